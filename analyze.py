@@ -0,0 +1,307 @@
+"""Reprocess many recordings with the current parser, on every core.
+
+Packets recorded by `proxy.py --record` are split into games: each recorded session is
+cut after every results packet, so a game and the lobby packets before it can be
+parsed on its own, by a fresh session.Session. Games are handed to a pool of worker
+processes in batches, and each worker runs them through proxy.process_packet, which
+decodes snapshots, collects live stats and encodes fumens exactly as the proxy does.
+Results are merged in the order the games ended in each recording, eg.
+
+    py ./analyze.py week1/*.rec --output games.jsonl
+
+writes a JSON line for every game, with every player's fumen and stats. Rates such as
+pieces per second are calculated from the recorded timestamps, so they are the same
+however fast games are reprocessed. Progress is reported on stderr as batches finish.
+
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from array import array
+from collections import defaultdict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import log
+import proxy
+from recording import HEADER, PACKET, Recording
+from session import Session
+
+RESULTS = b"%xt%results%"
+# stats that are rates over the last few seconds of wall clock time, which are
+# meaningless when reprocessing, they are replaced with rates over the whole game
+LIVE_RATES = ("pps", "lpm", "garbage_pm")
+BATCH_PACKETS = 20000  # packets in each batch of games sent to a worker
+
+GameShard = namedtuple("GameShard", "path session number offsets")
+GameShard.__doc__ = """The packets of one game, from a single recorded session.
+
+number counts the games in the session from 0, and offsets is an array of the
+positions of the game's packet records in the recording at path.
+
+"""
+
+# recordings opened by this worker process, path -> Recording
+RECORDINGS = {}
+
+
+def find_games(path):
+    """Split the packets of every session in a recording into games.
+
+    :returns: A list of GameShards, in the order the games ended. A session that ended
+              in the middle of a game has a final shard without a results packet.
+
+    """
+    shards = []
+    with Recording(path) as recording:
+        view = recording.view
+        games = {}  # session -> offsets of the packets in its current game
+        numbers = defaultdict(int)  # session -> games found so far
+        for pos in recording.offsets:
+            header = HEADER.unpack_from(view, pos)
+            if header[5] != PACKET:
+                continue
+            session = header[1]
+            offsets = games.get(session)
+            if offsets is None:
+                offsets = games[session] = array("Q")
+            offsets.append(pos)
+            start = pos + HEADER.size
+            if view[start : start + len(RESULTS)] == RESULTS:
+                shards.append(GameShard(path, session, numbers[session], offsets))
+                numbers[session] += 1
+                del games[session]
+        for session, offsets in games.items():
+            shards.append(GameShard(path, session, numbers[session], offsets))
+    return shards
+
+
+def batch_games(shards, batch_packets=BATCH_PACKETS):
+    """Group shards into batches of at least batch_packets packets, keeping order."""
+    batch = []
+    packets = 0
+    for shard in shards:
+        batch.append(shard)
+        packets += len(shard.offsets)
+        if packets >= batch_packets:
+            yield batch
+            batch = []
+            packets = 0
+    if batch:
+        yield batch
+
+
+def start_worker():
+    """Keep the parser's output out of the way, run as each worker process starts."""
+    log.configure(level=log.OFF)
+
+
+def game_result(shard, session, started, ended, finished):
+    """Return a dict of everything worked out about a game that has been parsed."""
+    duration = max(ended - started, 1e-9)
+    stats = session.stats.summary(ended)
+    players = {}
+    for player in sorted(set(stats) | set(session.encoders), key=str):
+        summary = stats.get(player, {})
+        for name in LIVE_RATES:
+            summary.pop(name, None)
+        if summary:
+            summary["pps"] = summary["pieces"] / duration
+            summary["lpm"] = summary["lines"] / duration * 60
+            summary["garbage_pm"] = summary["garbage"] / duration * 60
+        encoder = session.encoders.get(player)
+        summary["fumen"] = encoder.finish() if encoder is not None else None
+        players[player] = summary
+    return {
+        "recording": shard.path,
+        "session": shard.session,
+        "game": shard.number,
+        "finished": finished,
+        "started": started,
+        "duration": ended - started,
+        "players": players,
+    }
+
+
+def analyze_game(shard):
+    """Parse the packets of a game, returns a result dict, or None if no game started.
+
+    This is run in a worker process.
+
+    """
+    recording = RECORDINGS.get(shard.path)
+    if recording is None:
+        recording = RECORDINGS[shard.path] = Recording(shard.path, index=False)
+    session = Session(shard.session)
+    started = ended = None
+    for pos in shard.offsets:
+        record = recording.read(pos)
+        if session.game_started and record.data[: len(RESULTS)] == RESULTS:
+            # the results handler forgets the game, so collect it first
+            return game_result(shard, session, started, record.timestamp, True)
+        proxy.process_packet(record.data, record.origin, session, record.timestamp)
+        if started is None and session.game_started:
+            started = record.timestamp
+        ended = record.timestamp
+    if started is None:
+        return None
+    return game_result(shard, session, started, ended, False)
+
+
+def analyze_batch(shards):
+    """Parse a batch of games, returns (result dicts, packets parsed).
+
+    This is run in a worker process.
+
+    """
+    results = []
+    for shard in shards:
+        result = analyze_game(shard)
+        if result is not None:
+            results.append(result)
+    return results, sum(len(shard.offsets) for shard in shards)
+
+
+class AnalysisReport:
+    """Totals for a batch analysis."""
+
+    def __init__(self):
+        """Initialize an empty report."""
+        self.recordings = 0
+        self.games = 0
+        self.unfinished = 0
+        self.players = 0
+        self.packets = 0
+        self.elapsed = 0.0
+
+    def add(self, result):
+        """Count the result of a game."""
+        self.games += 1
+        self.unfinished += not result["finished"]
+        self.players += len(result["players"])
+
+    def print(self):
+        """Print the totals and throughput."""
+        elapsed = self.elapsed or float("nan")
+        print(
+            f"{self.recordings} recordings, {self.games:,} games "
+            f"({self.unfinished} unfinished), {self.players:,} players"
+        )
+        print(f"  packets:     {self.packets:,}")
+        print(f"  elapsed:     {self.elapsed:.2f}s")
+        print(f"  packets/sec: {self.packets / elapsed:,.0f}")
+
+
+class Progress:
+    """Report progress on stderr, at most every interval seconds."""
+
+    def __init__(self, total, interval=1.0, stream=None):
+        """Initialize progress for total packets."""
+        self.total = total
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    def update(self, packets, games, done=False):
+        """Report packets and games parsed so far."""
+        now = time.perf_counter()
+        if not done and now - self.last < self.interval:
+            return
+        self.last = now
+        rate = packets / max(now - self.start, 1e-9)
+        remaining = (self.total - packets) / rate if rate else float("inf")
+        self.stream.write(
+            f"\r{packets / max(self.total, 1):6.1%} {packets:,} packets, {games:,} "
+            f"games, {rate:,.0f} packets/sec, {remaining:.0f}s left "
+        )
+        if done:
+            self.stream.write("\n")
+        self.stream.flush()
+
+
+def analyze(paths, workers=None, output=None, progress=None, executor=None):
+    """Parse every game in some recordings across a pool of processes.
+
+    :param workers:  Number of worker processes, defaults to the number of cores
+    :param output:   File-like object to write a JSON line to for each game, in the
+                     order the games were recorded
+    :param progress: Report progress on stderr this often, in seconds
+    :param executor: Use this concurrent.futures executor instead of starting a
+                     process pool
+    :returns:        An AnalysisReport.
+
+    """
+    report = AnalysisReport()
+    start = time.perf_counter()
+    shards = []
+    for path in paths:
+        shards += find_games(path)
+        report.recordings += 1
+    batches = list(batch_games(shards))
+    tracker = None
+    if progress:
+        tracker = Progress(sum(len(shard.offsets) for shard in shards), progress)
+    pool = executor or ProcessPoolExecutor(workers, initializer=start_worker)
+    try:
+        tasks = {
+            pool.submit(analyze_batch, batch): i for i, batch in enumerate(batches)
+        }
+        finished = {}  # batch index -> results, waiting for the batches before them
+        merged = 0  # batches merged so far
+        pending = set(tasks)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for task in done:
+                results, packets = task.result()
+                finished[tasks[task]] = results
+                report.packets += packets
+            while merged in finished:
+                for result in finished.pop(merged):
+                    report.add(result)
+                    if output is not None:
+                        output.write(json.dumps(result) + "\n")
+                merged += 1
+            if tracker is not None:
+                tracker.update(report.packets, report.games)
+    finally:
+        if executor is None:
+            pool.shutdown()
+    if tracker is not None:
+        tracker.update(report.packets, report.games, done=True)
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def main():
+    """Analyze recordings and print a report."""
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument(
+        "recordings", nargs="+", help="files written by proxy.py --record"
+    )
+    arg_parser.add_argument(
+        "--workers", type=int, help=f"default: {os.cpu_count()}, one per core"
+    )
+    arg_parser.add_argument(
+        "--output", metavar="PATH", help="write a JSON line for every game to a file"
+    )
+    arg_parser.add_argument(
+        "--progress",
+        type=float,
+        default=1.0,
+        metavar="SECONDS",
+        help="report progress this often, 0 to never",
+    )
+    args = arg_parser.parse_args()
+    output = open(args.output, "w") if args.output else None
+    try:
+        report = analyze(args.recordings, args.workers, output, args.progress)
+    finally:
+        if output is not None:
+            output.close()
+    report.print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1259 @@
+"""Benchmark the proxy and its parsing pipeline.
+
+Everything here runs locally, against fakeserver.py or synthetic data, so no connection
+to the real Tetris Friends server is needed. Run a benchmark with eg.
+`py ./bench.py sessions --clients 200`, or `py ./bench.py -h` to list them.
+
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import io
+import itertools
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import tempfile
+import time
+import tracemalloc
+import zlib
+from importlib import reload
+from threading import Thread
+from xml.etree import ElementTree
+
+import analyze
+import dataset
+import dispatch
+import fumen
+import log
+import metrics
+import proxy
+import replay
+import snapshot
+from board import Board
+import tfparser
+from fakeserver import FakeServer, NULL_BYTE, SimulatedPlayer, room_list
+from framing import PacketFramer
+from export import GameExporter
+from hotreload import ModuleReloader
+from pipeline import POLICIES, ParsePipeline
+from recording import Recording, RecordingWriter
+from session import Session
+from simulator import Simulation
+from upstream import UpstreamPool
+
+LIVE_PIECE = b"%xt%livePiece%1%2%3%"
+# snapshots captured from real games
+SNAPSHOTS = [
+    "eNpjWEABYGiAAQQLjQdmJmUUVRYISTAwBCprOJYIAxkMoarOPkIyQAZDiIoLAxgkZTLAQCqclcIwwgAA"
+    "1cc+0w==",
+    "eNpjWEABaAACBhDRYGRhZMHg7MEQwJCclcHA4MIABCkMo4B0AACjLi2N",
+    "eNpjWEABaAACBhDRYGRhZMHg7FEYwJCclcHA4FJUV8GQwjAKSAcA6gEvZg==",
+]
+
+
+def snapshot_trace(frames, players=6):
+    """Return a list of (packet, origin) for a snapshot-heavy game.
+
+    The trace contains snapshots for every player, with a livePiece packet for every
+    snapshot, and ends with the results packet.
+
+    """
+    trace = []
+    snapshots = itertools.cycle(SNAPSHOTS)
+    for frame in range(frames):
+        player = frame % players
+        trace.append((LIVE_PIECE, "client"))
+        snapshot = f"%xt%snapShot%1%{player}%{next(snapshots)}%".encode()
+        trace.append((snapshot, "server"))
+    trace.append((b"%xt%results%1%", "server"))
+    return trace
+
+
+def lobby_trace(messages, rooms=40, users=30):
+    """Return a list of (packet, origin) for lobby traffic.
+
+    Every 100 messages contain one rmList and one joinOK, the rest are the uCount and
+    uVarsUpdate messages that the server sends whenever anybody moves around.
+
+    """
+    user_list = "".join(
+        f"<u i='{user}' m='0'><n><![CDATA[player{user}]]></n><vars>"
+        f"<var n='rank' t='n'><![CDATA[{user % 50}]]></var></vars></u>"
+        for user in range(users)
+    )
+    packets = [
+        room_list(rooms).decode(),
+        f"<msg t='sys'><body action='joinOK' r='1'><pid id='0'/><vars />"
+        f"<uLs r='1'>{user_list}</uLs></body></msg>",
+    ]
+    for i in range(98):
+        if i % 2:
+            packets.append(
+                f"<msg t='sys'><body action='uCount' r='{i}' u='{i % 6}'></body></msg>"
+            )
+        else:
+            packets.append(
+                f"<msg t='sys'><body action='uVarsUpdate' r='1'><user id='{i}' />"
+                "<vars><var n='status' t='n'><![CDATA[1]]></var></vars></body></msg>"
+            )
+    packets = [packet.encode() for packet in packets]
+    return [(packets[i % 100], "server") for i in range(messages)]
+
+
+def replay_trace(trace, parse):
+    """Run a trace through parse(packet, origin, session), returns packets/sec."""
+    session = Session(1)
+    start = time.perf_counter()
+    for packet, origin in trace:
+        parse(packet, origin, session)
+    log.flush()  # include the time taken to write anything that was logged
+    return len(trace) / (time.perf_counter() - start)
+
+
+async def session_client(port, packets):
+    """Connect through the proxy, returns (setup time, time to echo all packets)."""
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"<policy-file-request/>" + NULL_BYTE)
+    await reader.readuntil(NULL_BYTE)
+    setup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    writer.write((LIVE_PIECE + NULL_BYTE) * packets)
+    await writer.drain()
+    for _ in range(packets):
+        await reader.readuntil(NULL_BYTE)
+    writer.close()
+    return setup, time.perf_counter() - start
+
+
+async def run_sessions(clients, packets, pipeline=None):
+    """Run concurrent clients through an AsyncProxy in front of a FakeServer."""
+    server = FakeServer()
+    host, port = await server.start()
+    engine = proxy.AsyncProxy("127.0.0.1", host, 0, to_port=port, pipeline=pipeline)
+    engine.start()
+    engine.ready.wait()
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(session_client(engine.port, packets) for _ in range(clients))
+    )
+    elapsed = time.perf_counter() - start
+
+    engine.stop()
+    await server.close()
+    return results, elapsed
+
+
+def bench_sessions(args):
+    """Measure session setup and throughput with many concurrent clients."""
+    pipeline = None
+    if args.pipeline:
+        pipeline = ParsePipeline(proxy.process_packet, policy=args.pipeline)
+        pipeline.start()
+    results, elapsed = asyncio.run(run_sessions(args.clients, args.packets, pipeline))
+    setups = sorted(setup for setup, _ in results)
+    # every packet is parsed once on the way to the server and once on the way back
+    total_packets = 2 * args.clients * (args.packets + 1)
+    print(f"{args.clients} concurrent sessions, {args.packets} packets each")
+    print(f"  total time:     {elapsed:.3f}s")
+    print(f"  packets/sec:    {total_packets / elapsed:,.0f}")
+    print(f"  setup median:   {statistics.median(setups) * 1000:.2f}ms")
+    print(f"  setup p99:      {setups[int(len(setups) * 0.99) - 1] * 1000:.2f}ms")
+    if pipeline is not None:
+        print(f"  pipeline:       {pipeline.stats()}")
+        pipeline.stop()
+
+
+def bench_reload(args):
+    """Compare reloading the parser on every packet with reloading on change."""
+    trace = snapshot_trace(args.frames)
+
+    def reload_every_packet(packet, origin, session):
+        reload(tfparser)
+        tfparser.parse(packet, origin, session)
+
+    reloader = ModuleReloader(tfparser)
+
+    def reload_on_change(packet, origin, session):
+        reloader.get().parse(packet, origin, session)
+
+    before = replay_trace(trace, reload_every_packet)
+    after = replay_trace(trace, reload_on_change)
+    print(f"{len(trace)} packets, {args.frames} snapshots")
+    print(f"  reload every packet: {before:,.0f} packets/sec")
+    print(f"  reload on change:    {after:,.0f} packets/sec ({after / before:.1f}x)")
+
+
+def bench_xml(args):
+    """Compare parsing every sys message with routing them by their prefix."""
+    trace = lobby_trace(args.messages)
+
+    def parse_tree(packet, origin, session):
+        # how tfparser used to handle every XML packet
+        parser = ElementTree.XMLParser(encoding="utf-8")
+        elem = ElementTree.fromstring(str(packet, "utf-8"), parser=parser)
+        tfparser.sys_handler(elem[0], origin, session)
+
+    before = replay_trace(trace, parse_tree)
+    after = replay_trace(trace, tfparser.parse)
+    print(f"{len(trace)} lobby packets (rmList, joinOK, uCount, uVarsUpdate)")
+    print(f"  full parse:   {before:,.0f} packets/sec")
+    print(f"  prefix route: {after:,.0f} packets/sec ({after / before:.1f}x)")
+
+
+def unique_snapshots(count):
+    """Return count different snapshots, so that none of them are decoded from cache."""
+    raw = bytearray(snapshot.inflate(SNAPSHOTS[0]))
+    batch = []
+    for i in range(count):
+        raw[-4:] = i.to_bytes(4, "little")
+        batch.append(base64.b64encode(zlib.compress(raw)).decode())
+    return batch
+
+
+def decode_loop(data):
+    """Decode a snapshot the way snapshot.decode_snapshot used to."""
+    buffer = zlib.decompress(base64.b64decode(data))
+    pos = 1
+    field = []
+    for row in range(20):
+        field_row = []
+        for col in range(10):
+            mino_id = buffer[pos] >> 4
+            field_row.append(8 if mino_id > 8 else mino_id)
+            pos += 1
+        field.append(field_row)
+    return field
+
+
+def bench_snapshot(args):
+    """Compare the nested loop snapshot decoder with the lookup table decoders."""
+    batch = unique_snapshots(args.snapshots)
+    print(f"{len(batch)} snapshots, NumPy {'on' if snapshot.numpy else 'off'}")
+    snapshot.read_snapshot.cache_clear()
+    for name, decode in (
+        ("nested loop", lambda: [decode_loop(s) for s in batch]),
+        ("decode_snapshot", lambda: [snapshot.decode_snapshot(s) for s in batch]),
+        ("read_snapshot", lambda: [snapshot.read_snapshot(s) for s in batch]),
+        ("decode_snapshots", lambda: snapshot.decode_snapshots(batch)),
+    ):
+        start = time.perf_counter()
+        decode()
+        rate = len(batch) / (time.perf_counter() - start)
+        print(f"  {name + ':':18}{rate:10,.0f} snapshots/sec")
+
+
+def game_frames(count):
+    """Return count (Board, comment) frames of a game, with a snapshot every 0.5s."""
+    return [
+        (snapshot.decode_snapshot(data), time.strftime("%M:%S", time.gmtime(i / 2)))
+        for i, data in enumerate(unique_snapshots(count))
+    ]
+
+
+def bench_fumen(args):
+    """Measure fumen encoding and decoding for a whole game, and encoding by frame."""
+    frames = game_frames(args.frames)
+    list_frames = [(board.tolist(), comment) for board, comment in frames]
+    print(f"{args.frames} frame game")
+    for name, game in (("lists", list_frames), ("Boards", frames)):
+        start = time.perf_counter()
+        fumen.encode(game)
+        elapsed = time.perf_counter() - start
+        rate = args.frames / elapsed
+        print(f"  encode() {name + ':':8}{elapsed:7.3f}s {rate:9,.0f} frames/sec")
+
+    encoded = fumen.encode(frames)
+    for name, as_board in (("lists", False), ("Boards", True)):
+        start = time.perf_counter()
+        for _ in fumen.decode_frames(encoded, as_board):
+            pass
+        elapsed = time.perf_counter() - start
+        rate = args.frames / elapsed
+        print(f"  decode() {name + ':':8}{elapsed:7.3f}s {rate:9,.0f} frames/sec")
+
+    encoder = fumen.FumenEncoder()
+    latencies = []
+    for board, comment in frames:
+        start = time.perf_counter()
+        encoder.add_frame(board, comment)
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    encoder.finish()
+    finish = time.perf_counter() - start
+    latencies.sort()
+    print(f"  add_frame() median: {statistics.median(latencies) * 1e6:7.1f}us")
+    print(f"  add_frame() max:    {latencies[-1] * 1e6:7.1f}us")
+    print(f"  finish():           {finish * 1e6:7.1f}us")
+
+
+def stored_size(make_frames):
+    """Return the bytes allocated by make_frames() that are still alive afterwards."""
+    tracemalloc.start()
+    frames = make_frames()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del frames
+    return size
+
+
+def bench_memory(args):
+    """Measure the memory used to hold every frame of a game as lists and as Boards."""
+    count = int(args.minutes * 60 * args.rate * args.players)
+    base = bytearray(snapshot.read_snapshot(SNAPSHOTS[0]).minos)
+
+    def unique_cells():
+        # vary the top rows so that no two frames share their cells
+        for i in range(count):
+            base[-4:] = i.to_bytes(4, "little")
+            yield bytes(base)
+
+    def as_lists():
+        return [
+            ([list(cells[y : y + 10]) for y in range(0, 200, 10)], "00:00")
+            for cells in unique_cells()
+        ]
+
+    def as_boards():
+        return [(Board(cells), "00:00") for cells in unique_cells()]
+
+    lists = stored_size(as_lists)
+    boards = stored_size(as_boards)
+    print(
+        f"{args.minutes:g} minute game, {args.players} players, "
+        f"{args.rate:g} snapshots/sec each: {count:,} frames"
+    )
+    for name, size in (("list of lists", lists), ("Board", boards)):
+        megabytes = size / (1 << 20)
+        print(f"  {name + ':':15}{megabytes:6.1f}MB ({size / count:,.0f}B/frame)")
+
+
+class StreamSocket:
+    """Serve a bytes object through socket-style recv methods."""
+
+    def __init__(self, data):
+        """Initialize the socket with all of the data it will ever receive."""
+        self.stream = io.BytesIO(data)
+
+    def recv(self, size):
+        """Return up to size bytes."""
+        return self.stream.read(size)
+
+    def recv_into(self, buffer, size):
+        """Read up to size bytes into buffer, returns the number of bytes read."""
+        return self.stream.readinto(buffer[:size])
+
+
+def split_concat(sock):
+    """Split packets the way the recv loops used to, returns the number of packets."""
+    count = 0
+    buffer = b""
+    while True:
+        data = sock.recv(4096)
+        if not data:
+            return count
+        buffer += data
+        while NULL_BYTE in buffer:
+            packet, _, buffer = buffer.partition(NULL_BYTE)
+            count += 1
+
+
+def split_framer(sock):
+    """Split packets with a PacketFramer, returns the number of packets."""
+    count = 0
+    framer = PacketFramer()
+    while framer.recv_into(sock):
+        for packet in framer.frames():
+            count += 1
+    return count
+
+
+def bench_framing(args):
+    """Compare bytes concatenation with PacketFramer on synthetic streams."""
+    print(f"{args.megabytes}MB stream per packet size, received in 4096 byte chunks")
+    for size in (16, 256, 4096, 65536, 524288):
+        packet = b"x" * (size - 1) + NULL_BYTE
+        stream = packet * (args.megabytes * (1 << 20) // size)
+        results = []
+        for split in (split_concat, split_framer):
+            start = time.perf_counter()
+            split(StreamSocket(stream))
+            results.append(len(stream) / (time.perf_counter() - start) / (1 << 20))
+        print(
+            f"  {size:>6} byte packets: concat {results[0]:8,.1f}MB/s, "
+            f"framer {results[1]:8,.1f}MB/s"
+        )
+
+
+class SinkSocket:
+    """Count the bytes sent through a socket-style sendall method."""
+
+    def __init__(self):
+        """Initialize the socket with nothing sent."""
+        self.sent = 0
+
+    def sendall(self, data):
+        """Pretend to send data."""
+        self.sent += len(data)
+
+
+def forward_chunks(stream, forward):
+    """Time forward(framer, data, sink, session) for every chunk of a stream.
+
+    :returns: (the time taken for each chunk, the number of bytes forwarded)
+
+    """
+    sock = StreamSocket(stream)
+    sink = SinkSocket()
+    framer = PacketFramer()
+    session = Session(1)
+    times = []
+    while True:
+        start = time.perf_counter()
+        data = framer.recv_into(sock)
+        if not data:
+            break
+        forward(framer, data, sink, session)
+        times.append(time.perf_counter() - start)
+    return times, sink.sent
+
+
+def forward_raw(framer, data, sink, session):
+    """Forward the way the recv loops used to, the whole chunk after processing."""
+    for packet in framer.frames():
+        proxy.process_packet(packet, "server", session)
+    sink.sendall(data)
+
+
+def forward_filtered(framer, data, sink, session):
+    """Forward the way the recv loops do now, only packets the handlers approved."""
+    forward = proxy.filter_packets(framer, "server", session)
+    if forward:
+        sink.sendall(forward)
+
+
+def drop_packet(msg, origin, session):
+    """Drop every packet, subscribed by the filter benchmark."""
+    return dispatch.DROP
+
+
+def replace_packet(msg, origin, session):
+    """Replace every packet with a shorter one, subscribed by the filter benchmark."""
+    return b"%xt%livePiece%%"
+
+
+def bench_filter(args):
+    """Measure the latency added by filtering packets on the forwarding path."""
+    trace = snapshot_trace(args.frames)
+    stream = b"".join(packet + NULL_BYTE for packet, _ in trace)
+    print(f"{len(trace):,} packets, half of them snapshots, in 4096 byte chunks")
+    print(f"  best median of {args.rounds} rounds, run alternately")
+    forward_chunks(stream, forward_raw)  # warm up the snapshot cache
+    variants = {
+        "forward chunk (old):": (forward_raw, None),
+        "filter, all passed:": (forward_filtered, None),
+        "filter, livePiece dropped:": (forward_filtered, drop_packet),
+        "filter, livePiece replaced:": (forward_filtered, replace_packet),
+    }
+    medians = {name: float("inf") for name in variants}
+    sent = {}
+    for _ in range(args.rounds):
+        for name, (forward, handler) in variants.items():
+            if handler is not None:
+                dispatch.XT.subscribe("livePiece", handler)
+            times, sent[name] = forward_chunks(stream, forward)
+            if handler is not None:
+                dispatch.XT.unsubscribe("livePiece", handler)
+            medians[name] = min(medians[name], statistics.median(times))
+    baseline = medians["forward chunk (old):"]
+    for name, median in medians.items():
+        added = (median - baseline) * 1e6
+        verdict = "within" if added <= args.budget else "OVER"
+        print(
+            f"  {name:28}{median * 1e6:7.1f}us/chunk, {added:+6.1f}us "
+            f"({verdict} budget), {sent[name]:,} bytes forwarded"
+        )
+
+
+def bench_metrics(args):
+    """Measure the overhead of collecting metrics on the forwarding path."""
+    direction = metrics.Direction()
+    histogram = metrics.Histogram()
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        histogram.observe(0.0003)
+    observe = (time.perf_counter() - start) / args.calls
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        direction.forwarded(4096, 40, start)
+    forwarded = (time.perf_counter() - start) / args.calls
+    tracemalloc.start()
+    for _ in range(args.calls // 10):
+        direction.forwarded(4096, 40, start)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    trace = snapshot_trace(5000)
+    stream = b"".join(packet + NULL_BYTE for packet, _ in trace)
+    forward_chunks(stream, forward_filtered)  # warm up the snapshot cache
+    times, _ = forward_chunks(stream, forward_filtered)
+    chunk = statistics.median(times)
+    packets = len(trace) / len(times)
+    # every chunk is counted once, and every packet's parse time is observed once
+    overhead = forwarded + packets * observe
+    print(f"{args.calls:,} calls each")
+    print(f"  memory still allocated after {args.calls // 10:,} calls: {retained:,}B")
+    print(f"  Histogram.observe(): {observe * 1e9:6.0f}ns")
+    print(f"  Direction.forwarded(): {forwarded * 1e9:4.0f}ns")
+    print(
+        f"  per {len(stream) // len(times):,} byte chunk of {packets:.0f} packets: "
+        f"{overhead * 1e6:.1f}us of {chunk * 1e6:.1f}us ({overhead / chunk:.1%})"
+    )
+
+
+async def inject_client(port, packets):
+    """Connect to the proxy, then time injected packets while sending nothing."""
+    for _ in range(100):
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            break
+        except OSError:
+            await asyncio.sleep(0.01)  # the threaded proxy isn't listening yet
+    latencies = []
+    for _ in range(packets):
+        packet = await reader.readuntil(NULL_BYTE)
+        sent = float(packet.split(b"%")[3])
+        latencies.append(time.perf_counter() - sent)
+    writer.close()
+    return latencies
+
+
+def inject_packets(engine, packets, interval):
+    """Inject packets into the client of the proxy's current session."""
+    while engine.p2s is None or engine.p2s.injector.waker is None:
+        time.sleep(0.01)
+    for _ in range(packets):
+        time.sleep(interval)
+        packet = f"%xt%bench%{time.perf_counter()}%".encode() + NULL_BYTE
+        engine.p2s.injector.send(packet)
+
+
+async def run_inject(name, packets, interval):
+    """Measure injection latency through one of the proxy engines."""
+    if name == "thread":
+        # the threaded proxy connects to the port it listens on, so use another host
+        server = FakeServer("127.0.0.2")
+        host, port = await server.start()
+        engine = proxy.Proxy("127.0.0.1", host, port)
+        engine.daemon = True
+    else:
+        server = FakeServer()
+        host, port = await server.start()
+        engine = proxy.AsyncProxy("127.0.0.1", host, 0, to_port=port)
+    engine.start()
+    if name != "thread":
+        await asyncio.to_thread(engine.ready.wait)
+        port = engine.port
+    latencies, _ = await asyncio.gather(
+        inject_client(port, packets),
+        asyncio.to_thread(inject_packets, engine, packets, interval),
+    )
+    stats = engine.p2s.injector.stats()
+    if name != "thread":
+        engine.stop()
+    await server.close()
+    return latencies, stats
+
+
+def bench_inject(args):
+    """Measure how long injected packets take to reach a client that is idle."""
+    print(f"{args.packets} packets injected {args.interval}s apart, no other traffic")
+    for name in ("thread", "async"):
+        latencies, stats = asyncio.run(run_inject(name, args.packets, args.interval))
+        latencies.sort()
+        print(f"  {name} engine:")
+        print(f"    latency median: {statistics.median(latencies) * 1000:.3f}ms")
+        print(f"    latency max:    {latencies[-1] * 1000:.3f}ms")
+        print(f"    sent in {stats['writes']} writes")
+
+
+def numbered_stream(packets):
+    """Return a stream of different livePiece packets, about the size of snapshots."""
+    padding = "x" * 200
+    return b"".join(
+        f"%xt%livePiece%1%{i % 6}%{i:09}%{padding}%".encode() + NULL_BYTE
+        for i in range(packets)
+    )
+
+
+async def run_backpressure(name, stream, pause):
+    """Send stream through one of the proxy engines to a client that waits to read.
+
+    :returns: (the data the client received, seconds taken)
+
+    """
+
+    async def send_stream(reader, writer):
+        writer.write(stream)
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(send_stream, "127.0.0.1", 0)
+    host, port = server.sockets[0].getsockname()[:2]
+    if name == "thread":
+        engine = proxy.Proxy("127.0.0.1", host, 0, to_port=port)
+        engine.daemon = True  # it has no way to stop
+    else:
+        engine = proxy.AsyncProxy("127.0.0.1", host, 0, to_port=port)
+    engine.start()
+    await asyncio.to_thread(engine.ready.wait)
+    reader, writer = await asyncio.open_connection("127.0.0.1", engine.port)
+    start = time.perf_counter()
+    await asyncio.sleep(pause)  # the proxy's writes back up until the client reads
+    try:
+        received = await asyncio.wait_for(reader.readexactly(len(stream)), 30)
+    except asyncio.IncompleteReadError as exception:
+        received = exception.partial
+    elapsed = time.perf_counter() - start
+    writer.close()
+    if name != "thread":
+        engine.stop()
+    server.close()
+    return received, elapsed
+
+
+def bench_backpressure(args):
+    """Check that packets forwarded to a client that is slow to read arrive intact."""
+    stream = numbered_stream(args.packets)
+    expected = stream.split(NULL_BYTE)
+    print(
+        f"{args.packets:,} packets ({len(stream):,} bytes) from the server, the client "
+        f"waits {args.pause}s before reading"
+    )
+    for name in ("thread", "async"):
+        received, elapsed = asyncio.run(run_backpressure(name, stream, args.pause))
+        packets = received.split(NULL_BYTE)
+        corrupted = sum(a != b for a, b in zip(packets, expected))
+        lost = max(0, len(expected) - len(packets))
+        print(f"  {name} engine:")
+        print(f"    received:  {len(received):,} bytes in {elapsed:.2f}s")
+        print(f"    corrupted: {corrupted:,} packets, {lost:,} lost")
+        if received != stream:
+            raise AssertionError(f"The {name} engine forwarded a corrupted stream.")
+
+
+class SlowStream:
+    """A text stream that blocks for a while on every write, like a busy console."""
+
+    def __init__(self, delay):
+        """Initialize the stream, every write takes delay seconds."""
+        self.delay = delay
+
+    def write(self, text):
+        """Pretend to write text."""
+        time.sleep(self.delay)
+        return len(text)
+
+    def flush(self):
+        """Nothing to flush."""
+
+
+def print_frame(msg, origin, session):
+    """Print a line for every snapshot, the way tfparser used to."""
+    print(f"added frame for player {msg[3]} at 00:00")
+
+
+def bench_logging(args):
+    """Compare parsing throughput with logging off, on, and printing every frame."""
+    trace = snapshot_trace(args.frames)
+    sample = tfparser.FRAME_LOG_SAMPLE
+    devnull = open(os.devnull, "w")
+    console = SlowStream(args.write_delay / 1e6)
+    print(f"{len(trace):,} packets, half of them snapshots, in packets/sec")
+    print(f"  {'':26}{'devnull':>9}  {f'{args.write_delay:g}us writes':>14}")
+    for name, level, frame_sample in (
+        ("off:", log.OFF, sample),
+        ("info:", log.INFO, sample),
+        (f"debug, 1 in {sample} frames:", log.DEBUG, sample),
+        ("debug, every frame:", log.DEBUG, 1),
+        ("json, every frame:", log.DEBUG, 1),
+        ("print every frame (old):", log.OFF, sample),
+    ):
+        tfparser.FRAME_LOG_SAMPLE = frame_sample
+        if "print" in name:
+            dispatch.XT.subscribe("snapShot", print_frame)
+        rates = []
+        for stream in (devnull, console):
+            log.configure(stream, level, "json" if "json" in name else "text")
+            with contextlib.redirect_stdout(stream):
+                rates.append(replay_trace(trace, tfparser.parse))
+        dispatch.XT.unsubscribe("snapShot", print_frame)
+        print(f"  {name:26}{rates[0]:9,.0f}  {rates[1]:14,.0f}")
+    tfparser.FRAME_LOG_SAMPLE = sample
+    log.configure(level=log.OFF)
+    devnull.close()
+
+
+def write_recording(path, trace, sessions, rate):
+    """Record a trace as if it was played by sessions clients, rate packets/sec each."""
+    with RecordingWriter(path) as writer:
+        for i, (packet, origin) in enumerate(trace):
+            for session in range(1, sessions + 1):
+                writer.write_packet(session, origin, packet, i / rate)
+
+
+def bench_replay(args):
+    """Replay a recorded game straight to the parser and through the proxy."""
+    trace = snapshot_trace(args.frames)
+    path = os.path.join(tempfile.mkdtemp(), "bench.rec")
+    write_recording(path, trace, args.sessions, args.rate)
+    duration = len(trace) / args.rate
+    print(
+        f"{args.sessions} sessions of {len(trace):,} packets, recorded over "
+        f"{duration:.1f}s, replayed at {args.speed or 'max'} speed"
+    )
+    with Recording(path) as recording:
+        reports = [replay.replay(recording, args.speed)]
+        replayer = replay.NetworkReplay(recording, args.speed)
+        reports += asyncio.run(replayer.run())
+        del replayer
+    for report in reports:
+        report.print()
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+def play_games(games, trace):
+    """Parse a copy of trace for each session in games, one packet from each in turn."""
+    for packets in zip(*([trace] * len(games))):
+        for session, (packet, origin) in zip(games, packets):
+            with session.lock:
+                proxy.process_packet(packet, origin, session)
+
+
+def bench_games(args):
+    """Measure parsing many simultaneous games, and check they are kept separate."""
+    trace = snapshot_trace(args.frames)[:-1]  # leave the games running to check them
+    print(f"{args.games} games of {len(trace):,} packets each, in packets/sec")
+    for name, threads in (("1 thread:", 1), (f"{args.games} threads:", args.games)):
+        games = [Session(session_id) for session_id in range(args.games)]
+        workers = [
+            Thread(target=play_games, args=(games[i :: threads], trace))
+            for i in range(threads)
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        rate = args.games * len(trace) / (time.perf_counter() - start)
+        frames = [
+            sum(
+                sum(1 for _ in fumen.decode_frames(encoder.finish()))
+                for encoder in game.encoders.values()
+            )
+            for game in games
+        ]
+        separate = all(count == args.frames for count in frames)
+        print(
+            f"  {name:12}{rate:9,.0f}, "
+            f"{'every game kept its own' if separate else 'games mixed up, got'} "
+            f"{frames[0]:,} frames"
+        )
+
+
+def bench_export(args):
+    """Measure parsing games and their results packets, with and without export."""
+    trace = snapshot_trace(args.frames)
+    print(
+        f"{args.games} games of {args.frames:,} snapshots from 6 players, "
+        "in 6 player games"
+    )
+    for name in ("encoded inline:", "exported:"):
+        directory = tempfile.mkdtemp()
+        exporter = None
+        if name == "exported:":
+            exporter = GameExporter(directory, args.workers, args.limit)
+        stalls = []
+        parsing = 0.0
+        start = time.perf_counter()
+        for game in range(args.games):
+            session = Session(game, exporter=exporter)
+            stall = time.perf_counter()
+            for packet, origin in trace[:-1]:
+                proxy.process_packet(packet, origin, session)
+            parsing += time.perf_counter() - stall
+            stall = time.perf_counter()
+            if exporter is None:
+                # how results were handled before, with fumens written to files
+                for player_id, encoder in session.encoders.items():
+                    path = os.path.join(directory, f"{game}-{player_id}.txt")
+                    with open(path, "w") as file:
+                        file.write(encoder.finish())
+                session.end_game()
+            else:
+                proxy.process_packet(trace[-1][0], "server", session)
+            stalls.append(time.perf_counter() - stall)
+        if exporter is not None:
+            exporter.close()
+        elapsed = time.perf_counter() - start
+        print(f"  {name}")
+        rate = args.games * len(trace) / parsing
+        print(f"    during games:   {rate:,.0f} packets/sec")
+        print(f"    results median: {statistics.median(stalls) * 1000:.2f}ms")
+        print(f"    results max:    {max(stalls) * 1000:.2f}ms")
+        print(f"    all games written in {elapsed:.2f}s")
+        # check every frame of every game made it into the fumens
+        frames = 0
+        for file_name in os.listdir(directory):
+            path = os.path.join(directory, file_name)
+            with open(path) as file:
+                frames += sum(1 for _ in fumen.decode_frames(file.read().strip()))
+            os.remove(path)
+        os.rmdir(directory)
+        if frames != args.games * args.frames:
+            raise AssertionError(
+                f"{name} wrote {frames:,} frames, not {args.games * args.frames:,}"
+            )
+
+
+def record_games(path, sessions, games, frames, players=6):
+    """Record sessions that each play games, with frames snapshots from each player.
+
+    Every snapshot is of a simulated player's board, so few of them repeat, and
+    sessions are interleaved like they are when recorded by the proxy.
+
+    """
+    rng = random.Random(path)
+    with RecordingWriter(path) as writer:
+        for game in range(games):
+            simulated = [
+                [SimulatedPlayer(player, rng) for player in range(players)]
+                for _ in range(sessions)
+            ]
+            for frame in range(frames):
+                timestamp = game * frames + frame / 2
+                for session, session_players in enumerate(simulated, 1):
+                    for player in session_players:
+                        player.place_piece()
+                        live_piece = f"%xt%livePiece%1%{player.player_id}%0%".encode()
+                        snap = (
+                            f"%xt%snapShot%1%{player.player_id}%"
+                            f"{player.snapshot()}%"
+                        ).encode()
+                        writer.write_packet(session, "client", live_piece, timestamp)
+                        writer.write_packet(session, "server", snap, timestamp)
+            for session in range(1, sessions + 1):
+                writer.write_packet(session, "server", b"%xt%results%1%", timestamp)
+
+
+def bench_analyze(args):
+    """Measure reprocessing recordings one packet at a time and across processes."""
+    directory = tempfile.mkdtemp()
+    paths = [os.path.join(directory, f"{i}.rec") for i in range(args.recordings)]
+    for path in paths:
+        record_games(path, args.sessions, args.games, args.frames)
+    games = args.recordings * args.sessions * args.games
+    print(
+        f"{args.recordings} recordings of {args.sessions} sessions playing "
+        f"{args.games} games, {games} games of {args.frames:,} frames from 6 players, "
+        f"on {os.cpu_count()} cores"
+    )
+    start = time.perf_counter()
+    packets = 0
+    for path in paths:
+        with Recording(path) as recording:
+            packets += len(replay.replay(recording).latencies)
+    baseline = packets / (time.perf_counter() - start)
+    print(f"  {'replay.replay():':20}{baseline:10,.0f} packets/sec")
+    single = None
+    for workers in args.workers:
+        report = analyze.analyze(paths, workers)
+        rate = report.packets / report.elapsed
+        single = single or rate
+        print(
+            f"  {f'{workers} workers:':20}{rate:10,.0f} packets/sec, "
+            f"{rate / single:.2f}x, {rate / single / workers:.0%} per worker"
+        )
+    for path in paths:
+        os.remove(path)
+    os.rmdir(directory)
+
+
+def record_boards(path, games, frames, players=6):
+    """Record games of simulated players' boards, frames boards from each player."""
+    rng = random.Random(0)
+    with RecordingWriter(path) as writer:
+        for game in range(1, games + 1):
+            simulated = [SimulatedPlayer(player, rng) for player in range(players)]
+            for frame in range(frames):
+                for player in simulated:
+                    player.place_piece()
+                    writer.write_board(
+                        1,
+                        game,
+                        player.player_id,
+                        Board(player.cells),
+                        player.incoming_lines,
+                        frame / 2,
+                    )
+
+
+def bench_dataset(args):
+    """Compare exporting recorded games as fumens and as a columnar dataset."""
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "bench.rec")
+    record_boards(path, args.games, args.frames)
+    boards = args.games * args.frames * 6
+    print(
+        f"{args.games} games of {args.frames:,} boards from 6 players, "
+        f"{boards:,} boards, NumPy {'on' if dataset.numpy else 'off'}"
+    )
+    with Recording(path) as recording:
+        tracemalloc.start()
+        start = time.perf_counter()
+        fumens = [
+            recording.export_fumen(game, player)
+            for game in recording.games()
+            for player in recording.players(game)
+        ]
+        write_rate = boards / (time.perf_counter() - start)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        size = sum(len(text) for text in fumens)
+        start = time.perf_counter()
+        for text in fumens:
+            for _ in fumen.decode_frames(text):
+                pass
+        read_rate = boards / (time.perf_counter() - start)
+        del fumens
+        print(f"  {'':15}{'write/sec':>10}{'read/sec':>11}{'size':>10}{'peak':>10}")
+        print(
+            f"  {'fumen:':15}{write_rate:10,.0f}{read_rate:11,.0f}"
+            f"{size / 2 ** 20:8.1f}MB{peak / 2 ** 20:8.1f}MB"
+        )
+
+        output = os.path.join(directory, "dataset")
+        tracemalloc.start()
+        start = time.perf_counter()
+        writer = dataset.export_recording(recording, output, args.shard_frames)
+        write_rate = boards / (time.perf_counter() - start)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        size = sum(os.path.getsize(shard) for shard in writer.shards)
+        start = time.perf_counter()
+        for shard in writer.shards:
+            dataset.load_shard(shard)
+        read_rate = boards / (time.perf_counter() - start)
+        print(
+            f"  {'dataset:':15}{write_rate:10,.0f}{read_rate:11,.0f}"
+            f"{size / 2 ** 20:8.1f}MB{peak / 2 ** 20:8.1f}MB"
+        )
+        print(f"  {len(writer.shards)} shards of about {args.shard_frames:,} boards")
+    for shard in writer.shards:
+        os.remove(shard)
+    os.rmdir(output)
+    os.remove(path)
+    os.rmdir(directory)
+
+
+class DistantPool(UpstreamPool):
+    """An UpstreamPool whose connections take a round trip to a distant server."""
+
+    def __init__(self, host, port, size, rtt):
+        """Initialize the pool, rtt is the round trip time in seconds."""
+        super(DistantPool, self).__init__(host, port, size)
+        self.rtt = rtt
+
+    def connect(self):
+        """Connect after a round trip, like connecting to the real server."""
+        time.sleep(self.rtt)
+        return super(DistantPool, self).connect()
+
+
+def time_to_first_byte(port):
+    """Connect to the proxy and request the policy file, returns seconds to a reply."""
+    start = time.perf_counter()
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(b"<policy-file-request/>" + NULL_BYTE)
+        sock.recv(4096)
+        return time.perf_counter() - start
+
+
+async def run_connect(clients, interval, size, rtt):
+    """Time to first byte of clients connecting one after another to a Proxy."""
+    server = FakeServer()
+    host, port = await server.start()
+    pool = DistantPool(host, port, size, rtt)
+    pool.start()
+    engine = proxy.Proxy("127.0.0.1", host, 0, to_port=port, pool=pool)
+    engine.daemon = True  # it has no way to stop
+    engine.start()
+    await asyncio.to_thread(engine.ready.wait)
+    await asyncio.sleep(interval)  # let the pool fill
+    times = []
+    for _ in range(clients):
+        times.append(await asyncio.to_thread(time_to_first_byte, engine.port))
+        await asyncio.sleep(interval)
+    pool.close()
+    await server.close()
+    return times, pool.stats()
+
+
+def bench_connect(args):
+    """Measure the time to first byte of new clients, with and without a warm pool."""
+    rtt = args.rtt / 1000
+    print(
+        f"{args.clients} clients connecting {args.interval}s apart to the threaded "
+        f"proxy, {args.rtt}ms connecting to the server"
+    )
+    for size in (0, args.pool):
+        times, stats = asyncio.run(run_connect(args.clients, args.interval, size, rtt))
+        name = "connect per client:" if size == 0 else f"pool of {size}:"
+        print(f"  {name}")
+        print(f"    first byte median: {statistics.median(times) * 1000:.3f}ms")
+        print(f"    first byte max:    {max(times) * 1000:.3f}ms")
+        print(f"    pool: {stats}")
+
+
+def run_fake_server(connection, players, rate):
+    """Run a FakeServer in a child process, sending its port back over connection."""
+
+    async def serve():
+        server = FakeServer(players=players, rate=rate, game_length=3600)
+        _, port = await server.start()
+        connection.send(port)
+        # run until the parent closes the connection
+        await asyncio.to_thread(connection.recv)
+
+    with contextlib.suppress(EOFError):
+        asyncio.run(serve())
+
+
+def resident_memory():
+    """Return the resident memory of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # no /proc, the peak is the best there is
+        import resource  # pylint: disable=import-outside-toplevel
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_proxy(connection, server_port):
+    """Run an AsyncProxy in a child process, answering requests for its memory."""
+    log.configure(level=log.OFF)
+    engine = proxy.AsyncProxy("127.0.0.1", "127.0.0.1", 0, to_port=server_port)
+    engine.start()
+    engine.ready.wait()
+    connection.send(engine.port)
+    with contextlib.suppress(EOFError):
+        while connection.recv() is not None:
+            connection.send(resident_memory())
+    engine.stop()
+
+
+def start_child(target, *args):
+    """Start target(connection, *args) in a child process, returns (process, port)."""
+    connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=target, args=(child_connection, *args), daemon=True
+    )
+    process.start()
+    return process, connection, connection.recv()
+
+
+def bench_load(args):
+    """Measure the latency the proxy adds, and its memory, as the load increases."""
+    server, server_connection, server_port = start_child(
+        run_fake_server, args.players, args.rate
+    )
+    engine, proxy_connection, proxy_port = start_child(run_proxy, server_port)
+    proxy_connection.send("memory")
+    baseline = proxy_connection.recv()
+    print(
+        f"every client watches {args.players} players placing {args.rate} pieces/sec "
+        f"for {args.duration}s, and places its own pieces"
+    )
+    print(f"  proxy memory at start: {baseline / 2 ** 20:.1f}MB")
+    print(
+        f"  {'clients':>7} {'offered/s':>10} {'delivered/s':>11} {'p50 added':>10} "
+        f"{'p99 added':>10} {'direct p99':>10} {'memory':>8}"
+    )
+    sustainable = 0
+    for clients in args.clients:
+        # every piece is a livePiece and a snapShot
+        offered = clients * args.players * args.rate * 2
+        reports = []
+        for port in (server_port, proxy_port):
+            simulation = Simulation(
+                "127.0.0.1", port, clients, args.duration, args.rate
+            )
+            reports.append(asyncio.run(simulation.run()))
+        direct, proxied = reports
+        proxy_connection.send("memory")
+        memory = proxy_connection.recv()
+        delivered = (
+            proxied.commands["livePiece"] + proxied.commands["snapShot"]
+        ) / args.duration
+        p50 = proxied.percentile(0.5) - direct.percentile(0.5)
+        p99 = proxied.percentile(0.99) - direct.percentile(0.99)
+        if delivered >= offered * 0.95 and p99 * 1000 <= args.budget:
+            sustainable = clients
+        print(
+            f"  {clients:7} {offered:10,.0f} {delivered:11,.0f} {p50 * 1000:8.3f}ms "
+            f"{p99 * 1000:8.3f}ms {direct.percentile(0.99) * 1000:8.3f}ms "
+            f"{(memory - baseline) / 2 ** 20:+6.1f}MB"
+        )
+    if sustainable:
+        print(
+            f"  sustained {sustainable} clients, delivering 95% of packets with "
+            f"under {args.budget}ms added p99 latency"
+        )
+    else:
+        print(f"  no load was sustained with under {args.budget}ms added p99 latency")
+    proxy_connection.close()
+    server_connection.close()
+    engine.join(5)
+    server.join(5)
+
+
+def main():
+    """Run the benchmark named on the command line."""
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = arg_parser.add_subparsers(required=True)
+
+    sessions = subparsers.add_parser("sessions", help=bench_sessions.__doc__)
+    sessions.add_argument("--clients", type=int, default=200)
+    sessions.add_argument("--packets", type=int, default=50)
+    sessions.add_argument("--pipeline", choices=POLICIES)
+    sessions.set_defaults(func=bench_sessions)
+
+    reload_parser = subparsers.add_parser("reload", help=bench_reload.__doc__)
+    reload_parser.add_argument("--frames", type=int, default=5000)
+    reload_parser.set_defaults(func=bench_reload)
+
+    xml = subparsers.add_parser("xml", help=bench_xml.__doc__)
+    xml.add_argument("--messages", type=int, default=20000)
+    xml.set_defaults(func=bench_xml)
+
+    snapshots = subparsers.add_parser("snapshot", help=bench_snapshot.__doc__)
+    snapshots.add_argument("--snapshots", type=int, default=50000)
+    snapshots.set_defaults(func=bench_snapshot)
+
+    fumens = subparsers.add_parser("fumen", help=bench_fumen.__doc__)
+    fumens.add_argument("--frames", type=int, default=5000)
+    fumens.set_defaults(func=bench_fumen)
+
+    memory = subparsers.add_parser("memory", help=bench_memory.__doc__)
+    memory.add_argument("--minutes", type=float, default=10)
+    memory.add_argument("--players", type=int, default=6)
+    memory.add_argument("--rate", type=float, default=2, help="snapshots/sec")
+    memory.set_defaults(func=bench_memory)
+
+    framing = subparsers.add_parser("framing", help=bench_framing.__doc__)
+    framing.add_argument("--megabytes", type=int, default=8)
+    framing.set_defaults(func=bench_framing)
+
+    replays = subparsers.add_parser("replay", help=bench_replay.__doc__)
+    replays.add_argument("--frames", type=int, default=2000)
+    replays.add_argument("--sessions", type=int, default=4)
+    replays.add_argument("--rate", type=float, default=20, help="packets/sec")
+    replays.add_argument("--speed", type=float, help="default is as fast as possible")
+    replays.set_defaults(func=bench_replay)
+
+    injects = subparsers.add_parser("inject", help=bench_inject.__doc__)
+    injects.add_argument("--packets", type=int, default=20)
+    injects.add_argument("--interval", type=float, default=0.1)
+    injects.set_defaults(func=bench_inject)
+
+    backpressures = subparsers.add_parser(
+        "backpressure", help=bench_backpressure.__doc__
+    )
+    backpressures.add_argument("--packets", type=int, default=150000)
+    backpressures.add_argument("--pause", type=float, default=3.0, metavar="SECONDS")
+    backpressures.set_defaults(func=bench_backpressure)
+
+    filters = subparsers.add_parser("filter", help=bench_filter.__doc__)
+    filters.add_argument("--frames", type=int, default=5000)
+    filters.add_argument("--rounds", type=int, default=5)
+    filters.add_argument("--budget", type=float, default=50, help="microseconds")
+    filters.set_defaults(func=bench_filter)
+
+    metric = subparsers.add_parser("metrics", help=bench_metrics.__doc__)
+    metric.add_argument("--calls", type=int, default=1000000)
+    metric.set_defaults(func=bench_metrics)
+
+    logs = subparsers.add_parser("logging", help=bench_logging.__doc__)
+    logs.add_argument("--frames", type=int, default=10000)
+    logs.add_argument("--write-delay", type=float, default=50, help="microseconds")
+    logs.set_defaults(func=bench_logging)
+
+    game = subparsers.add_parser("games", help=bench_games.__doc__)
+    game.add_argument("--games", type=int, default=4)
+    game.add_argument("--frames", type=int, default=2000)
+    game.set_defaults(func=bench_games)
+
+    exports = subparsers.add_parser("export", help=bench_export.__doc__)
+    exports.add_argument("--games", type=int, default=10)
+    exports.add_argument("--frames", type=int, default=7200, help="10 minute games")
+    exports.add_argument("--workers", type=int, default=2)
+    exports.add_argument("--limit", type=int, default=4)
+    exports.set_defaults(func=bench_export)
+
+    analyzes = subparsers.add_parser("analyze", help=bench_analyze.__doc__)
+    analyzes.add_argument("--recordings", type=int, default=4)
+    analyzes.add_argument("--sessions", type=int, default=2)
+    analyzes.add_argument("--games", type=int, default=2)
+    analyzes.add_argument("--frames", type=int, default=300)
+    analyzes.add_argument(
+        "--workers",
+        type=lambda text: [int(count) for count in text.split(",")],
+        default=[1, 2, 4, 8],
+        help="comma separated numbers of workers, default: 1,2,4,8",
+    )
+    analyzes.set_defaults(func=bench_analyze)
+
+    datasets = subparsers.add_parser("dataset", help=bench_dataset.__doc__)
+    datasets.add_argument("--games", type=int, default=20)
+    datasets.add_argument("--frames", type=int, default=1200, help="10 minute games")
+    datasets.add_argument("--shard-frames", type=int, default=65536)
+    datasets.set_defaults(func=bench_dataset)
+
+    connects = subparsers.add_parser("connect", help=bench_connect.__doc__)
+    connects.add_argument("--clients", type=int, default=20)
+    connects.add_argument("--interval", type=float, default=0.1, metavar="SECONDS")
+    connects.add_argument("--pool", type=int, default=2)
+    connects.add_argument(
+        "--rtt", type=float, default=20, help="milliseconds to connect to the server"
+    )
+    connects.set_defaults(func=bench_connect)
+
+    loads = subparsers.add_parser("load", help=bench_load.__doc__)
+    loads.add_argument(
+        "--clients",
+        type=lambda text: [int(count) for count in text.split(",")],
+        default=[1, 10, 50, 100, 200],
+        help="comma separated numbers of clients, default: 1,10,50,100,200",
+    )
+    loads.add_argument("--duration", type=float, default=5.0, metavar="SECONDS")
+    loads.add_argument("--players", type=int, default=6)
+    loads.add_argument("--rate", type=float, default=2.0, help="pieces/sec")
+    loads.add_argument("--budget", type=float, default=5.0, help="milliseconds")
+    loads.set_defaults(func=bench_load)
+
+    args = arg_parser.parse_args()
+    log.configure(level=log.OFF)  # keep the parser's output out of the timings
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Store Tetris Friends fields compactly.
+
+A field is 20 rows of 10 cells, each cell holding a mino id (0 for an empty cell, 8
+for garbage). Boards keep these as 200 bytes instead of 20 lists of Python ints, so
+they are cheap to keep around for every frame of a long game, and can be compared and
+hashed directly.
+
+"""
+
+HEIGHT = 20
+WIDTH = 10
+CELLS = HEIGHT * WIDTH
+
+
+class Board:
+    """An immutable 20x10 field, stored as bytes one row at a time from the bottom.
+
+    Indexing a board returns a read only memoryview of a row, so board[y][x] works the
+    same as it does for a list of rows.
+
+    """
+
+    __slots__ = ("cells",)
+
+    def __init__(self, cells=None):
+        """Initialize the board from 200 bytes-like cells, or an empty board."""
+        if cells is None:
+            cells = bytes(CELLS)
+        elif len(cells) != CELLS:
+            raise ValueError(f"Board must have {CELLS} cells, got {len(cells)}.")
+        self.cells = bytes(cells)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Create a board from a list of rows, starting at the bottom.
+
+        Fewer than 20 rows can be given, the rows above them are empty.
+
+        """
+        if len(rows) > HEIGHT:
+            raise ValueError(f"Board can't have more than {HEIGHT} rows.")
+        cells = bytearray(CELLS)
+        for y, row in enumerate(rows):
+            cells[y * WIDTH : (y + 1) * WIDTH] = bytes(row)
+        return cls(cells)
+
+    def row(self, y):
+        """Return a view of row y, counting from the bottom."""
+        if not 0 <= y < HEIGHT:
+            raise IndexError("Board row out of range.")
+        return memoryview(self.cells)[y * WIDTH : (y + 1) * WIDTH]
+
+    def rows_from_top(self):
+        """Return the cells as bytes, one row at a time from the top."""
+        return b"".join(
+            self.cells[y : y + WIDTH] for y in range(CELLS - WIDTH, -1, -WIDTH)
+        )
+
+    def tolist(self):
+        """Return the board as a list of rows of ints, starting at the bottom."""
+        return [list(self.cells[y : y + WIDTH]) for y in range(0, CELLS, WIDTH)]
+
+    def __getitem__(self, y):
+        if y < 0:
+            y += HEIGHT
+        return self.row(y)
+
+    def __len__(self):
+        return HEIGHT
+
+    def __iter__(self):
+        view = memoryview(self.cells)
+        return (view[y : y + WIDTH] for y in range(0, CELLS, WIDTH))
+
+    def __eq__(self, other):
+        if not isinstance(other, Board):
+            return NotImplemented
+        return self.cells == other.cells
+
+    def __hash__(self):
+        return hash(self.cells)
+
+    def __repr__(self):
+        return f"Board.from_rows({self.tolist()!r})"
@@ -0,0 +1,230 @@
+"""Export recorded games as a columnar dataset, eg. for training a ML model.
+
+Every board in a recording (see recording.py) becomes a row, and rows are written to
+compressed NumPy .npz shards of roughly shard_frames rows each, with these columns:
+* boards:         uint8 (n, 20, 10), mino ids from the bottom row up, as in Board
+* timestamps:     float64 (n,), seconds since the epoch the board was received
+* sessions:       uint32 (n,), session the game was played in
+* games:          uint32 (n,), game id, unique across sessions
+* players:        uint32 (n,), player id
+* incoming_lines: uint8 (n,), garbage waiting to rise under the board
+
+Rows are grouped by game, then by player, in the order they were received, and a game
+is never split across shards. Games are read from the recording and written one at a
+time, so exporting millions of frames only ever holds a single shard in memory. eg.
+
+    py ./dataset.py games.rec dataset/
+
+NumPy is used to write the shards if it is installed. Without it they are written in
+exactly the same format by this module, and load_shard() reads them back, either as
+NumPy arrays or as shaped memoryviews.
+
+"""
+import argparse
+import ast
+import os
+import sys
+import zipfile
+from array import array
+from collections import defaultdict
+
+from board import HEIGHT, WIDTH
+from recording import Recording
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ORDER = "<" if sys.byteorder == "little" else ">"
+UINT32 = f"u{array('I').itemsize}"
+# NumPy dtype, without the byte order -> array typecode
+TYPECODES = {"u1": "B", "f8": "d", UINT32: "I"}
+# name -> (NumPy dtype, shape of each row)
+COLUMNS = {
+    "boards": ("|u1", (HEIGHT, WIDTH)),
+    "timestamps": (f"{ORDER}f8", ()),
+    "sessions": (ORDER + UINT32, ()),
+    "games": (ORDER + UINT32, ()),
+    "players": (ORDER + UINT32, ()),
+    "incoming_lines": ("|u1", ()),
+}
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+DEFAULT_SHARD_FRAMES = 65536  # about 13MB of boards before compression
+
+
+def npy_header(descr, shape):
+    """Return the header of a version 1.0 .npy file, padded like NumPy pads it."""
+    if len(shape) == 1:
+        shape_text = f"({shape[0]},)"
+    else:
+        shape_text = f"({', '.join(str(size) for size in shape)})"
+    text = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': {shape_text}, }}"
+    # the data starts on a multiple of 64 bytes, after a newline
+    padding = -(len(NPY_MAGIC) + 2 + len(text) + 1) % 64
+    text += " " * padding + "\n"
+    return NPY_MAGIC + len(text).to_bytes(2, "little") + text.encode("latin1")
+
+
+def read_npy(data):
+    """Return the (descr, shape, raw data) of a .npy file's bytes."""
+    if data[: len(NPY_MAGIC)] != NPY_MAGIC:
+        raise ValueError("Not a version 1.0 .npy file.")
+    start = len(NPY_MAGIC) + 2
+    end = start + int.from_bytes(data[len(NPY_MAGIC) : start], "little")
+    header = ast.literal_eval(data[start:end].decode("latin1"))
+    return header["descr"], header["shape"], data[end:]
+
+
+def load_shard(path):
+    """Read a shard, returns {column name: values}.
+
+    Values are NumPy arrays if NumPy is installed, otherwise memoryviews, with boards
+    cast to shape (n, 20, 10).
+
+    """
+    if numpy is not None:
+        with numpy.load(path) as shard:
+            return {name: shard[name] for name in shard.files}
+    columns = {}
+    with zipfile.ZipFile(path) as shard:
+        for name in shard.namelist():
+            descr, shape, raw = read_npy(shard.read(name))
+            values = array(TYPECODES[descr[1:]], raw)
+            if descr[0] not in (ORDER, "|"):
+                values.byteswap()
+            view = memoryview(values)
+            if len(shape) > 1 and shape[0]:
+                view = view.cast("B", shape)
+            columns[name[: -len(".npy")]] = view
+    return columns
+
+
+class DatasetWriter:
+    """Write rows to shards, each holding whole games."""
+
+    def __init__(self, directory, shard_frames=DEFAULT_SHARD_FRAMES):
+        """Initialize the writer, directory is created if needed.
+
+        :param shard_frames: A shard is written once it has at least this many rows
+
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_frames = shard_frames
+        self.columns = {}
+        self.rows = 0  # rows in the current shard
+        self.shards = []  # paths of the shards written
+        self.frames = 0  # rows in every shard written
+        self.reset()
+
+    def reset(self):
+        """Start a new, empty shard."""
+        self.columns = {
+            name: bytearray() if name == "boards" else array(TYPECODES[dtype[1:]])
+            for name, (dtype, _) in COLUMNS.items()
+        }
+        self.rows = 0
+
+    def write_board(self, session, game, player, cells, incoming_lines, timestamp):
+        """Add a row, cells are the 200 bytes of a board."""
+        columns = self.columns
+        columns["boards"] += cells
+        columns["timestamps"].append(timestamp)
+        columns["sessions"].append(session)
+        columns["games"].append(game)
+        columns["players"].append(player)
+        columns["incoming_lines"].append(incoming_lines)
+        self.rows += 1
+
+    def end_game(self):
+        """Write the shard if it is full, so games are never split between shards."""
+        if self.rows >= self.shard_frames:
+            self.flush()
+
+    def flush(self):
+        """Write the current shard, if it has any rows."""
+        if not self.rows:
+            return
+        path = os.path.join(self.directory, f"shard-{len(self.shards):05}.npz")
+        # write to a temporary file, so a shard that exists is always complete
+        with open(path + ".tmp", "wb") as file:
+            if numpy is not None:
+                arrays = {}
+                for name, values in self.columns.items():
+                    dtype, shape = COLUMNS[name]
+                    arrays[name] = numpy.frombuffer(values, dtype).reshape(
+                        (self.rows, *shape)
+                    )
+                numpy.savez_compressed(file, **arrays)
+            else:
+                with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as shard:
+                    for name, values in self.columns.items():
+                        dtype, shape = COLUMNS[name]
+                        with shard.open(f"{name}.npy", "w") as npy:
+                            npy.write(npy_header(dtype, (self.rows, *shape)))
+                            npy.write(memoryview(values).cast("B"))
+        os.replace(path + ".tmp", path)
+        self.shards.append(path)
+        self.frames += self.rows
+        self.reset()
+
+    def close(self):
+        """Write the last shard."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def export_recording(recording, directory, shard_frames=DEFAULT_SHARD_FRAMES):
+    """Export every board in a Recording, one game at a time.
+
+    :returns: The DatasetWriter used, which lists the shards written.
+
+    """
+    players = defaultdict(list)  # game -> players, found in a single pass of the index
+    for game, player in recording.boards:
+        players[game].append(player)
+    with DatasetWriter(directory, shard_frames) as writer:
+        for game in sorted(players):
+            for player in sorted(players[game]):
+                for record in recording.board_records(game, player):
+                    writer.write_board(
+                        record.session,
+                        game,
+                        player,
+                        record.data,
+                        record.incoming_lines,
+                        record.timestamp,
+                    )
+                    record.data.release()
+            writer.end_game()
+    return writer
+
+
+def main():
+    """Export a recording and print a summary."""
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("recording", help="a file written by proxy.py --record")
+    arg_parser.add_argument("directory", help="shards are written here")
+    arg_parser.add_argument(
+        "--shard-frames",
+        type=int,
+        default=DEFAULT_SHARD_FRAMES,
+        help=f"rows in each shard, default: {DEFAULT_SHARD_FRAMES}",
+    )
+    args = arg_parser.parse_args()
+    with Recording(args.recording) as recording:
+        writer = export_recording(recording, args.directory, args.shard_frames)
+    print(
+        f"{writer.frames:,} boards written to {len(writer.shards)} shards in "
+        f"{args.directory}, NumPy {'on' if numpy is not None else 'off'}"
+    )
+
+
+if __name__ == "__main__":
+    main()
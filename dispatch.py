@@ -0,0 +1,130 @@
+"""Route parsed packets to the handlers subscribed to them.
+
+Handlers subscribe to a command with a decorator, eg.
+
+    @on_xt("snapShot")
+    def snapshot_handler(msg, origin, session):
+        ...
+
+Any number of handlers, from any module, can subscribe to the same command. They are
+called in the order they subscribed, with the session.Session the packet was received
+on, which is where handlers keep any state.
+
+Handlers decide what happens to the packet they handled by what they return:
+* None or PASS forwards the packet unchanged
+* DROP suppresses the packet, it is never forwarded
+* A bytes object (without the NUL byte) is forwarded instead of the packet
+If more than one handler returns something other than PASS, the last one wins. Packets
+can only be dropped or replaced when they are parsed before being forwarded, ie. when
+the proxy isn't using a ParsePipeline. The routers also count how often each command is
+seen and how long its handlers take, to show which message types dominate CPU time.
+
+This module is never reloaded, so subscriptions and stats survive the parser module
+being live edited. A handler that is subscribed again (eg. because its module was
+reloaded) replaces its previous version instead of being called twice.
+
+"""
+import time
+from collections import defaultdict
+
+PASS = "pass"
+DROP = "drop"
+
+
+class Router:
+    """Map command names to handlers."""
+
+    def __init__(self):
+        """Initialize an empty router."""
+        self.handlers = {}  # command -> {(module, qualname): handler}
+        # these are updated without a lock, so may undercount slightly under contention
+        self.hits = defaultdict(int)
+        self.seconds = defaultdict(float)
+
+    def subscribe(self, command, handler):
+        """Call handler for every packet with this command."""
+        key = (handler.__module__, handler.__qualname__)
+        self.handlers.setdefault(command, {})[key] = handler
+
+    def unsubscribe(self, command, handler):
+        """Stop calling handler for packets with this command."""
+        key = (handler.__module__, handler.__qualname__)
+        self.handlers.get(command, {}).pop(key, None)
+
+    def on(self, command):
+        """Return a decorator that subscribes a function to a command."""
+
+        def decorator(handler):
+            self.subscribe(command, handler)
+            return handler
+
+        return decorator
+
+    def ignore(self, *commands):
+        """Mark commands as known, so they are counted but not reported as unknown."""
+        for command in commands:
+            self.handlers.setdefault(command, {})
+
+    def prune(self, module_name, module_globals):
+        """Drop handlers from a module that are no longer defined in it.
+
+        Call this at the end of a module that subscribes handlers, so that handlers
+        which were renamed or removed before the module was reloaded stop being called.
+
+        """
+        for handlers in self.handlers.values():
+            for key, handler in list(handlers.items()):
+                if key[0] != module_name:
+                    continue
+                if module_globals.get(handler.__name__) is not handler:
+                    del handlers[key]
+
+    def snapshot(self):
+        """Return a copy of the subscriptions, which restore() can go back to."""
+        return {command: dict(handlers) for command, handlers in self.handlers.items()}
+
+    def restore(self, snapshot):
+        """Replace the subscriptions with ones returned by snapshot()."""
+        # swapped in whole, so dispatch() never sees a partly restored table
+        self.handlers = {
+            command: dict(handlers) for command, handlers in snapshot.items()
+        }
+
+    def dispatch(self, command, *args):
+        """Call every handler subscribed to command with args.
+
+        :returns: None if the command is unknown, otherwise the verdict on the packet,
+                  PASS, DROP, or the bytes to replace it with.
+
+        """
+        handlers = self.handlers.get(command)
+        if handlers is None:
+            return None
+        verdict = PASS
+        start = time.perf_counter()
+        for handler in list(handlers.values()):
+            result = handler(*args)
+            if result is not None and result != PASS:
+                verdict = result
+        self.seconds[command] += time.perf_counter() - start
+        self.hits[command] += 1
+        return verdict
+
+    def stats(self):
+        """Return {command: (hits, seconds spent in handlers)}, busiest first."""
+        return {
+            command: (self.hits[command], self.seconds[command])
+            for command in sorted(self.hits.copy(), key=self.seconds.get, reverse=True)
+        }
+
+
+# routers for %xt% packets (by command) and XML sys messages (by action)
+XT = Router()
+SYS = Router()
+on_xt = XT.on
+on_sys = SYS.on
+
+
+def stats():
+    """Return the stats for both routers."""
+    return {"xt": XT.stats(), "sys": SYS.stats()}
@@ -0,0 +1,204 @@
+"""Export finished games to disk from a pool of worker processes.
+
+When games are exported, the parser only collects each player's boards while a game is
+being played. When the game ends they are handed to a GameExporter and the packet that
+ended the game is forwarded straight away. The exporter's own thread sends the boards to
+worker processes, which encode each player's fumen and write it to a file, one task per
+player. So encoding never slows down forwarding, and players are exported in parallel.
+eg.
+
+    exporter = GameExporter("games")
+    future = exporter.export(session_id, game_id, frames)
+    future.result()  # {player id: path of their fumen}
+
+Only max_in_flight games are exported at once, later games wait in the exporter until
+one finishes, so the pool's queue never grows without bound. Waiting games are never
+dropped, games only end every few minutes so there are never many of them.
+
+"""
+import os
+import queue
+from collections import deque
+from concurrent import futures
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Lock, Thread
+
+import fumen
+import log
+from board import CELLS, Board
+
+
+def export_player(directory, session_id, game_id, player_id, cells, comments):
+    """Encode a player's fumen and write it to a file, run in a worker process.
+
+    :param cells:    The cells of every board in the game, joined together
+    :param comments: The comment for each board
+    :returns:        The path of the file.
+
+    """
+    frames = (
+        (Board(cells[i * CELLS : (i + 1) * CELLS]), comment)
+        for i, comment in enumerate(comments)
+    )
+    path = os.path.join(directory, f"{game_id}-{session_id}-{player_id}.txt")
+    with open(path, "w") as file:
+        file.write(fumen.encode(frames))
+        file.write("\n")
+    return path
+
+
+def last_ids(directory):
+    """Return the highest (session id, game id) of the fumens in a directory."""
+    last_session = last_game = 0
+    for name in os.listdir(directory):
+        game_id, _, rest = name.partition("-")
+        session_id = rest.partition("-")[0]
+        if game_id.isdigit() and session_id.isdigit():
+            last_session = max(last_session, int(session_id))
+            last_game = max(last_game, int(game_id))
+    return last_session, last_game
+
+
+class GameExporter:
+    """Export finished games from worker processes, with a limit on games in flight."""
+
+    def __init__(self, directory, workers=2, max_in_flight=4, executor=None):
+        """Initialize the exporter, and start its worker processes.
+
+        :param directory:     Fumens are written here, it is created if needed
+        :param workers:       Number of worker processes
+        :param max_in_flight: Maximum number of games being exported at once
+        :param executor:      Use this concurrent.futures executor instead of starting
+                              a process pool
+
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        # highest ids of the fumens already exported, new games must use others
+        self.last_session, self.last_game = last_ids(directory)
+        self.max_in_flight = max_in_flight
+        self.executor = executor or ProcessPoolExecutor(workers)
+        self.lock = Lock()  # protects the counters and the waiting games
+        self.in_flight = 0
+        self.waiting = deque()  # (future, game) of games waiting for a slot
+        self.ready = queue.SimpleQueue()  # (future, game) of games to submit
+        self.unfinished = set()  # futures of games being exported or waiting
+        self.exported = 0
+        self.failed = 0
+        # start the workers now, rather than from a forwarding thread at the end of
+        # the first game
+        for _ in range(workers):
+            self.executor.submit(os.getpid).result()
+        # sending the boards to the workers takes a while, and releases the GIL to the
+        # executor's threads, so it is done from this thread instead of the caller's
+        self.thread = Thread(target=self.submit_games, daemon=True)
+        self.thread.start()
+
+    def export(self, session_id, game_id, frames):
+        """Export a finished game, without waiting for it to be written.
+
+        :param frames: {player id: (cells of every board joined together, [comment])},
+                       bytes are sent to the workers much faster than Boards
+        :returns:      A Future of {player id: path of their fumen}
+
+        """
+        future = Future()
+        game = (session_id, game_id, dict(frames))
+        with self.lock:
+            self.unfinished.add(future)
+            if self.in_flight >= self.max_in_flight:
+                self.waiting.append((future, game))
+                return future
+            self.in_flight += 1
+        self.ready.put((future, game))
+        return future
+
+    def submit_games(self):
+        """Submit games as they become ready, until close() is called."""
+        while True:
+            item = self.ready.get()
+            if item is None:
+                break
+            try:
+                self.submit(*item)
+            except Exception as exception:  # eg. a worker process was killed
+                self.finished(*item, {None: exception})
+
+    def submit(self, future, game):
+        """Submit a task for every player in a game, future is set once all are done."""
+        session_id, game_id, frames = game
+        if not frames:
+            self.finished(future, game, {})
+            return
+        paths = {}
+        remaining = [len(frames)]
+
+        def player_done(player_id, task):
+            try:
+                paths[player_id] = task.result()
+            except Exception as exception:
+                paths[player_id] = exception
+            with self.lock:
+                remaining[0] -= 1
+                done = not remaining[0]
+            if done:
+                self.finished(future, game, paths)
+
+        for player_id, (cells, comments) in frames.items():
+            task = self.executor.submit(
+                export_player,
+                self.directory,
+                session_id,
+                game_id,
+                player_id,
+                bytes(cells),
+                comments,
+            )
+            task.add_done_callback(
+                lambda task, player_id=player_id: player_done(player_id, task)
+            )
+
+    def finished(self, future, game, paths):
+        """Report a game that has been exported, and start the next waiting one."""
+        if future.done():
+            return  # already failed while it was being submitted
+        errors = [path for path in paths.values() if isinstance(path, Exception)]
+        with self.lock:
+            self.unfinished.discard(future)
+            if errors:
+                self.failed += 1
+            else:
+                self.exported += 1
+            if self.waiting:
+                waiting = self.waiting.popleft()
+            else:
+                waiting = None
+                self.in_flight -= 1
+        if errors:
+            log.error("export_failed", game=game[1], error=repr(errors[0]))
+            future.set_exception(errors[0])
+        else:
+            log.info("exported", game=game[1], players=len(paths))
+            future.set_result(paths)
+        if waiting is not None:
+            self.ready.put(waiting)
+
+    def stats(self):
+        """Return a dict of counters for monitoring the exporter."""
+        with self.lock:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": len(self.waiting),
+                "exported": self.exported,
+                "failed": self.failed,
+            }
+
+    def close(self, wait=True):
+        """Stop the worker processes, by default once every game has been exported."""
+        if wait:
+            with self.lock:
+                unfinished = list(self.unfinished)
+            # waiting games are submitted as others finish, so wait for them all first
+            futures.wait(unfinished)
+        self.ready.put(None)
+        self.executor.shutdown(wait=wait)
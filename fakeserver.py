@@ -0,0 +1,320 @@
+"""Run a local stand-in for the Tetris Friends SmartFoxServer.
+
+This speaks just enough of the NUL-terminated SmartFox protocol for the proxy to be
+exercised without routing traffic to sfs.tetrisfriends.com:
+* A policy file request is answered with a permissive cross-domain-policy
+* A verChk sys message is answered with apiOK
+* A login sys message is answered with zoneUserCount and the list of rooms (rmList)
+* A joinRoom sys message is answered with joinOK, and then the server plays games in
+  that room: every simulated player places pieces (livePiece) and sends snapshots of
+  their board (snapShot) at a steady rate, and each game ends with results
+* Every other %xt% packet is echoed back to the connection that sent it
+
+Simulated boards really change as pieces are placed, rows are cleared and garbage rises,
+so snapshots are as varied as in a real game. livePiece packets carry the
+time.perf_counter() they were sent at, so clients on the same machine can time them,
+see simulator.py. eg.
+
+    py ./fakeserver.py --players 6 --rate 2 --game-length 120
+
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import random
+import time
+import zlib
+
+from board import CELLS, HEIGHT, WIDTH
+from framing import NULL_BYTE, PacketFramer
+
+POLICY_RESPONSE = (
+    b"<cross-domain-policy><allow-access-from domain='*' to-ports='*' />"
+    b"</cross-domain-policy>"
+)
+API_OK_RESPONSE = b"<msg t='sys'><body action='apiOK' r='0'></body></msg>"
+# snapshot cells hold the mino id in the high nibble, see snapshot.py
+CELL_TABLE = bytes((byte << 4) & 0xFF for byte in range(256))
+GARBAGE = 8  # mino id of garbage cells
+
+
+def room_list(rooms):
+    """Return an rmList packet listing a number of rooms."""
+    rooms_xml = "".join(
+        f"<rm id='{room}' priv='0' temp='0' game='1' ucnt='{room % 6}' maxu='6' "
+        f"maxs='0'><n><![CDATA[Room {room}]]></n></rm>"
+        for room in range(rooms)
+    )
+    return (
+        f"<msg t='sys'><body action='rmList' r='-1'><rmList>{rooms_xml}</rmList>"
+        "</body></msg>"
+    ).encode()
+
+
+def encode_snapshot(cells, incoming_lines=0):
+    """Encode a snapshot the way the game does, the inverse of snapshot.read_snapshot.
+
+    :param cells: 200 bytes of mino ids, in row major order from the bottom
+
+    """
+    buffer = bytes((incoming_lines,)) + bytes(cells).translate(CELL_TABLE)
+    return base64.b64encode(zlib.compress(buffer)).decode()
+
+
+class SimulatedPlayer:
+    """A player whose board changes as they place pieces."""
+
+    def __init__(self, player_id, rng):
+        """Initialize the player with an empty board, rng is a random.Random."""
+        self.player_id = player_id
+        self.rng = rng
+        self.cells = bytearray(CELLS)
+        self.heights = [0] * WIDTH
+        self.incoming_lines = 0
+
+    def place_piece(self):
+        """Drop a random 2x2 piece onto the stack, clearing any full rows."""
+        x = self.rng.randrange(WIDTH - 1)
+        y = max(self.heights[x], self.heights[x + 1])
+        if y + 2 > HEIGHT:
+            self.reset()  # topped out, start again with an empty board
+            y = 0
+        mino = self.rng.randrange(1, 8)
+        for row in (y, y + 1):
+            self.cells[row * WIDTH + x] = mino
+            self.cells[row * WIDTH + x + 1] = mino
+        self.heights[x] = self.heights[x + 1] = y + 2
+        for row in (y + 1, y):
+            if 0 not in self.cells[row * WIDTH : (row + 1) * WIDTH]:
+                del self.cells[row * WIDTH : (row + 1) * WIDTH]
+                self.cells += bytes(WIDTH)
+                self.update_heights()
+        # sometimes an opponent sends garbage, which rises on the next piece
+        if self.incoming_lines:
+            self.add_garbage(self.incoming_lines)
+            self.incoming_lines = 0
+        elif self.rng.random() < 0.05:
+            self.incoming_lines = self.rng.randrange(1, 5)
+
+    def add_garbage(self, lines):
+        """Push garbage rows with a single hole in under the stack."""
+        hole = self.rng.randrange(WIDTH)
+        row = bytearray([GARBAGE]) * WIDTH
+        row[hole] = 0
+        self.cells[0:0] = bytes(row) * lines
+        del self.cells[CELLS:]
+        self.update_heights()
+
+    def update_heights(self):
+        """Recalculate the height of every column."""
+        for x in range(WIDTH):
+            column = self.cells[x::WIDTH]
+            self.heights[x] = len(column.rstrip(b"\x00"))
+
+    def reset(self):
+        """Empty the board."""
+        self.cells = bytearray(CELLS)
+        self.heights = [0] * WIDTH
+
+    def snapshot(self):
+        """Return the player's board as an encoded snapshot."""
+        return encode_snapshot(self.cells, self.incoming_lines)
+
+
+class FakeServer:
+    """An asyncio server that imitates the parts of SmartFoxServer the proxy sees."""
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        players=6,
+        rate=2.0,
+        game_length=60.0,
+        pause=5.0,
+        rooms=40,
+    ):
+        """Initialize the server, port 0 picks a free port when started.
+
+        :param players:     Number of simulated players in every game
+        :param rate:        Pieces placed per second by every player, each piece is
+                            followed by a snapshot
+        :param game_length: Seconds that every game lasts
+        :param pause:       Seconds between the end of a game and the next one
+        :param rooms:       Number of rooms in the room list
+
+        """
+        self.host = host
+        self.port = port
+        self.players = players
+        self.rate = rate
+        self.game_length = game_length
+        self.pause = pause
+        self.rooms = rooms
+        self.server = None
+        self.clients = {}  # handler task -> writer
+        self.connections = 0
+        self.packets = 0  # received
+        self.sent = 0
+        self.games = 0
+        self.room_ids = itertools.count(1)
+        self.rng = random.Random(0)
+
+    async def start(self):
+        """Start listening, returns the (host, port) the server is bound to."""
+        self.server = await asyncio.start_server(
+            self.handle_client, self.host, self.port, backlog=1024
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.host, self.port
+
+    async def close(self):
+        """Stop listening, disconnect all clients and wait for them to finish."""
+        self.server.close()
+        for writer in self.clients.values():
+            writer.close()
+        await asyncio.gather(*self.clients, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def handle_client(self, reader, writer):
+        """Answer packets from one client until it disconnects."""
+        self.connections += 1
+        self.clients[asyncio.current_task()] = writer
+        framer = PacketFramer()
+        game = None  # task playing games in the client's room
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                framer.feed(data)
+                for packet in framer.frames():
+                    self.packets += 1
+                    packet = bytes(packet)
+                    if game is None and b"action='joinRoom'" in packet:
+                        room_id = next(self.room_ids)
+                        writer.write(self.join_ok(room_id) + NULL_BYTE)
+                        game = asyncio.create_task(self.play_games(writer, room_id))
+                        continue
+                    if game is not None and packet.startswith(b"%xt%"):
+                        continue  # the client's own moves, nobody else to send them to
+                    for response in self.respond(packet):
+                        writer.write(response + NULL_BYTE)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            if game is not None:
+                game.cancel()
+            del self.clients[asyncio.current_task()]
+            writer.close()
+
+    def respond(self, packet):
+        """Return a list of responses to a packet, which may be empty."""
+        if packet.startswith(b"<policy-file-request"):
+            return [POLICY_RESPONSE]
+        if b"action='verChk'" in packet:
+            return [API_OK_RESPONSE]
+        if b"action='login'" in packet:
+            users = len(self.clients)
+            user_count = f"%xt%zoneUserCount%1%{users}%%{self.games}%".encode()
+            return [user_count, room_list(self.rooms)]
+        if packet.startswith(b"%xt%"):
+            return [packet]
+        return []
+
+    def join_ok(self, room_id):
+        """Return the joinOK packet for a room with the simulated players in it."""
+        users = "".join(
+            f"<u i='{room_id * 100 + i}' m='0'><n><![CDATA[player{i}]]></n></u>"
+            for i in range(self.players)
+        )
+        return (
+            f"<msg t='sys'><body action='joinOK' r='{room_id}'><pid id='0'/><vars />"
+            f"<uLs r='{room_id}'>{users}</uLs></body></msg>"
+        ).encode()
+
+    async def play_games(self, writer, room_id):
+        """Play games in a room, one after the other, until the client disconnects."""
+        try:
+            while True:
+                await self.play_game(writer, room_id)
+                await asyncio.sleep(self.pause)
+        except ConnectionError:
+            pass
+
+    async def play_game(self, writer, room_id):
+        """Send the packets for one game, every piece is due at a steady rate."""
+        self.games += 1
+        players = [
+            SimulatedPlayer(room_id * 100 + i, self.rng) for i in range(self.players)
+        ]
+        interval = 1 / self.rate
+        start = time.perf_counter()
+        rounds = 0  # rounds of pieces sent, every player places one piece per round
+        while True:
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.game_length:
+                break
+            # catch up on every round that is due, in a single write
+            due = min(int(elapsed * self.rate) + 1, int(self.game_length * self.rate))
+            packets = []
+            for _ in range(rounds, due):
+                for player in players:
+                    player.place_piece()
+                    packets.append(
+                        f"%xt%livePiece%{room_id}%{player.player_id}%"
+                        f"{time.perf_counter():.6f}%".encode()
+                    )
+                    packets.append(
+                        f"%xt%snapShot%{room_id}%{player.player_id}%"
+                        f"{player.snapshot()}%".encode()
+                    )
+            rounds = max(rounds, due)
+            if packets:
+                writer.write(NULL_BYTE.join(packets) + NULL_BYTE)
+                self.sent += len(packets)
+                await writer.drain()
+            next_round = start + rounds * interval
+            await asyncio.sleep(max(0.0, next_round - time.perf_counter()))
+        writer.write(f"%xt%results%{room_id}%".encode() + NULL_BYTE)
+        self.sent += 1
+        await writer.drain()
+
+
+def main():
+    """Run the fake server, by default on the SmartFox port."""
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=9339)
+    arg_parser.add_argument("--players", type=int, default=6)
+    arg_parser.add_argument(
+        "--rate", type=float, default=2.0, help="pieces/sec placed by every player"
+    )
+    arg_parser.add_argument(
+        "--game-length", type=float, default=60.0, metavar="SECONDS"
+    )
+    arg_parser.add_argument("--pause", type=float, default=5.0, metavar="SECONDS")
+    arg_parser.add_argument("--rooms", type=int, default=40)
+    args = arg_parser.parse_args()
+    server = FakeServer(
+        args.host,
+        args.port,
+        args.players,
+        args.rate,
+        args.game_length,
+        args.pause,
+        args.rooms,
+    )
+
+    async def serve():
+        host, port = await server.start()
+        print(f"[fakeserver] listening on {host}:{port}")
+        await server.server.serve_forever()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
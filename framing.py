@@ -0,0 +1,97 @@
+"""Split a stream of NUL-terminated SmartFox packets into frames.
+
+Data is received straight into a reusable buffer and complete packets are yielded as
+memoryviews of that buffer, so nothing is copied no matter how many chunks a large
+packet arrives in, or how many small packets arrive in one chunk.
+
+"""
+NULL_BYTE = b"\x00"
+
+
+class PacketFramer:
+    """Reassemble NUL-terminated packets from a stream of chunks.
+
+    Views returned by recv_into() and yielded by frames() are only valid until the next
+    call to recv_into() or feed(), copy them with bytes() to keep them for longer.
+
+    """
+
+    def __init__(self, max_frame=1 << 20, chunk_size=4096):
+        """Initialize the framer.
+
+        :param max_frame:  A packet is skipped once more than this many bytes of it have
+                           been buffered, to guard against unbounded memory growth
+        :param chunk_size: Maximum number of bytes to receive at once
+
+        """
+        self.max_frame = max_frame
+        self.chunk_size = chunk_size
+        self.buffer = bytearray(8 * chunk_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # start of the first incomplete packet
+        self.end = 0  # end of the received data
+        self.skipping = False  # discarding an oversized packet until its NUL byte
+        self.oversized = 0
+        self.count = 0  # packets yielded by frames()
+
+    @property
+    def pending(self):
+        """Return the number of bytes received of a packet that isn't complete yet."""
+        return self.end - self.start
+
+    def reserve(self, size):
+        """Make room for at least size more bytes at the end of the buffer."""
+        if len(self.buffer) - self.end >= size:
+            return
+        pending = self.end - self.start
+        if len(self.buffer) - pending < size:
+            # the buffer can't be resized while views of it are exported, so move the
+            # pending data into a bigger one, old views keep the old buffer alive
+            capacity = max(2 * len(self.buffer), pending + size)
+            self.buffer = bytearray(capacity)
+            self.buffer[:pending] = self.view[self.start : self.end]
+            self.view = memoryview(self.buffer)
+        else:
+            self.view[:pending] = self.view[self.start : self.end]
+        self.start = 0
+        self.end = pending
+
+    def recv_into(self, sock):
+        """Receive one chunk from a socket.
+
+        :returns: A view of the received data, empty if the connection was closed.
+
+        """
+        self.reserve(self.chunk_size)
+        received = sock.recv_into(self.view[self.end :], self.chunk_size)
+        self.end += received
+        return self.view[self.end - received : self.end]
+
+    def feed(self, data):
+        """Add a chunk of data that has already been received, eg. by asyncio."""
+        self.reserve(len(data))
+        self.view[self.end : self.end + len(data)] = data
+        self.end += len(data)
+
+    def frames(self):
+        """Yield a view of every complete packet received so far, without the NUL."""
+        find = self.buffer.find
+        view = self.view
+        end = self.end
+        pos = find(NULL_BYTE, self.start, end)
+        if pos >= 0 and self.skipping:
+            # this is the tail of an oversized packet
+            self.skipping = False
+            self.start = pos + 1
+            pos = find(NULL_BYTE, self.start, end)
+        while pos >= 0:
+            start = self.start
+            self.start = pos + 1
+            self.count += 1
+            yield view[start:pos]
+            pos = find(NULL_BYTE, pos + 1, end)
+        if not self.skipping and self.end - self.start > self.max_frame:
+            self.skipping = True
+            self.oversized += 1
+        if self.skipping:
+            self.start = self.end
@@ -6,7 +6,10 @@ Taken from my work on setup-finder.
 
 """
 
-from urllib.parse import quote
+from itertools import groupby
+from urllib.parse import quote, unquote
+
+from board import CELLS, Board, WIDTH
 
 FIELD_BLOCKS = 240  # number of blocks on field in fumen frame (24 rows of 10)
 # used for pseudo-base64 decoding
@@ -16,157 +19,243 @@ ASC_TABLE = (
     " !\"#$%&'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\\]^_`"
     "abcdefghijklmnopqrstuvwxyz{|}~"
 )
+ASC_LOOKUP = {c: i for i, c in enumerate(ASC_TABLE)}
+# maps ASCII codes to ENC_TABLE values, anything not in ENC_TABLE maps to INVALID_CHAR
+INVALID_CHAR = b"\xff"
+DEC_TABLE = bytes(
+    ENC_TABLE.index(chr(c)) if chr(c) in ENC_TABLE else 255 for c in range(256)
+)
 BLANK_ROW = [0] * 10
+# a field that is unchanged from the previous frame, (8 * FIELD_BLOCKS) + 239
+BLANK_DIFF = [47, 33]
 
 
 def data_to_field(field_data):
     """Convert raw field data into matrix representation."""
     # split into rows
     field = [field_data[i : i + 10] for i in range(0, FIELD_BLOCKS, 10)]
-    start = next((i for i, v in enumerate(field) if v != BLANK_ROW), None)
-    if start is None:
-        raise ValueError("Field is blank.")
+    start = next((i for i, v in enumerate(field) if v != BLANK_ROW), 23)
     stripped = field[start:23]  # strip blank top rows and blank bottom row
     stripped.reverse()  # TetField stores rows in reverse order
     return stripped
 
 
-def decode(fumen_str):
-    """Decode a fumen diagram."""
+def field_to_frame(field):
+    """Convert a field into bytes of fumen blocks, from the top of the frame.
+
+    Field is a Board or a list of rows, either way the bottom row comes first.
+
+    """
+    if isinstance(field, Board):
+        # the board takes up the rows above the blank bottom row
+        blocks = field.rows_from_top()
+        return bytes(FIELD_BLOCKS - WIDTH - len(blocks)) + blocks + bytes(WIDTH)
+    frame = bytearray(FIELD_BLOCKS)
+    # add field from bottom->top into blank frame
+    for y, row in enumerate(field):
+        frame[(22 - y) * 10 : (23 - y) * 10] = bytes(row[:10])
+    return bytes(frame)
+
+
+def frame_to_board(frame):
+    """Convert a list of fumen blocks into a Board, the inverse of field_to_frame."""
+    # the rows of the board, from the top
+    blocks = bytes(frame[FIELD_BLOCKS - WIDTH - CELLS : FIELD_BLOCKS - WIDTH])
+    rows = (blocks[y : y + WIDTH] for y in range(CELLS - WIDTH, -1, -WIDTH))
+    return Board(b"".join(rows))
+
+
+def decode_data(fumen_str):
+    """Convert a fumen string into a bytes object of 6 bit values."""
     if fumen_str[:5] != "v115@":
         raise ValueError("Unsupported fumen version.")
-
-    enc_data = fumen_str[5:]
     # need to strip ?, no clear reason why fumen even includes them
     try:
-        data = [ENC_TABLE.index(c) for c in enc_data.replace("?", "")]
-    except ValueError:
+        data = fumen_str[5:].replace("?", "").encode("ascii").translate(DEC_TABLE)
+    except UnicodeEncodeError:
         raise ValueError("Invalid character in fumen string.")
+    if INVALID_CHAR in data:
+        raise ValueError("Invalid character in fumen string.")
+    return data
 
-    i = 0  # data pointer
 
-    field = [0] * FIELD_BLOCKS
-    j = 0
-    while j < FIELD_BLOCKS:
-        val = data[i] + (data[i + 1] * 64)
-        i += 2
-        run_len = (val % FIELD_BLOCKS) + 1
-        block = ((val // FIELD_BLOCKS) % 17) - 8
-        for _ in range(run_len):
-            field[j] = block
-            j += 1
-        if block == 0 and run_len == (FIELD_BLOCKS - 1):
-            raise NotImplementedError("Fumen includes repeated frames.")
-
-    val = data[i] + (data[i + 1] * 64) + (data[i + 2] * 4096)
-    i += 3
-    # ignoring all piece/extra data parsing here
-    tmp = val // (256 * FIELD_BLOCKS)
-    comment_flag = tmp % 2
-    # todo: field copying (mirroring, rising, etc)
+def decode_frames(fumen_str, as_board=False):
+    """Decode every frame of a fumen diagram.
+
+    This is a generator, frames are only decoded as they are needed. Each frame is a
+    tuple of (field, comment), comments carry over from the previous frame when a frame
+    doesn't have its own. By default field is a list of rows with blank rows stripped
+    from the top, if as_board is True it is a Board instead.
 
+    Frames that place a piece, raise the field or mirror it are not supported.
+
+    """
+    data = decode_data(fumen_str)
+    i = 0  # data pointer
+    field = [0] * FIELD_BLOCKS
     comment = ""
-    if comment_flag == 1:
-        comment_len = (data[i] + (data[i + 1] * 64)) % 4096
-        i += 2
-        while len(comment) < comment_len:
-            val = (
-                data[i]
-                + (data[i + 1] * 64)
-                + (data[i + 2] * 4096)
-                + (data[i + 3] * 262144)
-                + (data[i + 4] * 16777216)
-            )
-            i += 5
-            comment += ASC_TABLE[val % 96]
-            val = val // 96
-            comment += ASC_TABLE[val % 96]
-            val = val // 96
-            comment += ASC_TABLE[val % 96]
-            val = val // 96
-            comment += ASC_TABLE[val % 96]
-            val = val // 96
-        comment = comment[:comment_len]  # strip padding
-        # note: fumen uses unescape to support unicode, but I'm not going to bother
-        # trying to simulate unescape could potentially try urllib.parse.unquote + a
-        # regular expression to handle %uxxxx
-    if len(data) - i > 0:
-        raise NotImplementedError("Data remaining after first frame parsed.")
-    return (data_to_field(field), comment)
+    repeat_count = 0
 
+    try:
+        while i < len(data):
+            if repeat_count > 0:
+                # field is unchanged, and there's no field data for this frame
+                repeat_count -= 1
+            else:
+                j = 0
+                while j < FIELD_BLOCKS:
+                    val = data[i] + (data[i + 1] * 64)
+                    i += 2
+                    run_len = (val % FIELD_BLOCKS) + 1
+                    block = ((val // FIELD_BLOCKS) % 17) - 8
+                    if block:
+                        for k in range(j, j + run_len):
+                            field[k] += block
+                    j += run_len
+                if block == 0 and run_len == FIELD_BLOCKS:
+                    # field is unchanged, followed by the number of repeated frames
+                    repeat_count = data[i]
+                    i += 1
 
-def encode(frames):
-    """Encode a fumen diagram.
+            val = data[i] + (data[i + 1] * 64) + (data[i + 2] * 4096)
+            i += 3
+            piece = val % 8
+            # flags: 1 = rise, 2 = mirror, 4 = colors, 8 = comment, 16 = don't lock
+            flags = val // (32 * FIELD_BLOCKS)
+            if not flags & 16 and (piece or flags & 3):
+                raise NotImplementedError("Fumen includes piece placement or rising.")
 
-    Frames is a list of tuples of (field, comment), for no comment comment should be an
-    empty string.
-    Field is in list form, should be converted to fumen colors first.
-    Pieces and extra data stuff isn't supported. Comments must be less than 4096
-    characters.
+            if flags & 8:
+                comment_len = (data[i] + (data[i + 1] * 64)) % 4096
+                i += 2
+                chars = []
+                for _ in range((comment_len + 3) // 4):
+                    val = (
+                        data[i]
+                        + (data[i + 1] * 64)
+                        + (data[i + 2] * 4096)
+                        + (data[i + 3] * 262144)
+                        + (data[i + 4] * 16777216)
+                    )
+                    i += 5
+                    for _ in range(4):
+                        chars.append(ASC_TABLE[val % 96])
+                        val = val // 96
+                # strip padding, fumen uses unescape to support unicode, unquote
+                # handles everything but the %uxxxx escapes
+                comment = unquote("".join(chars[:comment_len]))
+
+            if as_board:
+                yield (frame_to_board(field), comment)
+            else:
+                yield (data_to_field(field), comment)
+    except IndexError:
+        raise ValueError("Fumen string is truncated.")
+
+
+def decode(fumen_str, as_board=False):
+    """Decode a fumen diagram with a single frame.
+
+    Returns a tuple of (field, comment), see decode_frames() for details and for
+    decoding diagrams with more than one frame.
 
     """
-    data = []
-    prev_comment = ""
-    # used to output ct flag ("Guideline" checkbox for colors) on the first frame only
-    ct_flag = 1
-    prev_frame = [0] * FIELD_BLOCKS
+    frames = decode_frames(fumen_str, as_board)
+    frame = next(frames, None)
+    if frame is None:
+        raise ValueError("Fumen has no frames.")
+    if next(frames, None) is not None:
+        raise ValueError("Fumen has more than one frame, use decode_frames().")
+    return frame
 
-    for field, comment in frames:
-        new_frame = [0] * FIELD_BLOCKS
-        # add field from bottom->top into blank frame
-        for y, row in enumerate(field):
-            for x in range(10):
-                new_frame[((22 - y) * 10) + x] = row[x]
-
-        # fumen encoding starts here
-        frame = [0] * FIELD_BLOCKS
-        for i in range(FIELD_BLOCKS):
-            frame[i] += new_frame[i] + 8 - prev_frame[i]
-
-        # simple run-length encoding for field-data
-        repeat_count = 0
-        for j in range(FIELD_BLOCKS - 1):
-            repeat_count += 1
-            if frame[j] != frame[j + 1]:
-                val = (frame[j] * FIELD_BLOCKS) + (repeat_count - 1)
-                data.append(val % 64)
-                val = val // 64
+
+class FumenEncoder:
+    """Encode a fumen diagram one frame at a time.
+
+    Only the previous frame is kept, each call to add_frame() encodes the new frame
+    straight away. Encoded output is collected and returned by finish(), or if write is
+    given it is called with each chunk of output as soon as it is ready, eg. to stream a
+    fumen to a file.
+
+    """
+
+    def __init__(self, write=None):
+        """Initialize the encoder, write is an optional callable taking strings."""
+        self.write = write
+        self.chunks = [] if write is None else None
+        self.pending = []  # values held back until any repeat count is final
+        self.repeat_index = -1  # index in pending of the open repeat count
+        self.count = 0  # number of values output, used to place the "?" separators
+        self.prev_frame = bytes(FIELD_BLOCKS)
+        self.prev_comment = ""
+        # used to output ct flag ("Guideline" checkbox for colors) on the first frame
+        self.ct_flag = 1
+        self.output("v115@")
+
+    def output(self, chunk):
+        """Send a chunk of encoded output to write, or collect it."""
+        if self.write is None:
+            self.chunks.append(chunk)
+        else:
+            self.write(chunk)
+
+    def add_frame(self, field, comment=""):
+        """Encode a frame.
+
+        Field is a Board or in list form, should be converted to fumen colors first. A
+        field of None repeats the field from the previous frame. Comments must be less
+        than 4096 characters.
+
+        """
+        frame = self.prev_frame if field is None else field_to_frame(field)
+        data = self.pending
+
+        if frame == self.prev_frame:
+            # fumen stores unchanged fields as a count of repeated frames
+            if self.repeat_index >= 0 and data[self.repeat_index] < 63:
+                data[self.repeat_index] += 1
+            else:
+                if self.repeat_index >= 0:
+                    # the open repeat count is full, so everything up to here is final
+                    self.flush()
+                    data = self.pending
+                data.extend(BLANK_DIFF)
+                self.repeat_index = len(data)
+                data.append(0)
+        else:
+            self.repeat_index = -1
+            # simple run-length encoding for the difference between frames
+            diff = [new + 8 - prev for new, prev in zip(frame, self.prev_frame)]
+            for block, run in groupby(diff):
+                val = (block * FIELD_BLOCKS) + len(list(run)) - 1
                 data.append(val % 64)
-                repeat_count = 0
-        # output final block
-        val = (frame[FIELD_BLOCKS - 1] * FIELD_BLOCKS) + (repeat_count)
-        data.append(val % 64)
-        val = val // 64
-        data.append(val % 64)
-        # ignore check for blank frame/field repeat here
+                data.append(val // 64)
 
         # piece/data output
         # only thing I implement here is comment flag + "ct" flag (Guideline colors)
-        val = 1 if comment != prev_comment else 0
-        val = 128 * FIELD_BLOCKS * ((val * 2) + ct_flag)
-        ct_flag = 0  # should only be set on the first frame
+        val = 1 if comment != self.prev_comment else 0
+        val = 128 * FIELD_BLOCKS * ((val * 2) + self.ct_flag)
+        self.ct_flag = 0  # should only be set on the first frame
         data.append(val % 64)
         val = val // 64
         data.append(val % 64)
         val = val // 64
         data.append(val % 64)
 
-        if comment != prev_comment:
+        if comment != self.prev_comment:
             # quote similulates escape() in javascript, but output is not one-to-one
             # (since escape is deprecated)
             comment_str = quote(comment[:4096])
             comment_len = len(comment_str)
 
-            comment_data = [ASC_TABLE.index(c) for c in comment_str]
+            comment_data = [ASC_LOOKUP[c] for c in comment_str]
             # pad data if necessary
             if (comment_len % 4) > 0:
                 comment_data.extend([0] * (4 - (comment_len % 4)))
 
             # output length of comment
-            val = comment_len
-            data.append(val % 64)
-            val = val // 64
-            data.append(val % 64)
+            data.append(comment_len % 64)
+            data.append(comment_len // 64)
 
             # every 4 chars becomes 5 bytes (4 * 96 chars in ASCII table = 5 * 64)
             for i in range(0, comment_len, 4):
@@ -174,22 +263,51 @@ def encode(frames):
                 val += comment_data[i + 1] * 96
                 val += comment_data[i + 2] * 9216
                 val += comment_data[i + 3] * 884736
-                data.append(val % 64)
-                val = val // 64
-                data.append(val % 64)
-                val = val // 64
-                data.append(val % 64)
-                val = val // 64
-                data.append(val % 64)
-                val = val // 64
-                data.append(val % 64)
-        prev_frame = new_frame
-        prev_comment = comment
+                for _ in range(5):
+                    data.append(val % 64)
+                    val = val // 64
+        self.prev_frame = frame
+        self.prev_comment = comment
+
+        # a repeat count might still go up, so hold on to everything until it's final
+        if self.repeat_index < 0:
+            self.flush()
+
+    def flush(self):
+        """Output all of the pending encoded data."""
+        chars = []
+        count = self.count
+        for value in self.pending:
+            chars.append(ENC_TABLE[value])
+            if count % 47 == 41:
+                chars.append("?")
+            count += 1
+        self.count = count
+        self.pending = []
+        self.repeat_index = -1
+        if chars:
+            self.output("".join(chars))
 
-    encode_str = "v115@"
-    for i, output_byte in enumerate(data):
-        encode_str += ENC_TABLE[output_byte]
-        if i % 47 == 41:
-            encode_str += "?"
-    return encode_str
+    def finish(self):
+        """Output any pending data, returns the fumen if no write callable was given."""
+        self.flush()
+        if self.write is None:
+            return "".join(self.chunks)
+        return None
+
+
+def encode(frames):
+    """Encode a fumen diagram.
 
+    Frames is a list of tuples of (field, comment), for no comment comment should be an
+    empty string.
+    Field is a Board or in list form, should be converted to fumen colors first. A field
+    of None repeats the field from the previous frame.
+    Pieces and extra data stuff isn't supported. Comments must be less than 4096
+    characters.
+
+    """
+    encoder = FumenEncoder()
+    for field, comment in frames:
+        encoder.add_frame(field, comment)
+    return encoder.finish()
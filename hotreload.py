@@ -0,0 +1,92 @@
+"""Reload a module when its source file changes.
+
+This is what makes it possible to live edit the parser while the proxy is running,
+without paying for a reload on every packet. The source file is only stat'ed once per
+interval, and the module is only re-executed when its contents actually change.
+
+"""
+import hashlib
+import importlib.util
+import os
+import sys
+import time
+from threading import Lock
+
+import dispatch
+import log
+
+
+class ModuleReloader:
+    """Hold the latest version of a module, reloading it when the source changes."""
+
+    def __init__(self, module, interval=0.5):
+        """Initialize the reloader.
+
+        :param module:   The module to watch, must have been loaded from a source file
+        :param interval: Minimum number of seconds between checks of the source file
+
+        """
+        self.module = module
+        self.path = module.__file__
+        self.interval = interval
+        self.lock = Lock()
+        self.mtime = os.stat(self.path).st_mtime_ns
+        self.digest = self.hash_source()
+        self.next_check = time.monotonic() + interval
+        self.reloads = 0
+
+    def hash_source(self):
+        """Return a digest of the module's source file."""
+        with open(self.path, "rb") as source:
+            return hashlib.sha1(source.read()).digest()
+
+    def get(self):
+        """Return the current module, reloading it first if the source has changed."""
+        if time.monotonic() >= self.next_check:
+            self.check()
+        return self.module
+
+    def check(self):
+        """Reload the module if its source file has been modified."""
+        with self.lock:
+            self.next_check = time.monotonic() + self.interval
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return  # file is probably being replaced by an editor
+            if mtime == self.mtime:
+                return
+            self.mtime = mtime
+            digest = self.hash_source()
+            if digest == self.digest:
+                return  # touched but not changed
+            self.digest = digest
+            self.reload()
+
+    def reload(self):
+        """Load a fresh copy of the module and swap it in.
+
+        The new module is fully executed before it replaces the old one, so a packet
+        that is being parsed on another thread keeps using a consistent module. If the
+        new source fails to load, the old module is kept, and so are the handlers it
+        subscribed to the dispatch routers, undoing any the new source subscribed
+        before it failed.
+
+        """
+        name = self.module.__name__
+        spec = importlib.util.spec_from_file_location(name, self.path)
+        module = importlib.util.module_from_spec(spec)
+        routers = [
+            (router, router.snapshot()) for router in (dispatch.XT, dispatch.SYS)
+        ]
+        try:
+            spec.loader.exec_module(module)
+        except Exception as exception:
+            for router, snapshot in routers:
+                router.restore(snapshot)
+            log.error("reload_failed", module=name, error=repr(exception))
+            return
+        sys.modules[name] = module
+        self.module = module
+        self.reloads += 1
+        log.info("reloaded", module=name)
@@ -0,0 +1,110 @@
+"""Schedule packets to be injected into a connection.
+
+Each direction of a session has its own scheduler. Packets can be given a priority and
+a delay, and are rate limited with a token bucket so injecting lots of packets doesn't
+get us kicked for flooding. Every packet that is due (and allowed by the rate limit) is
+coalesced into a single write.
+
+The scheduler doesn't do any I/O itself. Whatever writes to the connection sets a
+waker, which is called whenever a packet is scheduled, so injected packets are sent
+straight away instead of waiting for the next packet to arrive.
+
+"""
+import heapq
+import itertools
+import statistics
+import time
+from collections import deque
+from threading import Lock
+
+RATE = 10.0  # packets/sec that can be injected in the long run
+BURST = 10  # packets that can be injected at once, after being idle
+
+
+class InjectionScheduler:
+    """A priority queue of packets to inject, rate limited by a token bucket."""
+
+    def __init__(self, rate=RATE, burst=BURST):
+        """Initialize the scheduler.
+
+        :param rate:  Maximum packets/sec, once the burst has been used up
+        :param burst: Maximum number of packets that can be sent at once
+
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = Lock()
+        self.waker = None  # called when a packet is scheduled, from any thread
+        self.order = itertools.count()  # keeps packets of equal priority in order
+        self.ready = []  # heap of (-priority, order, due, packet)
+        self.delayed = []  # heap of (due, order, priority, packet)
+        self.latencies = deque(maxlen=1000)  # seconds from due to sent, recent ones
+        self.sent = 0
+        self.writes = 0
+
+    def __len__(self):
+        """Return the number of packets waiting to be sent."""
+        return len(self.ready) + len(self.delayed)
+
+    def send(self, packet, priority=0, delay=0.0):
+        """Schedule a packet, including its NUL byte, to be injected.
+
+        :param priority: Packets with a higher priority are sent first
+        :param delay:    Seconds to wait before sending the packet
+
+        """
+        due = time.monotonic() + delay
+        with self.lock:
+            if delay > 0:
+                heapq.heappush(self.delayed, (due, next(self.order), priority, packet))
+            else:
+                heapq.heappush(self.ready, (-priority, next(self.order), due, packet))
+        if self.waker is not None:
+            self.waker()
+
+    def pop(self):
+        """Take every packet that can be sent now.
+
+        :returns: (data, timeout), data is the packets joined together, or empty if
+                  none can be sent. timeout is the number of seconds until the next
+                  packet can be sent, or None if there are no packets waiting.
+
+        """
+        now = time.monotonic()
+        with self.lock:
+            delayed = self.delayed
+            while delayed and delayed[0][0] <= now:
+                due, order, priority, packet = heapq.heappop(delayed)
+                heapq.heappush(self.ready, (-priority, order, due, packet))
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            packets = []
+            while self.ready and self.tokens >= 1:
+                _, _, due, packet = heapq.heappop(self.ready)
+                self.tokens -= 1
+                self.latencies.append(now - due)
+                packets.append(packet)
+            if self.ready:
+                timeout = (1 - self.tokens) / self.rate
+            elif delayed:
+                timeout = delayed[0][0] - now
+            else:
+                timeout = None
+            if packets:
+                self.sent += len(packets)
+                self.writes += 1
+        return b"".join(packets), timeout
+
+    def stats(self):
+        """Return a dict of counters and recent injection latencies."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {"waiting": len(self), "sent": self.sent, "writes": self.writes}
+        if latencies:
+            stats["latency_median"] = statistics.median(latencies)
+            stats["latency_max"] = latencies[-1]
+        return stats
@@ -0,0 +1,219 @@
+"""Keep rolling stats on every player's performance during a game.
+
+Stats are updated incrementally as packets arrive, so they cost the same no matter how
+long a game has been going on:
+* Pieces and lines are counted in rolling windows, so rates reflect recent play
+* Board features (stack height and holes) are only recomputed for the columns that
+  changed since the player's previous snapshot
+* Incoming garbage is read from the header byte of each snapshot
+
+The server doesn't say how many lines a player clears, so they are estimated from the
+change in filled cells between snapshots: every piece adds 4 cells, every row of
+garbage adds 9, and every cleared line removes 10.
+
+"""
+import time
+from collections import deque
+from threading import Lock
+
+from board import CELLS, HEIGHT, WIDTH
+
+WINDOW = 30.0  # seconds of play that rates are calculated over
+GARBAGE = 8  # mino id of garbage cells
+
+
+class RollingWindow:
+    """Sum values added over the last few seconds, in amortized O(1) time."""
+
+    def __init__(self, seconds=WINDOW):
+        """Initialize an empty window."""
+        self.seconds = seconds
+        self.events = deque()  # (time, value), oldest first
+        self.total = 0
+        self.first = None  # time of the first event ever added
+
+    def add(self, now, value=1):
+        """Add a value at time now, which must not be before the previous add."""
+        if self.first is None:
+            self.first = now
+        self.events.append((now, value))
+        self.total += value
+        self.expire(now)
+
+    def expire(self, now):
+        """Forget values that are older than the window."""
+        events = self.events
+        while events and events[0][0] <= now - self.seconds:
+            self.total -= events.popleft()[1]
+
+    def rate(self, now):
+        """Return the sum per second, over the window or since the first value."""
+        self.expire(now)
+        if self.first is None:
+            return 0.0
+        # don't report huge rates in the first second of a game
+        return self.total / max(1.0, min(self.seconds, now - self.first))
+
+
+class PlayerStats:
+    """Stats for one player in the current game."""
+
+    def __init__(self, window=WINDOW):
+        """Initialize stats for a player with an empty board."""
+        self.pieces = RollingWindow(window)
+        self.lines = RollingWindow(window)
+        self.garbage = RollingWindow(window)
+        self.total_pieces = 0
+        self.total_lines = 0
+        self.total_garbage = 0
+        self.pending_pieces = 0  # pieces placed since the last snapshot
+        self.cells = bytes(CELLS)
+        self.filled = 0
+        self.garbage_rows = 0
+        self.heights = [0] * WIDTH
+        self.holes = [0] * WIDTH
+        self.incoming = 0  # lines of garbage waiting to rise, from the last snapshot
+        self.max_height = 0
+        self.topped_out = False
+
+    def piece(self, now):
+        """Count a piece placed by the player."""
+        self.pieces.add(now)
+        self.total_pieces += 1
+        self.pending_pieces += 1
+
+    def snapshot(self, board, incoming_lines, now):
+        """Update the board features from a new snapshot of the player's board."""
+        if incoming_lines > self.incoming:
+            self.garbage.add(now, incoming_lines - self.incoming)
+            self.total_garbage += incoming_lines - self.incoming
+        self.incoming = incoming_lines
+        cells = board.cells
+        last = self.cells
+        if cells == last:
+            return
+        for x in range(WIDTH):
+            column = cells[x::WIDTH]
+            if column == last[x::WIDTH]:
+                continue
+            height = len(column.rstrip(b"\x00"))
+            self.heights[x] = height
+            self.holes[x] = column.count(0, 0, height)
+        height = max(self.heights)
+        if height > self.max_height:
+            self.max_height = height
+
+        filled = CELLS - cells.count(0)
+        garbage_rows = 0
+        while garbage_rows < HEIGHT:
+            start = garbage_rows * WIDTH
+            if GARBAGE not in cells[start : start + WIDTH]:
+                break
+            garbage_rows += 1
+        risen = max(0, garbage_rows - self.garbage_rows)
+        added = 4 * self.pending_pieces + 9 * risen
+        lines = max(0, round((self.filled + added - filled) / 10))
+        if lines:
+            self.lines.add(now, lines)
+            self.total_lines += lines
+        self.cells = cells
+        self.filled = filled
+        self.garbage_rows = garbage_rows
+        self.pending_pieces = 0
+
+    def summary(self, now):
+        """Return a dict of the player's current stats."""
+        return {
+            "pps": self.pieces.rate(now),
+            "lpm": self.lines.rate(now) * 60,
+            "garbage_pm": self.garbage.rate(now) * 60,
+            "pieces": self.total_pieces,
+            "lines": self.total_lines,
+            "garbage": self.total_garbage,
+            "incoming": self.incoming,
+            "height": max(self.heights),
+            "max_height": self.max_height,
+            "holes": sum(self.holes),
+            "topped_out": self.topped_out,
+        }
+
+
+class LiveStats:
+    """Stats for every player in the current game.
+
+    Times are time.time() values, or session.Session.now() when packets are replayed.
+    Stats are updated by whichever thread parses the session's packets, and can be
+    read from any other, eg. to report them in chat. Reading expires old events from
+    the rolling windows, so updates and reads are serialized by a lock.
+
+    """
+
+    def __init__(self, window=WINDOW):
+        """Initialize the stats, rates are calculated over window seconds."""
+        self.window = window
+        self.players = {}  # player id -> PlayerStats
+        self.room = None  # room the game is being played in
+        self.lock = Lock()
+
+    def player(self, player_id):
+        """Return the stats for a player, creating them if needed."""
+        stats = self.players.get(player_id)
+        if stats is None:
+            stats = self.players[player_id] = PlayerStats(self.window)
+        return stats
+
+    def piece(self, player_id, now=None):
+        """Count a piece placed by a player."""
+        now = time.time() if now is None else now
+        with self.lock:
+            self.player(player_id).piece(now)
+
+    def snapshot(self, room_id, player_id, board, incoming_lines, now=None):
+        """Update a player's stats from a snapshot of their board."""
+        now = time.time() if now is None else now
+        with self.lock:
+            self.room = room_id
+            self.player(player_id).snapshot(board, incoming_lines, now)
+
+    def top_out(self, player_id):
+        """Mark a player as topped out."""
+        with self.lock:
+            self.player(player_id).topped_out = True
+
+    def reset(self):
+        """Forget every player, eg. when a game ends."""
+        with self.lock:
+            self.players = {}
+            self.room = None
+
+    def summary(self, now=None):
+        """Return {player id: stats dict} for every player."""
+        now = time.time() if now is None else now
+        with self.lock:
+            return {
+                player_id: stats.summary(now)
+                for player_id, stats in self.players.items()
+            }
+
+    def message(self, now=None):
+        """Return a one line summary of every player, or None if there's no game."""
+        players = []
+        for player_id, stats in self.summary(now).items():
+            if stats["topped_out"]:
+                players.append(f"{player_id}: out")
+                continue
+            players.append(
+                f"{player_id}: {stats['pps']:.2f}pps {stats['lpm']:.0f}lpm "
+                f"h{stats['height']} {stats['holes']}holes +{stats['garbage']}"
+            )
+        return " | ".join(players) or None
+
+    def chat_packet(self, now=None):
+        """Return a public message for the client showing the summary, or None."""
+        message = self.message(now)
+        if message is None or self.room is None:
+            return None
+        return (
+            f"<msg t='sys'><body action='pubMsg' r='{self.room}'><user id='-1' />"
+            f"<txt><![CDATA[{message}]]></txt></body></msg>"
+        ).encode()
@@ -0,0 +1,190 @@
+"""Log structured events from a background thread.
+
+Logging an event only puts a small tuple on a queue, formatting and writing it happens
+on a writer thread, so a burst of events never holds up forwarding, and lines from
+different threads never interleave. Events are logged by name with keyword fields, eg.
+
+    log.info("game_ended", players=6)
+
+and are written either as text, or as JSON lines for other tools to consume.
+High-frequency events can be sampled, so only one in every few is logged.
+
+This module is never reloaded, so the writer thread survives the parser being live
+edited.
+
+"""
+import json
+import queue
+import sys
+import time
+from threading import Event, Lock, Thread
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR, "off": OFF}
+LEVEL_NAMES = {level: name.upper() for name, level in LEVELS.items()}
+FORMATS = ["text", "json"]
+BATCH_INTERVAL = 0.05  # seconds the writer waits for more events after each write
+
+
+class Logger:
+    """Queue events on the calling thread, and write them on a background thread."""
+
+    def __init__(self, stream=None, level=INFO, fmt="text", maxsize=100000):
+        """Initialize the logger.
+
+        :param stream:  File-like object to write to, defaults to sys.stdout
+        :param level:   Events below this level are ignored
+        :param fmt:     One of FORMATS
+        :param maxsize: Events are dropped once this many are waiting to be written
+
+        """
+        self.stream = stream
+        self.level = level
+        self.fmt = fmt
+        self.maxsize = maxsize
+        self.queue = queue.SimpleQueue()
+        self.samples = {}  # event -> number of times it was logged with sampling
+        self.dropped = 0
+        self.thread = None
+        self.lock = Lock()  # protects starting the thread
+        self.second = None  # (whole second, its formatted time) of the last event
+
+    def configure(self, stream=None, level=None, fmt=None):
+        """Change where and how events are written, None keeps the current setting."""
+        self.flush()
+        if stream is not None:
+            self.stream = stream
+        if level is not None:
+            self.level = level
+        if fmt is not None:
+            if fmt not in FORMATS:
+                raise ValueError(f"Unknown log format: {fmt}")
+            self.fmt = fmt
+
+    def log(self, level, event, sample=1, **fields):
+        """Queue an event to be written.
+
+        :param sample: Only log one in every sample times this event is logged
+
+        """
+        if level < self.level:
+            return
+        if sample > 1:
+            count = self.samples.get(event, 0)
+            self.samples[event] = count + 1
+            if count % sample:
+                return
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+            return
+        if self.thread is None:
+            self.start()
+        self.queue.put((time.time(), level, event, fields))
+
+    def debug(self, event, sample=1, **fields):
+        """Queue an event at the DEBUG level."""
+        self.log(DEBUG, event, sample, **fields)
+
+    def info(self, event, sample=1, **fields):
+        """Queue an event at the INFO level."""
+        self.log(INFO, event, sample, **fields)
+
+    def warning(self, event, sample=1, **fields):
+        """Queue an event at the WARNING level."""
+        self.log(WARNING, event, sample, **fields)
+
+    def error(self, event, sample=1, **fields):
+        """Queue an event at the ERROR level."""
+        self.log(ERROR, event, sample, **fields)
+
+    def start(self):
+        """Start the writer thread, if it isn't running already."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.write_events, daemon=True)
+                self.thread.start()
+
+    def flush(self):
+        """Wait until every event logged so far has been written."""
+        if self.thread is None:
+            return
+        written = Event()
+        self.queue.put(written)
+        written.wait()
+
+    def format(self, record):
+        """Return an event as a line of text."""
+        timestamp, level, event, fields = record
+        if self.fmt == "json":
+            return (
+                json.dumps(
+                    {
+                        "time": timestamp,
+                        "level": LEVEL_NAMES.get(level, level),
+                        "event": event,
+                        **fields,
+                    },
+                    default=repr,
+                )
+                + "\n"
+            )
+        second = int(timestamp)
+        if self.second is None or self.second[0] != second:
+            self.second = (second, time.strftime("%H:%M:%S", time.localtime(second)))
+        clock = self.second[1]
+        milliseconds = int(timestamp % 1 * 1000)
+        line = f"{clock}.{milliseconds:03} {LEVEL_NAMES.get(level, level)} {event}"
+        for name, value in fields.items():
+            line += f" {name}={value}"
+        return line + "\n"
+
+    def write_events(self):
+        """Write queued events until the process exits, run on the writer thread."""
+        get = self.queue.get
+        while True:
+            item = get()
+            stream = self.stream or sys.stdout
+            lines = []
+            # write everything that's waiting at once, with a single flush
+            while True:
+                if isinstance(item, Event):
+                    self.write(stream, lines)
+                    lines = []
+                    item.set()
+                else:
+                    try:
+                        lines.append(self.format(item))
+                    except Exception as exception:
+                        lines.append(f"error formatting {item[2]}: {exception!r}\n")
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.write(stream, lines)
+            # let events build up, so the logging threads rarely have to wake us
+            time.sleep(BATCH_INTERVAL)
+
+    @staticmethod
+    def write(stream, lines):
+        """Write lines to a stream and flush it."""
+        if not lines:
+            return
+        try:
+            stream.write("".join(lines))
+            stream.flush()
+        except (OSError, ValueError):
+            pass  # stream was closed, there's nowhere left to log to
+
+
+# the proxy's logger
+LOG = Logger()
+configure = LOG.configure
+flush = LOG.flush
+debug = LOG.debug
+info = LOG.info
+warning = LOG.warning
+error = LOG.error
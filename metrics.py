@@ -0,0 +1,205 @@
+"""Measure how much delay the proxy adds, and how much traffic it handles.
+
+Everything is counted in preallocated counters and fixed-bucket histograms, so
+recording a measurement doesn't allocate and the metrics can always be left on. They
+can be exported in the Prometheus text format, from a local HTTP endpoint, or printed
+as a periodic summary.
+
+Like dispatch.py this module is never reloaded, so metrics survive the parser being
+live edited. Counters are updated without a lock, so they may undercount slightly when
+several threads update them at once.
+
+"""
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import dispatch
+
+# upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    float("inf"),
+)
+ORIGINS = ("client", "server")
+
+
+class Histogram:
+    """Count values in fixed buckets."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        """Initialize the histogram, bounds must be sorted and end with infinity."""
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+
+    @property
+    def count(self):
+        """Return the number of values in the histogram."""
+        return sum(self.counts)
+
+    def observe(self, value):
+        """Add a value to the histogram."""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket that holds the q quantile."""
+        target = q * sum(self.counts)
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.bounds[-1]
+
+    def lines(self, name, labels):
+        """Return the histogram in the Prometheus text format."""
+        lines = []
+        cumulative = 0
+        prefix = f"{labels}," if labels else ""
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Direction:
+    """Traffic and latency for packets travelling in one direction."""
+
+    def __init__(self):
+        """Initialize the counters to zero."""
+        self.bytes = 0
+        self.packets = 0
+        self.forward_latency = Histogram()  # from receiving a chunk to forwarding it
+        self.parse_latency = Histogram()  # time to parse a single packet
+
+    def forwarded(self, size, packets, received):
+        """Count a chunk of size bytes, that was received at perf_counter() received."""
+        self.bytes += size
+        self.packets += packets
+        self.forward_latency.observe(time.perf_counter() - received)
+
+
+class Metrics:
+    """Every metric the proxy collects."""
+
+    def __init__(self):
+        """Initialize the metrics."""
+        self.directions = {origin: Direction() for origin in ORIGINS}
+        self.sessions = 0  # active sessions
+        # from accepting a client to being connected to the server for it
+        self.connect_latency = Histogram()
+        self.gauges = {}  # name -> function returning the current value
+        self.started = time.monotonic()
+        self.last_summary = (self.started, 0, 0)  # (time, bytes, packets)
+
+    def gauge(self, name, function):
+        """Report the value returned by function as a gauge when exporting."""
+        self.gauges[name] = function
+
+    def export(self):
+        """Return every metric in the Prometheus text format."""
+        lines = [
+            "# TYPE tf_sessions_active gauge",
+            f"tf_sessions_active {self.sessions}",
+            "# TYPE tf_bytes_total counter",
+            "# TYPE tf_packets_total counter",
+        ]
+        for origin, direction in self.directions.items():
+            lines.append(f'tf_bytes_total{{origin="{origin}"}} {direction.bytes}')
+            lines.append(f'tf_packets_total{{origin="{origin}"}} {direction.packets}')
+        for name in ("forward_latency", "parse_latency"):
+            lines.append(f"# TYPE tf_{name}_seconds histogram")
+            for origin, direction in self.directions.items():
+                histogram = getattr(direction, name)
+                lines += histogram.lines(f"tf_{name}_seconds", f'origin="{origin}"')
+        lines.append("# TYPE tf_connect_latency_seconds histogram")
+        lines += self.connect_latency.lines("tf_connect_latency_seconds", "")
+        lines.append("# TYPE tf_handler_calls_total counter")
+        lines.append("# TYPE tf_handler_seconds_total counter")
+        for router, commands in dispatch.stats().items():
+            for command, (hits, seconds) in commands.items():
+                labels = f'router="{router}",command="{command}"'
+                lines.append(f"tf_handler_calls_total{{{labels}}} {hits}")
+                lines.append(f"tf_handler_seconds_total{{{labels}}} {seconds}")
+        for name, function in self.gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {function()}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Return a one line summary of traffic since the last summary."""
+        now = time.monotonic()
+        size = sum(direction.bytes for direction in self.directions.values())
+        packets = sum(direction.packets for direction in self.directions.values())
+        last_time, last_size, last_packets = self.last_summary
+        self.last_summary = (now, size, packets)
+        elapsed = max(now - last_time, 1e-9)
+        parts = [
+            f"{self.sessions} sessions",
+            f"{(packets - last_packets) / elapsed:,.0f} packets/sec",
+            f"{(size - last_size) / elapsed / 1000:,.1f}kB/sec",
+        ]
+        for origin, direction in self.directions.items():
+            latency = direction.forward_latency
+            parts.append(
+                f"{origin} forward p50<={latency.quantile(0.5) * 1000:g}ms "
+                f"p99<={latency.quantile(0.99) * 1000:g}ms"
+            )
+        for name, function in self.gauges.items():
+            parts.append(f"{name}={function()}")
+        return ", ".join(parts)
+
+
+# the proxy's metrics
+METRICS = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve METRICS at /metrics."""
+
+    def do_GET(self):  # pylint: disable=C0103
+        """Respond with the metrics, in the Prometheus text format."""
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.export().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Don't print a line for every scrape."""
+
+
+def serve(port, host="127.0.0.1"):
+    """Serve the metrics over HTTP from a background thread, returns the server."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def dump(interval):
+    """Print a summary of the metrics every interval seconds, forever."""
+    while True:
+        time.sleep(interval)
+        print("metrics:", METRICS.summary())
@@ -0,0 +1,132 @@
+"""Parse packets on worker threads, off the forwarding path.
+
+Packets are handed to a bounded queue after they have been forwarded, so a slow parse
+(eg. decoding a snapshot or encoding fumens) never delays gameplay. Every session is
+pinned to a single worker, so packets from one session are always parsed in the order
+they were received.
+
+When the queue for a worker is full, the backpressure policy decides what happens:
+* block:  wait for room in the queue, this slows down forwarding for that session
+* drop:   discard the packet
+* sample: once the queue is half full, only keep one in every sample_rate packets
+
+"""
+import queue
+import time
+from threading import Lock, Thread
+
+import log
+
+POLICIES = ["block", "drop", "sample"]
+
+
+class ParsePipeline:
+    """A pool of worker threads that drain bounded per-worker packet queues."""
+
+    def __init__(
+        self, handler, workers=2, maxsize=1024, policy="block", sample_rate=10
+    ):
+        """Initialize the pipeline.
+
+        :param handler:     Called as handler(packet, origin, session, received) on a
+                            worker thread, received is the time.time() it was queued
+        :param workers:     Number of worker threads
+        :param maxsize:     Maximum number of packets waiting in each worker's queue
+        :param policy:      Backpressure policy, one of POLICIES
+        :param sample_rate: Keep one in this many packets when sampling
+
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.handler = handler
+        self.maxsize = maxsize
+        self.policy = policy
+        self.sample_rate = sample_rate
+        self.queues = [queue.Queue(maxsize) for _ in range(workers)]
+        self.threads = [
+            Thread(target=self.work, args=(q,), daemon=True) for q in self.queues
+        ]
+        self.lock = Lock()  # protects the counters below
+        self.submitted = 0
+        self.dropped = 0
+        self.processed = 0
+        self.max_depth = 0
+        self.sample_count = 0
+
+    def start(self):
+        """Start the worker threads."""
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Stop the worker threads once they have drained their queues."""
+        for q in self.queues:
+            q.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def work(self, packets):
+        """Parse packets from one queue until stop() is called."""
+        while True:
+            item = packets.get()
+            if item is None:
+                break
+            try:
+                self.handler(*item)
+            except Exception as exception:
+                log.error("pipeline_error", error=repr(exception))
+            with self.lock:
+                self.processed += 1
+
+    def offer(self, session, packet, origin):
+        """Queue a packet without blocking.
+
+        :returns: False if the queue is full and the policy is block, so the caller
+                  should wait using submit(). True if the packet was queued or dropped.
+
+        """
+        packets = self.queues[session.session_id % len(self.queues)]
+        depth = packets.qsize()
+        with self.lock:
+            if depth > self.max_depth:
+                self.max_depth = depth
+            if self.policy == "sample" and depth >= self.maxsize // 2:
+                self.sample_count += 1
+                if self.sample_count % self.sample_rate:
+                    self.dropped += 1
+                    return True
+        try:
+            packets.put_nowait((packet, origin, session, time.time()))
+        except queue.Full:
+            if self.policy == "block":
+                return False
+            with self.lock:
+                self.dropped += 1
+            return True
+        with self.lock:
+            self.submitted += 1
+        return True
+
+    def submit(self, session, packet, origin):
+        """Queue a packet, blocking if the queue is full and the policy is block."""
+        if self.offer(session, packet, origin):
+            return
+        packets = self.queues[session.session_id % len(self.queues)]
+        packets.put((packet, origin, session, time.time()))
+        with self.lock:
+            self.submitted += 1
+
+    def queue_depth(self):
+        """Return the total number of packets waiting to be parsed."""
+        return sum(q.qsize() for q in self.queues)
+
+    def stats(self):
+        """Return a dict of counters for monitoring the pipeline."""
+        with self.lock:
+            return {
+                "queue_depth": self.queue_depth(),
+                "max_depth": self.max_depth,
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "dropped": self.dropped,
+            }
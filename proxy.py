@@ -15,12 +15,28 @@ For this to work you will need to route "sfs.tetrisfriends.com" to localhost in
 
 """
 # import binascii
+import argparse
+import asyncio
 import os
+import selectors
 import socket
-from threading import Thread
-from importlib import reload
-from collections import defaultdict, deque
+import time
+from threading import Event, Thread
+import dispatch
+import log
+from dispatch import DROP, PASS
+from export import GameExporter
 import tfparser as parser
+from framing import PacketFramer
+from hotreload import ModuleReloader
+from inject import InjectionScheduler
+import metrics
+from metrics import METRICS
+from pipeline import POLICIES, ParsePipeline
+from recording import RecordingWriter
+from session import GAME_IDS, SESSION_IDS, Session
+from snapshot import read_snapshot
+from upstream import UpstreamPool, tune_socket
 
 NULL_BYTE = b"\x00"
 
@@ -30,23 +46,28 @@ TF_PORT = 9339
 # Use localhost by default, change this if running proxy on a different IP
 PROXY_IP = "0.0.0.0"
 
-# initialize a dictionary here to for the parser to use, since we are constantly
-# reloading the module  we need some data to persist outside of the parser module
-PERSISTENT_DATA = {"fields": defaultdict(list), "game_started": False}
+# options for every new session.Session, the parser's state lives in the sessions so
+# that it persists when the parser module is reloaded
+SESSION_OPTIONS = {
+    "recorder": None,  # a RecordingWriter, if games are being recorded
+    "dedup_frames": False,  # store unchanged boards as repeats of the previous frame
+    "exporter": None,  # a GameExporter, if finished games are exported
+}
+# swaps in a fresh copy of the parser whenever its source changes
+PARSER = ModuleReloader(parser)
 
 
 class Proxy2Server(Thread):
     """This class creates a connection from the game server to the proxy."""
 
-    def __init__(self, host, port):
-        """Initialize the connection to the server."""
+    def __init__(self, server):
+        """Initialize the pipe from a socket connected to the server."""
         super(Proxy2Server, self).__init__()
         self.game = None  # game client socket not known yet
-        self.port = port
-        self.host = host
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.connect((host, port))
-        self.queue = deque()
+        self.server = server
+        self.injector = InjectionScheduler()  # packets to inject into the client
+        self.session = None
+        self.pipeline = None  # parse inline unless a ParsePipeline is set
 
     def run(self):
         """Receive packets from the server and run them through the parser module.
@@ -55,127 +76,724 @@ class Proxy2Server(Thread):
         separate thread.
 
         """
-        buffer = b""
-        while True:
-            # not sure if this should send one per packet or all at once
-            while self.queue:
-                packet = self.queue.popleft()
-                print("sending packet to client:", packet)
-                self.game.sendall(packet)
-            data = self.server.recv(4096)
-            if data:
-                buffer += data
-                while NULL_BYTE in buffer:
-                    packet, _, buffer = buffer.partition(NULL_BYTE)
-                    # could make this return if we should suppress
-                    process_packet(packet, "server")
-                # forward data to game, do this after processing, in case we want to
-                # suppress sending data later
-                self.game.sendall(data)
+        framer = PacketFramer()
+        selector = wake_on_inject(self.injector, self.server)
+        direction = METRICS.directions["server"]
+        try:
+            while True:
+                if not inject_and_wait(
+                    self.injector, framer, self.game, self.server, selector, "client"
+                ):
+                    continue
+                data = framer.recv_into(self.server)
+                if not data:
+                    break  # server disconnected
+                received = time.perf_counter()
+                count = framer.count
+                if self.pipeline is not None:
+                    # forward straight away, the pipeline parses packets later
+                    self.game.sendall(data)
+                    for packet in framer.frames():
+                        self.pipeline.submit(self.session, bytes(packet), "server")
+                else:
+                    # forward after processing, so handlers can drop or replace packets
+                    with self.session.lock:  # the other direction parses on its thread
+                        forward = filter_packets(framer, "server", self.session)
+                    if forward:
+                        self.game.sendall(forward)
+                direction.forwarded(len(data), framer.count - count, received)
+        except OSError:
+            pass  # either side disconnected
+        finally:
+            stop_waking(self.injector, selector)
+            disconnect(self.game)
 
 
 class Game2Proxy(Thread):
     """This class creates a connection from the game client to the proxy."""
 
-    def __init__(self, host, port):
-        """Initialize the connection to the client."""
+    def __init__(self, game):
+        """Initialize the pipe from a socket accepted from the client."""
         super(Game2Proxy, self).__init__()
         self.server = None  # real server socket not known yet
-        self.port = port
-        self.host = host
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind((host, port))
-        sock.listen(1)
-        # waiting for a connection
-        self.game, _ = sock.accept()
-        self.queue = deque()
+        self.game = game
+        self.injector = InjectionScheduler()  # packets to inject into the server
+        self.session = None
+        self.pipeline = None  # parse inline unless a ParsePipeline is set
 
     def run(self):
         """Receive packets from the client and run them through the parser module."""
-        buffer = b""
-        while True:
-            while self.queue:
-                packet = self.queue.popleft()
-                print("sending packet to server:", packet)
-                self.server.sendall(packet)
-            data = self.game.recv(4096)
-            if data:
-                buffer += data
-                while NULL_BYTE in buffer:
-                    packet, _, buffer = buffer.partition(NULL_BYTE)
-                    process_packet(packet, "client")
-                # forward data to server, do this after processing, in case we want to
-                # suppress sending data later
-                self.server.sendall(data)
+        framer = PacketFramer()
+        selector = wake_on_inject(self.injector, self.game)
+        direction = METRICS.directions["client"]
+        METRICS.sessions += 1
+        try:
+            while True:
+                if not inject_and_wait(
+                    self.injector, framer, self.server, self.game, selector, "server"
+                ):
+                    continue
+                data = framer.recv_into(self.game)
+                if not data:
+                    break  # client disconnected
+                received = time.perf_counter()
+                count = framer.count
+                if self.pipeline is not None:
+                    # forward straight away, the pipeline parses packets later
+                    self.server.sendall(data)
+                    for packet in framer.frames():
+                        self.pipeline.submit(self.session, bytes(packet), "client")
+                else:
+                    # forward after processing, so handlers can drop or replace packets
+                    with self.session.lock:  # the other direction parses on its thread
+                        forward = filter_packets(framer, "client", self.session)
+                    if forward:
+                        self.server.sendall(forward)
+                direction.forwarded(len(data), framer.count - count, received)
+        except OSError:
+            pass  # either side disconnected
+        finally:
+            METRICS.sessions -= 1
+            stop_waking(self.injector, selector)
+            disconnect(self.server)
+
+
+def disconnect(sock):
+    """Shut down a socket, so the thread reading from it stops too."""
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass  # already disconnected
+
+
+def wake_on_inject(injector, source):
+    """Return a selector that wakes up on data from source, or a packet being injected.
+
+    A selector is used rather than select.select(), which fails for file descriptors
+    of FD_SETSIZE (1024 on Linux) and above.
+
+    """
+    wake, waker = socket.socketpair()
+    waker.setblocking(False)
+
+    def wake_up():
+        try:
+            waker.send(NULL_BYTE)
+        except OSError:
+            pass  # buffer is full or closed, so the pipe will wake up anyway
+
+    injector.waker = wake_up
+    selector = selectors.DefaultSelector()
+    selector.register(source, selectors.EVENT_READ)
+    selector.register(wake, selectors.EVENT_READ, waker)
+    return selector
+
+
+def stop_waking(injector, selector):
+    """Close the selector returned by wake_on_inject(), and its wake up sockets."""
+    injector.waker = None
+    for key in list(selector.get_map().values()):
+        if key.data is not None:  # the wake up socket pair
+            key.fileobj.close()
+            key.data.close()
+    selector.close()
+
+
+def inject_and_wait(injector, framer, dest, source, selector, label):
+    """Send injected packets that are due, then wait for data or another injection.
+
+    Injected packets are only sent between packets, never in the middle of one that is
+    still being forwarded.
+
+    :returns: True if there is data to receive from source.
+
+    """
+    timeout = None  # wait for the rest of the packet before injecting
+    if not framer.pending:
+        data, timeout = injector.pop()
+        if data:
+            log.info("injected", to=label, packets=data)
+            dest.sendall(data)
+    readable = False
+    for key, _ in selector.select(timeout):
+        if key.data is None:
+            readable = True
+        else:
+            key.fileobj.recv(4096)  # woken up by an injection
+    return readable
 
 
 class Proxy(Thread):
     """This class serves as a bridge between the client and server."""
 
-    def __init__(self, from_host, to_host, port):
-        """Initialize the proxy."""
+    def __init__(
+        self, from_host, to_host, port, to_port=None, pipeline=None, pool=None
+    ):
+        """Initialize the proxy, to_port defaults to the port the proxy listens on.
+
+        If a ParsePipeline is given, packets are forwarded before they are parsed. If
+        an upstream.UpstreamPool is given, clients are bridged to its connections
+        instead of connecting to the server once they have connected.
+
+        """
         super(Proxy, self).__init__()
         self.from_host = from_host
         self.to_host = to_host
         self.port = port
+        self.to_port = port if to_port is None else to_port
+        self.pipeline = pipeline
+        self.pool = pool or UpstreamPool(to_host, self.to_port, size=0)
+        self.session_ids = SESSION_IDS  # shared by every engine
         self.g2p = None
         self.p2s = None
+        self.ready = Event()  # set once the listener is bound
 
     def run(self):
-        """Create the two proxy connections and set up the bridge."""
+        """Accept clients, and bridge each one to its own connection to the server."""
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.from_host, self.port))
+        listener.listen(16)
+        self.port = listener.getsockname()[1]
+        self.ready.set()
         while True:
-            print("[proxy({})] setting up - waiting for connection".format(self.port))
-            self.g2p = Game2Proxy(self.from_host, self.port)  # waiting for a client
-            self.p2s = Proxy2Server(self.to_host, self.port)
-            print("[proxy({})] connection established".format(self.port))
+            log.info("waiting_for_client", port=self.port)
+            game, _ = listener.accept()
+            accepted = time.perf_counter()
+            tune_socket(game, self.pool.buffer_size)
+            session_id = next(self.session_ids)
+            try:
+                server = self.pool.get()
+            except OSError as exception:
+                log.warning("connect_failed", session=session_id, error=repr(exception))
+                game.close()
+                continue
+            METRICS.connect_latency.observe(time.perf_counter() - accepted)
+            self.g2p = Game2Proxy(game)
+            self.p2s = Proxy2Server(server)
+            session = Session(session_id, **SESSION_OPTIONS)
+            log.info("connected", port=self.port, session=session.session_id)
             self.g2p.server = self.p2s.server
             self.p2s.game = self.g2p.game
+            for pipe in (self.g2p, self.p2s):
+                pipe.session = session
+                pipe.pipeline = self.pipeline
 
             self.g2p.start()
             self.p2s.start()
 
 
-def process_packet(packet, origin):
+class AsyncPipe:
+    """One direction of a session bridged by the asyncio engine, eg. client->server."""
+
+    def __init__(self, reader, writer, origin, session, pipeline=None):
+        """Initialize the pipe, data read from reader is forwarded to writer."""
+        self.reader = reader
+        self.writer = writer
+        self.origin = origin
+        self.session = session
+        self.pipeline = pipeline
+        self.injector = InjectionScheduler()
+        self.framer = PacketFramer()
+        self.wake = asyncio.Event()
+
+    async def run(self):
+        """Receive packets, run them through the parser module and forward them."""
+        framer = self.framer
+        loop = asyncio.get_running_loop()
+
+        def wake_up():
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self.wake.set)
+
+        self.injector.waker = wake_up
+        injecting = asyncio.create_task(self.inject())
+        direction = METRICS.directions[self.origin]
+        try:
+            while True:
+                data = await self.reader.read(4096)
+                if not data:
+                    break
+                received = time.perf_counter()
+                count = framer.count
+                framer.feed(data)
+                if self.pipeline is not None:
+                    # forward straight away, the pipeline parses packets later
+                    self.writer.write(data)
+                    for packet in framer.frames():
+                        await self.submit(bytes(packet))
+                    direction.forwarded(len(data), framer.count - count, received)
+                    if not framer.pending and self.injector:
+                        self.wake.set()  # injection was held back until now
+                    await self.writer.drain()
+                    continue
+                # forward after processing, so handlers can drop or replace packets
+                forward = filter_packets(framer, self.origin, self.session)
+                if forward:
+                    # the transport may keep what it's given until it is sent, and the
+                    # framer's buffer is reused by the next feed(), so copy it
+                    self.writer.write(bytes(forward))
+                direction.forwarded(len(data), framer.count - count, received)
+                if not framer.pending and self.injector:
+                    self.wake.set()  # injection was held back until now
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.injector.waker = None
+            injecting.cancel()
+
+    async def inject(self):
+        """Send injected packets as soon as they are due."""
+        while True:
+            self.wake.clear()
+            timeout = None  # wait for the rest of the packet before injecting
+            if not self.framer.pending:
+                data, timeout = self.injector.pop()
+                if data:
+                    log.info("injected", session=self.session.session_id, packets=data)
+                    self.writer.write(data)
+                    await self.writer.drain()
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def submit(self, packet):
+        """Hand a packet to the pipeline without blocking the event loop."""
+        if not self.pipeline.offer(self.session, packet, self.origin):
+            # queue is full, wait for room on a thread so other sessions keep going
+            await asyncio.to_thread(
+                self.pipeline.submit, self.session, packet, self.origin
+            )
+
+
+class AsyncSession:
+    """A single client<->server pair, with its own buffers and injection queues."""
+
+    def __init__(self, session, game, server, pipeline=None):
+        """Initialize the session from (reader, writer) pairs for both connections.
+
+        Both pipes parse on the event loop's thread, so they share the session.Session
+        without needing its lock.
+
+        """
+        self.session = session
+        self.task = None  # set by the proxy once the session is running
+        self.game_writer = game[1]
+        self.server_writer = server[1]
+        # named after the threaded classes so injection works the same for both
+        self.g2p = AsyncPipe(game[0], server[1], "client", session, pipeline)
+        self.p2s = AsyncPipe(server[0], game[1], "server", session, pipeline)
+
+    def close(self):
+        """Disconnect both sides of the session."""
+        self.game_writer.close()
+        self.server_writer.close()
+
+    async def run(self):
+        """Bridge both directions until either side disconnects."""
+        tasks = [
+            asyncio.create_task(self.g2p.run()),
+            asyncio.create_task(self.p2s.run()),
+        ]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.close()
+
+
+class AsyncProxy(Thread):
+    """Bridge many concurrent clients to the server from a single asyncio event loop.
+
+    The event loop runs in its own thread, so this can be used as a drop-in replacement
+    for Proxy. g2p and p2s point at the pipes of the most recently connected session.
+
+    """
+
+    def __init__(
+        self, from_host, to_host, port, to_port=None, pipeline=None, pool=None
+    ):
+        """Initialize the proxy, to_port defaults to the port the proxy listens on.
+
+        If a ParsePipeline is given, packets are forwarded before they are parsed. If
+        an upstream.UpstreamPool is given, clients are bridged to its connections
+        instead of connecting to the server once they have connected.
+
+        """
+        super(AsyncProxy, self).__init__(daemon=True)
+        self.from_host = from_host
+        self.to_host = to_host
+        self.port = port
+        self.to_port = port if to_port is None else to_port
+        self.pipeline = pipeline
+        self.pool = pool or UpstreamPool(to_host, self.to_port, size=0)
+        self.sessions = {}
+        self.session_ids = SESSION_IDS  # shared by every engine
+        self.g2p = None
+        self.p2s = None
+        self.loop = None
+        self.server = None
+        self.ready = Event()  # set once the listener is bound
+
+    def run(self):
+        """Run the event loop until stop() is called."""
+        asyncio.run(self.serve())
+
+    def stop(self):
+        """Stop accepting new clients and disconnect existing sessions.
+
+        This can be called from any thread.
+
+        """
+        self.loop.call_soon_threadsafe(self.close)
+
+    def close(self):
+        """Stop accepting new clients and disconnect existing sessions."""
+        self.server.close()
+        for session in list(self.sessions.values()):
+            session.close()
+
+    async def serve(self):
+        """Listen for clients, each one gets its own session."""
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(
+            self.handle_client, self.from_host, self.port, backlog=1024
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        log.info("listening", port=self.port)
+        self.ready.set()
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        # let sessions disconnected by close() finish before the loop shuts down
+        tasks = [session.task for session in self.sessions.values()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def handle_client(self, game_reader, game_writer):
+        """Connect a newly accepted client to the server and bridge the two."""
+        accepted = time.perf_counter()
+        session_id = next(self.session_ids)
+        # asyncio already sets TCP_NODELAY, this only sets the buffer sizes
+        tune_socket(game_writer.get_extra_info("socket"), self.pool.buffer_size)
+        try:
+            sock = self.pool.take()
+            if sock is not None:
+                server = await asyncio.open_connection(sock=sock)
+            else:
+                server = await asyncio.open_connection(self.to_host, self.to_port)
+                sock = server[1].get_extra_info("socket")
+                tune_socket(sock, self.pool.buffer_size)
+        except OSError as exception:
+            log.warning("connect_failed", session=session_id, error=repr(exception))
+            game_writer.close()
+            return
+        METRICS.connect_latency.observe(time.perf_counter() - accepted)
+        session = AsyncSession(
+            Session(session_id, **SESSION_OPTIONS),
+            (game_reader, game_writer),
+            server,
+            self.pipeline,
+        )
+        session.task = asyncio.current_task()
+        self.sessions[session_id] = session
+        self.g2p, self.p2s = session.g2p, session.p2s
+        METRICS.sessions += 1
+        try:
+            await session.run()
+        finally:
+            METRICS.sessions -= 1
+            del self.sessions[session_id]
+
+
+def report_stats(proxy, interval):
+    """Show every player's live stats to the client in chat, every interval seconds.
+
+    Stats are shown in the most recently connected session. This is run on its own
+    thread.
+
+    """
+    while True:
+        time.sleep(interval)
+        pipe = proxy.p2s
+        if pipe is None:
+            continue
+        session = pipe.session
+        packet = session.stats.chat_packet(session.now())
+        if packet is not None:
+            pipe.injector.send(packet + NULL_BYTE)
+
+
+def filter_packets(framer, origin, session):
+    """Process every complete packet in a framer, returns the data to forward.
+
+    Incomplete packets are held back until they can be processed. When every packet is
+    passed, the data returned is a view of the framer's buffer, which is only valid
+    until the framer is next fed, otherwise the stream is rebuilt without dropped
+    packets and with replaced ones. Packets over the framer's max_frame are never
+    forwarded.
+
+    """
+    view = framer.view
+    first = None  # start of the first packet
+    end = None  # just after the last packet's NUL byte
+    pieces = None  # only built once a packet is dropped or replaced
+    for packet in framer.frames():
+        end = framer.start
+        start = end - len(packet) - 1
+        if first is None:
+            first = start
+        verdict = process_packet(packet, origin, session)
+        if verdict == PASS:
+            if pieces is not None:
+                pieces.append(view[start:end])
+            continue
+        if pieces is None:
+            pieces = [view[first:start]]
+        if verdict != DROP:
+            pieces.append(verdict)
+            pieces.append(NULL_BYTE)
+    if first is None:
+        return b""
+    if pieces is None:
+        # not framer.start, which skips past the start of an oversized packet
+        return view[first:end]
+    return b"".join(pieces)
+
+
+def process_packet(packet, origin, session, received=None):
     """Process a packet of data.
 
     This is a shared wrapper for processing data from both client and server.
 
-    :param packet: bytes object representing binary data for one packet
-    :param origin: string representing origin of packet, eg. "server"
+    :param packet:   bytes-like object representing binary data for one packet
+    :param origin:   string representing origin of packet, eg. "server"
+    :param session:  the session.Session the packet was received on
+    :param received: time.time() the packet was received, defaults to now
+    :returns:        The verdict on the packet, PASS, DROP or a replacement packet
 
     """
+    if session.recorder is not None:
+        session.recorder.write_packet(session.session_id, origin, packet, received)
+    session.received = received  # so handlers time the game by when packets arrived
+    start = time.perf_counter()
     try:
         # print(origin, packet)
-        reload(parser)
-        parser.parse(packet, origin, PERSISTENT_DATA)
+        verdict = PARSER.get().parse(packet, origin, session)
     except Exception as exception:
-        print(f"Error processing {origin} packet:", packet[:32], "…")
-        print(repr(exception))
+        log.error(
+            "parse_error",
+            origin=origin,
+            packet=bytes(packet[:32]),
+            error=repr(exception),
+        )
+        return PASS
+    finally:
+        METRICS.directions[origin].parse_latency.observe(time.perf_counter() - start)
+    return PASS if verdict is None else verdict
 
 
 def main():
     """Run the script."""
-    proxy = Proxy(PROXY_IP, TF_SERVER, TF_PORT)
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument(
+        "--engine",
+        choices=["thread", "async"],
+        default="thread",
+        help="async serves many concurrent sessions from a single event loop",
+    )
+    arg_parser.add_argument(
+        "--pipeline",
+        choices=POLICIES,
+        help="forward packets before parsing them on worker threads, "
+        "using this policy when the parse queue is full",
+    )
+    arg_parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="store boards that haven't changed as repeats of the previous frame",
+    )
+    arg_parser.add_argument(
+        "--record",
+        metavar="PATH",
+        help="append raw packets and decoded boards to a binary recording",
+    )
+    arg_parser.add_argument(
+        "--export",
+        metavar="DIR",
+        help="write every player's fumen to this directory when a game ends",
+    )
+    arg_parser.add_argument(
+        "--export-workers",
+        type=int,
+        default=2,
+        help="processes that finish and write fumens",
+    )
+    arg_parser.add_argument(
+        "--export-limit",
+        type=int,
+        default=4,
+        help="games exported at once, later games wait for one to finish",
+    )
+    arg_parser.add_argument(
+        "--stats-interval",
+        type=float,
+        metavar="SECONDS",
+        help="show live stats for every player in chat this often during games",
+    )
+    arg_parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve Prometheus metrics at http://127.0.0.1:PORT/metrics",
+    )
+    arg_parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        metavar="SECONDS",
+        help="print a summary of the metrics this often",
+    )
+    arg_parser.add_argument(
+        "--log-level", choices=list(log.LEVELS), default="info", help="default: info"
+    )
+    arg_parser.add_argument("--log-format", choices=log.FORMATS, default="text")
+    arg_parser.add_argument(
+        "--log-file", metavar="PATH", help="append the log to a file, not stdout"
+    )
+    arg_parser.add_argument("--workers", type=int, default=2)
+    arg_parser.add_argument("--queue-size", type=int, default=1024)
+    arg_parser.add_argument(
+        "--port", type=int, default=TF_PORT, help="port to listen on for the game"
+    )
+    arg_parser.add_argument(
+        "--server-host",
+        default=TF_SERVER,
+        help="server to forward to, eg. 127.0.0.1 for fakeserver.py",
+    )
+    arg_parser.add_argument("--server-port", type=int, default=TF_PORT)
+    arg_parser.add_argument(
+        "--pool",
+        type=int,
+        default=1,
+        help="connections to the server kept open for the next clients, "
+        "0 connects once a client has connected",
+    )
+    arg_parser.add_argument(
+        "--socket-buffer",
+        type=int,
+        metavar="BYTES",
+        help="send and receive buffer size of every socket, default: chosen by the OS",
+    )
+    args = arg_parser.parse_args()
+
+    log_file = open(args.log_file, "a") if args.log_file else None
+    log.configure(log_file, log.LEVELS[args.log_level], args.log_format)
+    SESSION_OPTIONS["dedup_frames"] = args.dedup
+    if args.record:
+        SESSION_OPTIONS["recorder"] = RecordingWriter(args.record)
+    if args.export:
+        SESSION_OPTIONS["exporter"] = GameExporter(
+            args.export, args.export_workers, args.export_limit
+        )
+    for output in (SESSION_OPTIONS["recorder"], SESSION_OPTIONS["exporter"]):
+        if output is not None:
+            # carry on from the ids used by previous runs
+            SESSION_IDS.skip_past(output.last_session)
+            GAME_IDS.skip_past(output.last_game)
+    pipeline = None
+    if args.pipeline:
+        pipeline = ParsePipeline(
+            process_packet, args.workers, args.queue_size, args.pipeline
+        )
+        pipeline.start()
+
+    pool = UpstreamPool(
+        args.server_host, args.server_port, args.pool, args.socket_buffer
+    )
+    pool.start()
+    if args.engine == "async":
+        proxy = AsyncProxy(
+            PROXY_IP,
+            args.server_host,
+            args.port,
+            args.server_port,
+            pipeline=pipeline,
+            pool=pool,
+        )
+    else:
+        proxy = Proxy(
+            PROXY_IP,
+            args.server_host,
+            args.port,
+            args.server_port,
+            pipeline=pipeline,
+            pool=pool,
+        )
     proxy.start()
+    if pipeline is not None:
+        METRICS.gauge("tf_parse_queue_depth", pipeline.queue_depth)
+    METRICS.gauge("tf_upstream_idle", lambda: len(pool.idle))
+    METRICS.gauge(
+        "tf_inject_queue_depth",
+        lambda: sum(len(pipe.injector) for pipe in (proxy.g2p, proxy.p2s) if pipe),
+    )
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    if args.metrics_interval:
+        Thread(target=metrics.dump, args=(args.metrics_interval,), daemon=True).start()
+    if args.stats_interval:
+        Thread(
+            target=report_stats, args=(proxy, args.stats_interval), daemon=True
+        ).start()
 
     # some simple input so user can inject commands, etc.
     while True:
         try:
             cmd = input("$ ")
             if cmd[:1] == "q":
+                if SESSION_OPTIONS["recorder"] is not None:
+                    SESSION_OPTIONS["recorder"].flush()
+                if SESSION_OPTIONS["exporter"] is not None:
+                    SESSION_OPTIONS["exporter"].close()
+                log.flush()
                 # sys.exit doesn't work, there's probably a better way to do this
                 os._exit(0)  # pylint: disable=W0212
             elif cmd[:1] == "s":
                 # send packet to server (from client)
                 packet = cmd[1:].encode() + NULL_BYTE
-                proxy.g2p.queue.append(packet)
+                proxy.g2p.injector.send(packet, priority=1)
                 print("c->s:", packet)
             elif cmd[:1] == "c":
                 # send packet to client (from server)
                 packet = cmd[1:].encode() + NULL_BYTE
-                proxy.p2s.queue.append(packet)
+                proxy.p2s.injector.send(packet, priority=1)
                 print("s->c:", packet)
+            elif cmd[:1] == "t":
+                # print hit counts and handler time per message type
+                for router, commands in dispatch.stats().items():
+                    for command, (hits, seconds) in commands.items():
+                        print(f"{router} {command}: {hits} hits, {seconds:.3f}s")
+                print("snapshot cache:", read_snapshot.cache_info())
+            elif cmd[:1] == "l":
+                # print live stats for the game in the most recent session
+                session = proxy.p2s.session
+                for player, summary in session.stats.summary(session.now()).items():
+                    print(player, summary)
+            elif cmd[:1] == "i":
+                # print injection counters and latencies for both directions
+                print("c->s:", proxy.g2p.injector.stats())
+                print("s->c:", proxy.p2s.injector.stats())
+            elif cmd[:1] == "p" and pipeline is not None:
+                # print parse pipeline counters
+                print(pipeline.stats())
+            elif cmd[:1] == "e" and SESSION_OPTIONS["exporter"] is not None:
+                # print game export counters
+                print(SESSION_OPTIONS["exporter"].stats())
+            elif cmd[:1] == "u":
+                # print upstream connection pool counters
+                print(pool.stats())
         except Exception as exception:
             print(exception)
 
@@ -0,0 +1,224 @@
+"""Record games to an append-only binary file, and read them back.
+
+A recording starts with MAGIC, followed by any number of records. Every record is a
+fixed size header (see HEADER) followed by its payload, which is either the raw bytes
+of a packet or the 200 cells of a decoded board. Records are only ever appended, so a
+recording is still readable up to the last complete record if the proxy crashes.
+
+"""
+import mmap
+import struct
+import time
+from collections import defaultdict, namedtuple
+from threading import Lock
+
+import fumen
+from board import HEIGHT, WIDTH, Board
+
+MAGIC = b"TFREC\x00\x01\x00"
+# timestamp, session, game, player, origin, kind, incoming lines, payload length
+HEADER = struct.Struct("<dIIIBBBxI")
+
+ORIGINS = ["client", "server"]
+PACKET = 0  # payload is a raw packet
+BOARD = 1  # payload is a board, in the same layout as Board.cells
+
+Record = namedtuple(
+    "Record",
+    "timestamp session game player origin kind incoming_lines data",
+)
+
+
+def last_ids(path):
+    """Return the highest (session id, game id) in a recording."""
+    last_session = last_game = 0
+    recording = Recording(path, index=False)
+    try:
+        recording.index()
+        for pos in recording.offsets:
+            header = HEADER.unpack_from(recording.view, pos)
+            last_session = max(last_session, header[1])
+            last_game = max(last_game, header[2])
+    finally:
+        recording.close()
+    return last_session, last_game
+
+
+class RecordingWriter:
+    """Append records to a recording file.
+
+    Writes are buffered, and can be made from any thread. The buffer is flushed at least
+    every flush_interval seconds (when the next record is written), so little is lost
+    if the proxy crashes.
+
+    """
+
+    def __init__(self, path, buffer_size=1 << 16, flush_interval=1.0):
+        """Open a recording for appending, creating it if it doesn't exist."""
+        self.file = open(path, "ab", buffering=buffer_size)
+        # highest ids already in the recording, new sessions and games must use others
+        self.last_session = self.last_game = 0
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        else:
+            self.last_session, self.last_game = last_ids(path)
+        self.lock = Lock()
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+
+    def write(self, record):
+        """Append a Record, its data can be any bytes-like object."""
+        header = HEADER.pack(
+            time.time() if record.timestamp is None else record.timestamp,
+            record.session,
+            record.game,
+            record.player,
+            ORIGINS.index(record.origin),
+            record.kind,
+            record.incoming_lines,
+            len(record.data),
+        )
+        with self.lock:
+            self.file.write(header)
+            self.file.write(record.data)
+            now = time.monotonic()
+            if now - self.last_flush >= self.flush_interval:
+                self.file.flush()
+                self.last_flush = now
+
+    def write_packet(self, session, origin, packet, timestamp=None):
+        """Append a raw packet, origin is "client" or "server"."""
+        self.write(Record(timestamp, session, 0, 0, origin, PACKET, 0, packet))
+
+    def write_board(
+        self, session, game, player, board, incoming_lines=0, timestamp=None
+    ):
+        """Append a player's board, as received from the server."""
+        self.write(
+            Record(
+                timestamp,
+                session,
+                game,
+                player,
+                "server",
+                BOARD,
+                incoming_lines,
+                board.cells,
+            )
+        )
+
+    def flush(self):
+        """Write any buffered records to disk."""
+        with self.lock:
+            self.file.flush()
+            self.last_flush = time.monotonic()
+
+    def close(self):
+        """Flush and close the recording."""
+        with self.lock:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Recording:
+    """Read a recording through a memory map, without copying record data.
+
+    Board records are indexed by game and player when the recording is opened.
+
+    """
+
+    def __init__(self, path, index=True):
+        """Open and index a recording.
+
+        :param index: False skips indexing, for reading records by offset with read()
+
+        """
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        if self.view[: len(MAGIC)] != MAGIC:
+            raise ValueError("Not a recording, or an unsupported version.")
+        self.offsets = []  # offset of every complete record
+        self.boards = defaultdict(list)  # (game, player) -> record indexes
+        if index:
+            self.index()
+
+    def index(self):
+        """Find every complete record, a truncated record at the end is ignored."""
+        pos = len(MAGIC)
+        size = len(self.view)
+        while pos + HEADER.size <= size:
+            header = HEADER.unpack_from(self.view, pos)
+            end = pos + HEADER.size + header[-1]
+            if end > size:
+                break
+            if header[5] == BOARD:
+                self.boards[(header[2], header[3])].append(len(self.offsets))
+            self.offsets.append(pos)
+            pos = end
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        """Return a Record, data is a memoryview into the recording."""
+        return self.read(self.offsets[index])
+
+    def read(self, pos):
+        """Return the Record at an offset, data is a memoryview into the recording."""
+        header = HEADER.unpack_from(self.view, pos)
+        start = pos + HEADER.size
+        data = self.view[start : start + header[-1]]
+        return Record(*header[:4], ORIGINS[header[4]], *header[5:7], data)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self.offsets)))
+
+    def games(self):
+        """Return a sorted list of the ids of games with boards recorded."""
+        return sorted({game for game, _ in self.boards})
+
+    def players(self, game):
+        """Return a sorted list of the players with boards recorded in a game."""
+        return sorted(player for g, player in self.boards if g == game)
+
+    def board_records(self, game, player):
+        """Return the board Records of one player in a game, in order."""
+        return [self[i] for i in self.boards[(game, player)]]
+
+    def board_arrays(self, game, player):
+        """Return a player's boards as (20, 10) memoryviews into the recording."""
+        return [
+            record.data.cast("B", (HEIGHT, WIDTH))
+            for record in self.board_records(game, player)
+        ]
+
+    def export_fumen(self, game, player):
+        """Encode a player's boards in a game as a fumen, commented with the time."""
+        records = self.board_records(game, player)
+        if not records:
+            raise KeyError(f"No boards for player {player} in game {game}.")
+        start = records[0].timestamp
+        return fumen.encode(
+            (
+                Board(record.data),
+                time.strftime("%M:%S", time.gmtime(record.timestamp - start)),
+            )
+            for record in records
+        )
+
+    def close(self):
+        """Close the memory map, any views of records must be released first."""
+        self.view.release()
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,275 @@
+"""Replay recorded sessions through the parser, without a live server.
+
+Packets are read from a recording (see recording.py) and either passed straight to
+proxy.process_packet, or played back through an AsyncProxy by a fake client and server
+that each send their side of the recorded sessions. Both modes report throughput and
+per-packet latency, eg.
+
+    py ./replay.py games.rec                        # as fast as possible
+    py ./replay.py games.rec --speed 1              # in real time
+    py ./replay.py games.rec --speed 100 --network  # 100x, through the proxy
+
+Replaying straight to the parser is deterministic, packets are parsed in exactly the
+order they were recorded in. Through the proxy, order is only kept within each
+direction of a session, just like it is with live traffic.
+
+"""
+import argparse
+import asyncio
+import contextlib
+import statistics
+import time
+from collections import defaultdict, deque
+
+import log
+import proxy
+from framing import NULL_BYTE, PacketFramer
+from recording import PACKET, Recording
+from session import Session
+
+
+def packet_records(recording, sessions=None):
+    """Yield the packet Records in a recording, optionally only from some sessions."""
+    for record in recording:
+        if record.kind == PACKET and (sessions is None or record.session in sessions):
+            yield record
+
+
+class Clock:
+    """Decide when recorded packets are due to be replayed."""
+
+    def __init__(self, first, speed=None):
+        """Initialize the clock, starting now.
+
+        :param first: Timestamp of the first recorded packet
+        :param speed: Replay this many times faster than real time, None or 0 replays
+                      as fast as possible
+
+        """
+        self.first = first
+        self.speed = speed
+        self.start = time.perf_counter()
+
+    def delay(self, timestamp):
+        """Return the seconds until a packet recorded at timestamp is due, or 0."""
+        if not self.speed:
+            return 0
+        due = (timestamp - self.first) / self.speed
+        return max(0.0, due - (time.perf_counter() - self.start))
+
+
+class ReplayReport:
+    """Count replayed packets and their latencies."""
+
+    def __init__(self, name):
+        """Initialize an empty report."""
+        self.name = name
+        self.bytes = 0
+        self.latencies = []
+        self.elapsed = 0.0
+
+    def add(self, size, latency):
+        """Count a packet of size bytes that took latency seconds."""
+        self.bytes += size
+        self.latencies.append(latency)
+
+    def print(self):
+        """Print throughput and latency percentiles."""
+        packets = len(self.latencies)
+        print(f"{self.name}: {packets:,} packets, {self.bytes:,} bytes")
+        if not packets:
+            return
+        latencies = sorted(self.latencies)
+        elapsed = self.elapsed or float("nan")
+        print(f"  packets/sec:    {packets / elapsed:,.0f}")
+        print(f"  MB/sec:         {self.bytes / elapsed / 1e6:,.2f}")
+        print(f"  latency median: {statistics.median(latencies) * 1000:.3f}ms")
+        print(f"  latency p99:    {latencies[int(packets * 0.99) - 1] * 1000:.3f}ms")
+        print(f"  latency max:    {latencies[-1] * 1000:.3f}ms")
+
+
+def replay(recording, speed=None, sessions=None, handler=proxy.process_packet):
+    """Pass recorded packets to handler(packet, origin, session, received).
+
+    Every recorded session is replayed into a new session.Session, so every replay
+    starts from the same state.
+
+    :returns: A ReplayReport, latency is the time handler took for each packet.
+
+    """
+    replayed = {}  # recorded session id -> Session
+    report = ReplayReport("parser")
+    clock = None
+    start = time.perf_counter()
+    for record in packet_records(recording, sessions):
+        if clock is None:
+            clock = Clock(record.timestamp, speed)
+        delay = clock.delay(record.timestamp)
+        if delay:
+            time.sleep(delay)
+        session = replayed.get(record.session)
+        if session is None:
+            session = replayed[record.session] = Session(record.session)
+        sent = time.perf_counter()
+        handler(record.data, record.origin, session, record.timestamp)
+        report.add(len(record.data), time.perf_counter() - sent)
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+class NetworkReplay:
+    """Replay recorded sessions through an AsyncProxy, from a fake client and server.
+
+    Every recorded session gets its own connection. The client sends the packets that
+    were recorded from the client, the server sends the ones recorded from the server,
+    and latency is the time from a packet being sent at one end to it being received
+    at the other.
+
+    """
+
+    def __init__(self, recording, speed=None, sessions=None, pipeline=None):
+        """Initialize the replay, see replay() for the arguments."""
+        self.sessions = defaultdict(list)  # session id -> packet records
+        for record in packet_records(recording, sessions):
+            self.sessions[record.session].append(record)
+        self.speed = speed
+        self.pipeline = pipeline
+        self.reports = {
+            "client": ReplayReport("client->server"),
+            "server": ReplayReport("server->client"),
+        }
+        self.clocks = {}  # session id -> Clock shared by both ends
+        self.in_flight = {}  # (session id, origin) -> send times of unreceived packets
+        self.connecting = None  # held while a client connects, so the server knows
+        self.accepted = None  # which session each accepted connection belongs to
+
+    async def run(self):
+        """Replay every session concurrently, returns the report for each direction."""
+        self.connecting = asyncio.Lock()
+        self.accepted = asyncio.Queue()
+        server = await asyncio.start_server(self.handle_proxy, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        engine = proxy.AsyncProxy(
+            "127.0.0.1", "127.0.0.1", 0, to_port=port, pipeline=self.pipeline
+        )
+        engine.start()
+        await asyncio.to_thread(engine.ready.wait)
+
+        start = time.perf_counter()
+        with contextlib.closing(server):
+            await asyncio.gather(
+                *(self.play_client(session, engine.port) for session in self.sessions)
+            )
+        for report in self.reports.values():
+            report.elapsed = time.perf_counter() - start
+        engine.stop()
+        await asyncio.to_thread(engine.join)
+        return list(self.reports.values())
+
+    async def play_client(self, session_id, port):
+        """Connect through the proxy and play the client side of a session."""
+        async with self.connecting:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            await self.accepted.put(session_id)
+            # wait for the proxy to connect to the server, which takes the session id
+            await self.accepted.join()
+        await self.play(session_id, "client", reader, writer)
+
+    async def handle_proxy(self, reader, writer):
+        """Play the server side of the session the proxy has just connected for."""
+        session_id = await self.accepted.get()
+        records = self.sessions[session_id]
+        self.clocks[session_id] = Clock(records[0].timestamp, self.speed)
+        self.accepted.task_done()
+        await self.play(session_id, "server", reader, writer)
+
+    async def play(self, session_id, origin, reader, writer):
+        """Send one end's packets and receive the other end's, then disconnect."""
+        other = "server" if origin == "client" else "client"
+        records = self.sessions[session_id]
+        for key in ((session_id, origin), (session_id, other)):
+            self.in_flight.setdefault(key, deque())
+        expected = sum(record.origin == other for record in records)
+        try:
+            await asyncio.gather(
+                self.send(session_id, origin, writer),
+                self.receive(session_id, other, reader, expected),
+            )
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def send(self, session_id, origin, writer):
+        """Send the packets recorded from origin, when they are due."""
+        clock = self.clocks[session_id]
+        in_flight = self.in_flight[(session_id, origin)]
+        for record in self.sessions[session_id]:
+            if record.origin != origin:
+                continue
+            delay = clock.delay(record.timestamp)
+            if delay:
+                await asyncio.sleep(delay)
+            in_flight.append(time.perf_counter())
+            writer.write(bytes(record.data) + NULL_BYTE)
+            await writer.drain()
+
+    async def receive(self, session_id, origin, reader, expected):
+        """Receive the packets sent from origin, timing each one."""
+        report = self.reports[origin]
+        in_flight = self.in_flight[(session_id, origin)]
+        framer = PacketFramer()
+        while expected:
+            data = await reader.read(65536)
+            if not data:
+                break
+            received = time.perf_counter()
+            framer.feed(data)
+            for packet in framer.frames():
+                report.add(len(packet), received - in_flight.popleft())
+                expected -= 1
+
+
+def main():
+    """Replay a recording and print a report."""
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("recording", help="a file written by proxy.py --record")
+    arg_parser.add_argument(
+        "--speed",
+        type=float,
+        help="replay this many times faster than real time (1 is real time), "
+        "by default packets are replayed as fast as possible",
+    )
+    arg_parser.add_argument(
+        "--session",
+        type=int,
+        action="append",
+        help="only replay this session, can be given more than once",
+    )
+    arg_parser.add_argument(
+        "--network",
+        action="store_true",
+        help="replay through an AsyncProxy, instead of straight to the parser",
+    )
+    arg_parser.add_argument(
+        "--quiet", action="store_true", help="hide the parser's output"
+    )
+    args = arg_parser.parse_args()
+
+    sessions = set(args.session) if args.session else None
+    if args.quiet:
+        log.configure(level=log.OFF)
+    with Recording(args.recording) as recording:
+        if args.network:
+            replayer = NetworkReplay(recording, args.speed, sessions)
+            reports = asyncio.run(replayer.run())
+            del replayer  # release the views of the recording
+        else:
+            reports = [replay(recording, args.speed, sessions)]
+    log.flush()
+    for report in reports:
+        report.print()
+
+
+if __name__ == "__main__":
+    main()
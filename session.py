@@ -0,0 +1,100 @@
+"""Keep the state of each client<->server connection separate.
+
+Every connection the proxy accepts gets its own Session, which is passed to the packet
+handlers instead of a dict shared by every connection. Games played on different
+connections never see each other's frames, and a game ending only resets the session
+it was played in.
+
+A session has a single owner, so its state is changed without locks:
+* The async engine parses every packet of a session on its event loop
+* A ParsePipeline always parses the packets of a session on the same worker
+* The threaded engine parses each direction on its own thread, so it holds the
+  session's lock while parsing. Only the two threads of the same session ever wait
+  for it, sessions never wait for each other.
+
+This module is never reloaded, so sessions survive the parser being live edited.
+
+"""
+import time
+from threading import Lock
+
+from livestats import LiveStats
+
+
+class IdSequence:
+    """Hand out increasing ids, from any thread."""
+
+    def __init__(self, start=1):
+        """Initialize the sequence, start is the first id handed out."""
+        self.next_id = start
+        self.lock = Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.lock:
+            value = self.next_id
+            self.next_id += 1
+            return value
+
+    def skip_past(self, used):
+        """Only hand out ids greater than used, eg. the highest id in a recording."""
+        with self.lock:
+            self.next_id = max(self.next_id, used + 1)
+
+
+# ids of sessions and games, for recordings and exported fumens, which are kept across
+# restarts of the proxy. The proxy skips past the ids already in the recording it
+# appends to and in its export directory, so games from different runs never merge.
+SESSION_IDS = IdSequence()
+GAME_IDS = IdSequence()
+
+
+class Session:
+    """The state of one client<->server connection."""
+
+    def __init__(self, session_id, recorder=None, dedup_frames=False, exporter=None):
+        """Initialize a session with no game in progress.
+
+        :param session_id:   Unique id of the session, eg. for recordings
+        :param recorder:     A RecordingWriter, if games are being recorded
+        :param dedup_frames: Store boards that haven't changed as repeats of the
+                             previous frame
+        :param exporter:     An export.GameExporter, if finished games are exported
+
+        """
+        self.session_id = session_id
+        self.recorder = recorder
+        self.dedup_frames = dedup_frames
+        self.exporter = exporter
+        self.lock = Lock()  # only used by the threaded engine, see above
+        self.stats = LiveStats()
+        self.game_started = False
+        self.game_id = 0
+        self.start_time = 0.0  # now() when the game started
+        # time.time() the packet being parsed was received, None if it is being parsed
+        # as it arrives. Recordings that are reprocessed set it from their timestamps.
+        self.received = None
+        self.encoders = {}  # player id -> fumen.FumenEncoder
+        # player id -> (bytearray of every board's cells, [comment]), when exporting
+        self.frames = {}
+        self.last_boards = {}  # player id -> Board, when deduplicating frames
+
+    def start_game(self):
+        """Start a new game."""
+        self.game_started = True
+        self.game_id = next(GAME_IDS)
+        self.start_time = self.now()
+
+    def now(self):
+        """Return the time.time() the packet being parsed was received."""
+        return time.time() if self.received is None else self.received
+
+    def end_game(self):
+        """Forget the game in progress."""
+        self.game_started = False
+        self.encoders = {}
+        self.frames = {}
+        self.last_boards = {}
+        self.stats.reset()
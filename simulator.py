@@ -0,0 +1,214 @@
+"""Simulate many Tetris Friends clients, to load test the proxy.
+
+Each simulated client connects, logs in and joins a room the way the game does, then
+receives the games that fakeserver.py plays in its room while sending pieces and
+snapshots of its own board. Every livePiece packet from the server is timed, so running
+the same simulation straight against the server and through the proxy shows how much
+latency the proxy adds. eg.
+
+    py ./fakeserver.py --port 9340
+    py ./proxy.py --engine async --server-host 127.0.0.1 --server-port 9340
+    py ./simulator.py --clients 50 --duration 30
+
+Latencies are only meaningful when the clients and the server run on the same machine,
+since they are measured with time.perf_counter().
+
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import Counter
+
+from fakeserver import NULL_BYTE, SimulatedPlayer
+from framing import PacketFramer
+
+VER_CHK = b"<msg t='sys'><body action='verChk' r='0'><ver v='165' /></body></msg>"
+LOGIN = (
+    b"<msg t='sys'><body action='login' r='0'><login z='TetrisFriends'>"
+    b"<nick><![CDATA[simulator]]></nick><pword><![CDATA[]]></pword></login>"
+    b"</body></msg>"
+)
+JOIN_ROOM = (
+    b"<msg t='sys'><body action='joinRoom' r='-1'><room id='-1' pwd='' spec='0' "
+    b"leave='0' old='-1' /></body></msg>"
+)
+
+
+class SimulationReport:
+    """Packets received and livePiece latencies, for every client in a simulation."""
+
+    def __init__(self):
+        """Initialize an empty report."""
+        self.commands = Counter()  # command or sys action -> packets received
+        self.bytes = 0
+        self.sent = 0
+        self.latencies = []  # seconds from a livePiece being sent to it being received
+        self.connected = 0
+        self.failed = 0
+        self.elapsed = 0.0
+
+    @property
+    def packets(self):
+        """Return the number of packets received."""
+        return sum(self.commands.values())
+
+    def percentile(self, q):
+        """Return the q quantile of the latencies, or NaN if there are none."""
+        if not self.latencies:
+            return float("nan")
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+
+    def print(self):
+        """Print throughput and latency percentiles."""
+        elapsed = self.elapsed or float("nan")
+        print(f"{self.connected} clients connected, {self.failed} failed")
+        print(f"  received:       {self.packets:,} packets, {self.bytes:,} bytes")
+        print(f"  packets/sec:    {self.packets / elapsed:,.0f}")
+        print(f"  sent:           {self.sent:,} packets")
+        print(f"  by command:     {dict(self.commands.most_common())}")
+        if self.latencies:
+            print(f"  latency median: {statistics.median(self.latencies) * 1000:.3f}ms")
+            print(f"  latency p99:    {self.percentile(0.99) * 1000:.3f}ms")
+            print(f"  latency max:    {max(self.latencies) * 1000:.3f}ms")
+
+
+class SimulatedClient:
+    """A single game client."""
+
+    def __init__(self, client_id, report, rate=2.0):
+        """Initialize the client.
+
+        :param report: SimulationReport to count received packets in
+        :param rate:   Pieces/sec the client places itself, 0 to only watch
+
+        """
+        self.client_id = client_id
+        self.report = report
+        self.rate = rate
+        self.player = SimulatedPlayer(client_id, random.Random(client_id))
+
+    async def run(self, host, port, duration):
+        """Connect, join a room and play for duration seconds."""
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            self.report.failed += 1
+            return
+        self.report.connected += 1
+        # the game asks for the policy file, then checks its version and logs in
+        writer.write(b"<policy-file-request/>" + NULL_BYTE)
+        for packet in (VER_CHK, LOGIN, JOIN_ROOM):
+            writer.write(packet + NULL_BYTE)
+        self.report.sent += 4
+        end = time.perf_counter() + duration
+        sending = asyncio.create_task(self.send_moves(writer, end))
+        try:
+            await asyncio.wait_for(self.receive(reader), max(0.0, duration))
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            sending.cancel()
+            writer.close()
+
+    async def receive(self, reader):
+        """Count and time packets from the server until it disconnects."""
+        report = self.report
+        framer = PacketFramer()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            received = time.perf_counter()
+            report.bytes += len(data)
+            framer.feed(data)
+            for packet in framer.frames():
+                report.commands[command(packet)] += 1
+                if packet[:14] == b"%xt%livePiece%":
+                    sent = float(bytes(packet).split(b"%")[5])
+                    report.latencies.append(received - sent)
+
+    async def send_moves(self, writer, end):
+        """Place pieces and send snapshots of the client's board, like a player."""
+        if not self.rate:
+            return
+        while time.perf_counter() < end:
+            await asyncio.sleep(1 / self.rate)
+            self.player.place_piece()
+            writer.write(
+                f"%xt%livePiece%-1%{self.client_id}%{time.perf_counter():.6f}%".encode()
+                + NULL_BYTE
+                + f"%xt%snapShot%-1%{self.client_id}%{self.player.snapshot()}%".encode()
+                + NULL_BYTE
+            )
+            self.report.sent += 2
+            await writer.drain()
+
+
+def command(packet):
+    """Return the xt command or sys action of a packet, for counting packets."""
+    packet = bytes(packet[:64])
+    if packet.startswith(b"%xt%"):
+        return packet.split(b"%")[2].decode()
+    start = packet.find(b"action='")
+    if start >= 0:
+        start += len(b"action='")
+        return packet[start : packet.find(b"'", start)].decode()
+    return packet[1 : packet.find(b">")].decode() or "other"
+
+
+class Simulation:
+    """Many clients playing at once, connecting a few milliseconds apart."""
+
+    def __init__(self, host, port, clients=10, duration=10.0, rate=2.0, ramp=0.005):
+        """Initialize the simulation.
+
+        :param clients:  Number of clients
+        :param duration: Seconds that every client stays connected
+        :param rate:     Pieces/sec each client places itself
+        :param ramp:     Seconds between clients connecting
+
+        """
+        self.host = host
+        self.port = port
+        self.clients = clients
+        self.duration = duration
+        self.rate = rate
+        self.ramp = ramp
+
+    async def run(self):
+        """Run every client, returns a SimulationReport."""
+        report = SimulationReport()
+
+        async def start_client(i):
+            await asyncio.sleep(i * self.ramp)
+            client = SimulatedClient(i + 1, report, self.rate)
+            await client.run(self.host, self.port, self.duration)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(start_client(i) for i in range(self.clients)))
+        report.elapsed = time.perf_counter() - start
+        return report
+
+
+def main():
+    """Run a simulation and print a report."""
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=9339)
+    arg_parser.add_argument("--clients", type=int, default=10)
+    arg_parser.add_argument("--duration", type=float, default=10.0, metavar="SECONDS")
+    arg_parser.add_argument(
+        "--rate", type=float, default=2.0, help="pieces/sec placed by every client"
+    )
+    args = arg_parser.parse_args()
+    simulation = Simulation(
+        args.host, args.port, args.clients, args.duration, args.rate
+    )
+    asyncio.run(simulation.run()).print()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,43 +2,107 @@
 
 import base64
 import zlib
+from collections import namedtuple
+from functools import lru_cache
+
+from board import Board
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 FIELD_HEIGHT = 20
 FIELD_WIDTH = 10
+FIELD_CELLS = FIELD_HEIGHT * FIELD_WIDTH
+# number of decoded snapshots to keep, players often send the same snapshot repeatedly
+CACHE_SIZE = 4096
+
+# each cell is one byte, the high nibble is the mino id and the low nibble is flags
+# mino ids above 8 are special cases for hurry up lines I think, use normal garbage
+MINO_TABLE = bytes(min(byte >> 4, 8) for byte in range(256))
+FLAG_TABLE = bytes(byte & 0xF for byte in range(256))
+
+Snapshot = namedtuple("Snapshot", ["incoming_lines", "minos", "flags"])
+Snapshot.__doc__ = """A decoded snapshot.
+
+minos and flags are 200 byte bytes objects, one byte per cell, in row major order from
+the bottom of the field.
+
+"""
+
+
+def inflate(snapshot):
+    """Return the raw bytes of a snapshot, a header byte followed by the cells."""
+    buffer = zlib.decompress(base64.b64decode(snapshot))
+    if len(buffer) <= FIELD_CELLS:
+        raise ValueError("Snapshot is too short.")
+    return buffer
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def read_snapshot(snapshot):
+    """Decode a TF snapshot object, keeping all of the data in it.
+
+    Results are cached by the snapshot string, read_snapshot.cache_info() reports cache
+    hits and misses.
+
+    :param snapshot: Snapshot in string form. This is base64 encoded and compressed with
+                     zlib.
+    :returns:        A Snapshot of the incoming lines header, minos and cell flags.
+
+    """
+    buffer = inflate(snapshot)
+    cells = buffer[1 : FIELD_CELLS + 1]
+    return Snapshot(
+        buffer[0], cells.translate(MINO_TABLE), cells.translate(FLAG_TABLE)
+    )
 
 
 def decode_snapshot(snapshot):
-    """Decode a TF snapshot object into a multidimensional list.
+    """Decode a TF snapshot object into a Board.
 
     :param snapshot: Snapshot in string form. This is base64 encoded and compressed with
                      zlib.
-    :returns:        The decoded matrix in list form. Each row is a list of colors for
-                     that cell.
+    :returns:        The decoded matrix as a Board. Each row is a view of the colors for
+                     the cells in that row, starting with the bottom row.
 
     """
-    buffer = zlib.decompress(base64.b64decode(snapshot))
-    # print(f"buffer size: {len(buffer)}")
-    incoming_lines = buffer[0]
-    # print(f"{incoming_lines} incoming lines")
-    pos = 1  # position in the buffer
-    field = []
-    for row in range(FIELD_HEIGHT):
-        field_row = []
-        for col in range(FIELD_WIDTH):
-            byte = buffer[pos]
-            mino_id = byte >> 4
-            flags = byte & 0xF
-            # special case for hurry up lines I think
-            # print(f"SetMino mino: {mino_id}, flags: {flags}, x: {col}, y: {row}")
-            if mino_id > 8:
-                mino_id = 8  # use normal garbage mino for hurry up
-            field_row.append(mino_id)
-            pos += 1
-        field.append(field_row)
-    # print(field)
-    # print("remaining buffer", len(buffer[pos:]), buffer[pos:])
-    # comment = "{:d} lines incoming".format(incoming_lines)
-    return field
+    return Board(read_snapshot(snapshot).minos)
+
+
+def decode_snapshots(batch):
+    """Decode many TF snapshot objects at once.
+
+    :param batch: Iterable of snapshots in string form.
+    :returns:     A Snapshot where incoming_lines has shape (n,), minos and flags have
+                  shape (n, 20, 10). These are uint8 NumPy arrays if NumPy is
+                  installed, otherwise memoryviews of contiguous bytes.
+
+    """
+    headers = bytearray()
+    cells = bytearray()
+    for snapshot in batch:
+        buffer = inflate(snapshot)
+        headers.append(buffer[0])
+        cells += buffer[1 : FIELD_CELLS + 1]
+    shape = (len(headers), FIELD_HEIGHT, FIELD_WIDTH)
+
+    if numpy is not None:
+        raw = numpy.frombuffer(cells, dtype=numpy.uint8).reshape(shape)
+        return Snapshot(
+            numpy.frombuffer(headers, dtype=numpy.uint8),
+            numpy.minimum(raw >> 4, 8),
+            raw & 0xF,
+        )
+    if not headers:
+        # memoryview can't cast to a shape with a zero dimension
+        return Snapshot(memoryview(b""), memoryview(b""), memoryview(b""))
+    return Snapshot(
+        memoryview(headers),
+        memoryview(cells.translate(MINO_TABLE)).cast("B", shape),
+        memoryview(cells.translate(FLAG_TABLE)).cast("B", shape),
+    )
 
 
 if __name__ == "__main__":
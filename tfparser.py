@@ -1,167 +1,256 @@
 """Parse Tetris Friends network packets."""
 
 # import binascii
+import re
 import time
 from xml.etree import ElementTree
-from collections import defaultdict
 
 import fumen
-from snapshot import decode_snapshot
+import log
+from dispatch import PASS, SYS, XT, on_xt
+from snapshot import decode_snapshot, read_snapshot
 
 IGNORED_TAGS = ["policy-file-request", "cross-domain-policy"]
 IGNORED_SYS_ACTS = ["verChk", "apiOK", "login", "autoJoin"]
+# matches the start of a sys message up to the end of the body tag, eg.
+# <msg t='sys'><body action='uCount' r='1'>
+SYS_PREFIX = re.compile(r"<msg t=(['\"])sys\1>\s*<body\b([^>]*?)/?>")
+ATTRIB = re.compile(r"(\w+)=(['\"])(.*?)\2")
+FRAME_LOG_SAMPLE = 10  # log one in this many frames, at the debug level
 
 
-def parse(packet_data, origin, persistent_data):
+def parse(packet_data, origin, session):
     """Parse data received in a packet.
 
-    :param packet_data:     A bytes object representing the data received
-    :param origin:          String representing origin of the packet, eg. "server"
-    :param persistent_data: Dict used to persist data when module is reloaded
+    :param packet_data: A bytes-like object representing the data received
+    :param origin:      String representing origin of the packet, eg. "server"
+    :param session:     The session.Session the packet was received on
+    :returns:           The verdict on the packet, see dispatch.py
 
     """
-    # decode packet data into string
-    msg = packet_data.decode()
+    # decode packet data into string, str() also accepts memoryviews from the framer
+    msg = str(packet_data, "utf-8")
 
     # there are two types of packets, simple ones in this format:
     # %xt%arg%arg%
     if msg[0] == "%":
-        percent_handler(msg.strip("%").split("%"), origin, persistent_data)
-        return
+        return percent_handler(msg.strip("%").split("%"), origin, session)
+
+    # and these more complicated ones that are XML, most of them are sys messages that
+    # can be routed from their prefix, without parsing the whole message
+    prefix = SYS_PREFIX.match(msg)
+    if prefix is not None and "&" not in prefix[2]:
+        attrib = {name: value for name, _, value in ATTRIB.findall(prefix[2])}
+        if "action" in attrib:
+            return sys_handler(LazyBody(msg, attrib), origin, session)
 
-    # and these more complicated ones that are XML
     parser = ElementTree.XMLParser(encoding="utf-8")
     elem = ElementTree.fromstring(msg, parser=parser)
     if elem.tag == "msg" and elem.attrib["t"] == "sys":
         body = elem[0]
-        sys_handler(origin, body)
+        return sys_handler(body, origin, session)
     elif elem.tag == "msg" and elem.attrib["t"] == "xt":
         # ignore these for now, probably use something like xthandler
         pass
     elif elem.tag in IGNORED_TAGS:
         pass
     else:
-        print(f"unknown tag from {origin}:")
-        print_elem(elem, max_depth=2)
-
-
-def percent_handler(msg, origin, persistent_data):
-    """Handle packets that start with a percent."""
-    # fields object is defaultdict, passed in, used to persist frames
-    if msg[0] == "xt":
-        if msg[1] == "livePiece":
-            # player placing a piece
-            pass
-        elif msg[1] == "snapShot":
-            if not persistent_data["game_started"]:
-                persistent_data["game_started"] = True
-                persistent_data["start_time"] = time.perf_counter()
-            try:
-                room_id, player_id, snapshot = msg[2:]
-                timestamp = time.perf_counter() - persistent_data["start_time"]
-                comment = time.strftime("%M:%S", time.gmtime(timestamp))
-                print(f"added frame for player {player_id} at {comment}")
-                # create list of fumen frames to generate
-                persistent_data["fields"][player_id].append(
-                    (decode_snapshot(snapshot), comment)
-                )
-            except Exception as exception:
-                # print(msg[2:])
-                print("snapshot exception", exception)
-        elif msg[1] == "results":
-            # only output once
-            if persistent_data["game_started"]:
-                print("game ended")
-                persistent_data["game_started"] = False
-
-                for player, frames in persistent_data["fields"].items():
-                    print("encoding fumen for player", player)
-                    print(player, fumen.encode(frames))
-
-                persistent_data["fields"] = defaultdict(list)  # reset fields
-            # game end -- output fumens
-        elif msg[1] == "resultsDone":
-            # game start
-            pass
-        elif msg[1] == "TetrisLive":
-            # also a results done
-            pass
-        elif msg[1] == "topOut":
-            # player got topped out
-            pass
-        elif msg[1] == "zoneUserCount":
-            # server telling us how many users are online
-            # eg. ['zoneUserCount', '1', '243', '', '467315657']
-            num_users = msg[3]
-            num_games = msg[5]
-            print(
-                f"Logged in successfully. "
-                f"{num_users} online, {num_games} games played."
+        xml = "\n".join(format_elem(elem, max_depth=2))
+        log.info("unknown_tag", origin=origin, xml="\n" + xml)
+    return PASS
+
+
+class LazyBody:
+    """Stand in for the body element of a sys message, parsed only when needed.
+
+    The attributes of the body tag are known up front, anything else (children, text,
+    find(), etc.) parses the full message first. Most sys messages are ignored by
+    their action alone, so they are never parsed.
+
+    """
+
+    tag = "body"
+
+    def __init__(self, msg, attrib):
+        """Initialize the body from the whole message and the body tag's attributes."""
+        self.msg = msg
+        self.attrib = attrib
+        self._elem = None
+
+    @property
+    def elem(self):
+        """Return the parsed body element."""
+        if self._elem is None:
+            self._elem = ElementTree.fromstring(self.msg)[0]
+        return self._elem
+
+    def __getattr__(self, name):
+        return getattr(self.elem, name)
+
+    def __getitem__(self, index):
+        return self.elem[index]
+
+    def __len__(self):
+        return len(self.elem)
+
+    def __iter__(self):
+        return iter(self.elem)
+
+
+def percent_handler(msg, origin, session):
+    """Route packets that start with a percent to their xt handlers."""
+    if msg[0] != "xt":
+        log.info("unknown_packet", origin=origin, msg=msg)
+        return PASS
+    verdict = XT.dispatch(msg[1], msg, origin, session)
+    if verdict is None:
+        log.info("unknown_xt", origin=origin, msg=msg[1:])
+        return PASS
+    return verdict
+
+
+def sys_handler(body, origin, session):
+    """Route msg tags where t= sys to their handlers, as defined in SysHandler.as."""
+    verdict = SYS.dispatch(body.attrib["action"], body, origin, session)
+    if verdict is None:
+        xml = "\n".join(format_elem(body, max_depth=2))
+        log.info("unknown_sys", origin=origin, xml="\n" + xml)
+        return PASS
+    return verdict
+
+
+@on_xt("snapShot")
+def snapshot_handler(msg, origin, session):
+    """Add the board from a snapshot to the player's fumen."""
+    if not session.game_started:
+        session.start_game()
+    try:
+        room_id, player_id, snapshot = msg[2:]
+        timestamp = session.now() - session.start_time
+        comment = time.strftime("%M:%S", time.gmtime(timestamp))
+        log.debug(
+            "frame_added",
+            sample=FRAME_LOG_SAMPLE,
+            session=session.session_id,
+            player=player_id,
+            at=comment,
+        )
+        board = decode_snapshot(snapshot)
+        incoming_lines = read_snapshot(snapshot).incoming_lines  # cached, so cheap
+        if session.recorder is not None:
+            session.recorder.write_board(
+                session.session_id,
+                session.game_id,
+                int(player_id),
+                board,
+                incoming_lines,
             )
+        session.stats.snapshot(
+            room_id, player_id, board, incoming_lines, session.now()
+        )
+        if session.dedup_frames:
+            if board == session.last_boards.get(player_id):
+                board = None  # tells the encoder to repeat the last field
+            else:
+                session.last_boards[player_id] = board
+        if session.exporter is not None:
+            # the exporter encodes the whole game at once, in another process, so keep
+            # the boards in a form that is quick to send it
+            frames = session.frames.get(player_id)
+            if frames is None:
+                frames = session.frames[player_id] = (bytearray(), [])
+            cells, comments = frames
+            if board is None:
+                # unchanged, so repeat the last board, the exporter encodes it as such
+                board = session.last_boards[player_id]
+            cells.extend(board.cells)
+            comments.append(comment)
+            return
+        # encode fumen frames as they arrive, so there's nothing left to do at the end
+        encoders = session.encoders
+        if player_id not in encoders:
+            encoders[player_id] = fumen.FumenEncoder()
+        encoders[player_id].add_frame(board, comment)
+    except Exception as exception:
+        log.error("snapshot_error", msg=msg[2:], error=repr(exception))
+
+
+@on_xt("results")
+def results_handler(msg, origin, session):
+    """Output the fumens for every player when a game ends."""
+    # only output once
+    if session.game_started:
+        players = len(session.frames or session.encoders)
+        log.info("game_ended", session=session.session_id, players=players)
+        if session.exporter is not None:
+            # encode the fumens in the exporter's processes, so forwarding carries on
+            session.exporter.export(session.session_id, session.game_id, session.frames)
         else:
-            # % packet is implied by square brackets
-            print(f"{origin}:", msg[1:])
-    else:
-        print(f"unknown % packet from {origin}", msg)
+            for player, encoder in session.encoders.items():
+                log.info("fumen", player=player, fumen=encoder.finish())
+        for player, summary in session.stats.summary(session.now()).items():
+            log.info("player_stats", player=player, **summary)
+        session.end_game()
 
 
-def sys_handler(origin, body):
-    """Parse msg tags where t= sys. Handlers are defined in SysHandler.as."""
-    action = body.attrib["action"]
-    if action == "uCount":
-        # handleUserCountChange
-        pass
-        # room = body.attrib["r"]
-        # users = body.attrib["u"]
-        # # not defined for room 1, probably count in your rank?
-        # spectators = body.attrib["s"] if "s" in body.attrib else None
-        # print(
-        #   f"== UserCountChange - Room: {room}, Users: {users}, "
-        #  "Spectators: {spectators} =="
-        # )
-    elif action == "uER":
-        # handleUserEnterRoom
-        # print("UserEnterRoom")
-        # printElem(body)
-        # possible to set moderator?
-        pass
-    elif action == "uVarsUpdate":
-        # handleUserVarsUpdate
-        pass
-    elif action == "roomAdd":
-        # handleRoomAdded
-        # some potentially interesting things here?
-        pass
-    elif action == "roomDel":
-        # handleRoomDeleted
-        pass
-    elif action == "rmList":
-        # server sends list of all the rooms
-        pass
-    elif action == "joinOK":
-        # looks like list of all users in each room?
-        pass
-    elif action == "setUvars":
-        # sending info about myself, could be interesting
-        pass
-    elif action in IGNORED_SYS_ACTS:
-        pass
-    else:
-        # sys packet is implied by curly brackets
-        print(f"{origin}:")
-        print_elem(body, max_depth=2)
+@on_xt("livePiece")
+def live_piece_handler(msg, origin, session):
+    """Count a piece placed by a player, for live stats."""
+    # eg. ['livePiece', room id, player id, ...]
+    if len(msg) > 3:
+        session.stats.piece(msg[3], session.now())
+
+
+@on_xt("topOut")
+def top_out_handler(msg, origin, session):
+    """Mark a player as topped out, for live stats."""
+    if len(msg) > 3:
+        session.stats.top_out(msg[3])
+
 
+@on_xt("zoneUserCount")
+def zone_user_count_handler(msg, origin, session):
+    """Report the number of users online after logging in."""
+    # server telling us how many users are online
+    # eg. ['zoneUserCount', '1', '243', '', '467315657']
+    num_users = msg[3]
+    num_games = msg[5]
+    log.info("logged_in", users_online=num_users, games_played=num_games)
 
-def print_elem(elem, depth=0, max_depth=10, max_children=3):
-    """Recursively print out an XML tree for debugging."""
-    padding = "".join(" " * depth)
-    print(padding, "<" + elem.tag + ">", "attrib:", elem.attrib, "text:", elem.text)
+
+XT.ignore(
+    "resultsDone",  # game start
+    "TetrisLive",  # also a results done
+)
+SYS.ignore(
+    "uCount",  # handleUserCountChange, attribs r: room, u: users, s: spectators
+    "uER",  # handleUserEnterRoom, possible to set moderator?
+    "uVarsUpdate",  # handleUserVarsUpdate
+    "roomAdd",  # handleRoomAdded, some potentially interesting things here?
+    "roomDel",  # handleRoomDeleted
+    "rmList",  # server sends list of all the rooms
+    "joinOK",  # looks like list of all users in each room?
+    "setUvars",  # sending info about myself, could be interesting
+    *IGNORED_SYS_ACTS,
+)
+
+
+def format_elem(elem, depth=0, max_depth=10, max_children=3):
+    """Recursively format an XML tree for debugging, returns a list of lines."""
+    padding = " " * depth
+    lines = [f"{padding} <{elem.tag}> attrib: {elem.attrib} text: {elem.text}"]
     for child in elem[:max_children]:
         if depth >= max_depth:
-            print(padding + "  …")
+            lines.append(padding + "  …")
             break
         else:
-            print_elem(child, depth=depth + 1, max_depth=max_depth)
+            lines += format_elem(child, depth=depth + 1, max_depth=max_depth)
     hidden_children = len(elem[max_children:])
     if hidden_children:
-        print(padding, f" … {hidden_children} more children hidden")
+        lines.append(f"{padding}  … {hidden_children} more children hidden")
+    return lines
+
+
+# stop calling handlers that were removed from this module before it was reloaded
+XT.prune(__name__, globals())
+SYS.prune(__name__, globals())
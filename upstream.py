@@ -0,0 +1,183 @@
+"""Keep connections to the game server open, ready for the next client.
+
+Connecting to the server takes a round trip, which every client used to wait for before
+any of its packets could be forwarded. An UpstreamPool connects ahead of time from a
+background thread, so a client that connects is bridged to an open connection straight
+away, eg.
+
+    pool = UpstreamPool(TF_SERVER, TF_PORT, size=2)
+    pool.start()
+    server = pool.get()  # a connected socket
+
+The server never sends anything before the client does, so an idle connection that
+becomes readable has been closed (or is in a state we know nothing about), and is
+thrown away rather than handed to a client. Idle connections are also replaced after
+max_idle seconds, in case the server or something in between drops them silently.
+
+"""
+import socket
+import time
+from collections import deque
+from threading import Event, Lock, Thread
+
+import log
+
+
+def tune_socket(sock, buffer_size=None):
+    """Send small packets straight away, and optionally set the socket's buffer sizes.
+
+    :param buffer_size: Bytes for the send and receive buffers, None leaves the OS to
+                        size them, which it does well unless memory is tight
+
+    """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if buffer_size:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+
+
+def is_healthy(sock):
+    """Return whether an idle connection is open, and nothing has arrived on it."""
+    # peek without blocking, unlike select() this works for any file descriptor
+    sock.setblocking(False)
+    try:
+        sock.recv(1, socket.MSG_PEEK)
+    except BlockingIOError:
+        return True  # nothing to read, so still open
+    except OSError:
+        return False  # reset, or already closed
+    finally:
+        if sock.fileno() != -1:
+            sock.setblocking(True)
+    return False  # closed by the server, or it sent something unexpected
+
+
+class UpstreamPool:
+    """Connections to the server, opened in advance by a background thread."""
+
+    def __init__(
+        self, host, port, size=2, buffer_size=None, max_idle=60.0, interval=1.0
+    ):
+        """Initialize the pool, no connections are made until start() is called.
+
+        :param size:        Number of idle connections to keep open, 0 to always
+                            connect when a client connects
+        :param buffer_size: Socket buffer size, see tune_socket()
+        :param max_idle:    Seconds before an idle connection is replaced
+        :param interval:    Seconds between health checks, and between attempts to
+                            connect after connecting fails
+
+        """
+        self.host = host
+        self.port = port
+        self.size = size
+        self.buffer_size = buffer_size
+        self.max_idle = max_idle
+        self.interval = interval
+        self.idle = deque()  # (perf_counter() when connected, socket), oldest first
+        self.lock = Lock()  # protects idle and the counters
+        self.wake = Event()  # set when a connection is taken, to replace it
+        self.thread = None
+        self.closed = False
+        self.hits = 0  # clients given an idle connection
+        self.misses = 0  # clients that had to wait to connect
+        self.discarded = 0  # idle connections that failed a health check or expired
+        self.failures = 0  # attempts to connect that failed
+
+    def start(self):
+        """Start filling the pool from a background thread."""
+        if self.size and self.thread is None:
+            self.thread = Thread(target=self.fill, daemon=True)
+            self.thread.start()
+
+    def connect(self):
+        """Return a new connection to the server, blocking until it is connected."""
+        sock = socket.create_connection((self.host, self.port))
+        tune_socket(sock, self.buffer_size)
+        return sock
+
+    def take(self):
+        """Return a healthy idle connection, or None if there isn't one."""
+        while True:
+            with self.lock:
+                if not self.idle:
+                    self.misses += 1
+                    self.wake.set()
+                    return None
+                _, sock = self.idle.popleft()
+            if is_healthy(sock):
+                with self.lock:
+                    self.hits += 1
+                self.wake.set()
+                return sock
+            self.discard(sock)
+
+    def get(self):
+        """Return a connection to the server, connecting now if the pool is empty."""
+        sock = self.take()
+        if sock is None:
+            sock = self.connect()
+        return sock
+
+    def discard(self, sock):
+        """Close a connection that won't be used."""
+        with self.lock:
+            self.discarded += 1
+        sock.close()
+
+    def check(self):
+        """Close idle connections that are unhealthy or have been idle too long."""
+        expired = time.perf_counter() - self.max_idle
+        with self.lock:
+            idle = list(self.idle)
+            self.idle.clear()
+        keep = []
+        for connected, sock in idle:
+            if connected > expired and is_healthy(sock):
+                keep.append((connected, sock))
+            else:
+                self.discard(sock)
+        with self.lock:
+            # connections returned by fill() while checking are newer, so go last
+            self.idle.extendleft(reversed(keep))
+
+    def close(self):
+        """Stop filling the pool, and close every idle connection."""
+        self.closed = True
+        self.wake.set()
+        with self.lock:
+            idle = list(self.idle)
+            self.idle.clear()
+        for _, sock in idle:
+            sock.close()
+
+    def fill(self):
+        """Keep size connections open, run on the pool's thread."""
+        while not self.closed:
+            self.check()
+            while len(self.idle) < self.size and not self.closed:
+                try:
+                    sock = self.connect()
+                except OSError as exception:
+                    with self.lock:
+                        self.failures += 1
+                    log.warning("upstream_connect_failed", error=repr(exception))
+                    break  # try again after the next health check
+                with self.lock:
+                    self.idle.append((time.perf_counter(), sock))
+            if self.closed:
+                self.close()  # close anything connected while closing
+                break
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def stats(self):
+        """Return a dict of counters for monitoring the pool."""
+        with self.lock:
+            return {
+                "idle": len(self.idle),
+                "hits": self.hits,
+                "misses": self.misses,
+                "discarded": self.discarded,
+                "failures": self.failures,
+            }